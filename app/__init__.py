@@ -1,6 +1,9 @@
 from aiohttp import web
 
+from app.api.helpers.services import AsyncRedisService, RedisService
+
 from flask import Flask
+
 from flask_alembic import Alembic
 
 from flask_cors import CORS
@@ -9,7 +12,6 @@ from flask_marshmallow import Marshmallow
 
 from flask_sqlalchemy import SQLAlchemy
 
-from app.api.helpers.services import RedisService
 from settings import ACCESS_CONTROL_ALLOW_CREDENTIALS
 
 
@@ -34,6 +36,7 @@ CORS(app, resources={r"/api/*": {"origins": "*"}},
 
 # Redis service
 redis_service = RedisService()
+async_redis_service = AsyncRedisService()
 
 # Events
 from app.api.events import *  # noqa: E402, I100, E501, I202, F401
@@ -41,6 +44,8 @@ from app.api.events import *  # noqa: E402, I100, E501, I202, F401
 # Routing
 from app.api.videos.views import bp as bp__videos  # noqa: E402, I100, E501, I202
 app.register_blueprint(bp__videos)
+from app.api.metrics.views import bp as bp__metrics  # noqa: E402, I100, E501, I202
+app.register_blueprint(bp__metrics)
 
 
 # Adding swagger
@@ -1,4 +1,5 @@
 after_video_upload_views_funcs = []
+after_video_upload_async_views_funcs = []
 
 
 def after_video_upload_views(func):
@@ -17,16 +18,53 @@ def after_video_upload_views(func):
         return func
 
 
-def process_after_video_upload_views(file_id, filepath):
+def process_after_video_upload_views(file_id, filepath, params=None):
     """
     Actions after video has been uploaded.
     Args:
         file_id (str): file id
         filepath (dict): filepath
+        params (dict | None): recognition params
 
     Returns:
-        None:
+        list: results of functions
     """
-    for func in after_video_upload_views_funcs:
-        if callable(func):
-            func(file_id, filepath)
+    return [
+        func(file_id, filepath, params)
+        for func in after_video_upload_views_funcs if callable(func)
+    ]
+
+
+def after_video_upload_async_views(func):
+    """Decorator that registers coroutine function like event.
+    Coroutine functions are awaited by asyncio consumers instead of
+    functions registered by after_video_upload_views.
+
+    Args:
+        func (collections.abc.Callable): Registered coroutine function.
+
+    Returns:
+        collections.abc.Callable: Initial function without changes.
+
+    """
+    if callable(func):
+        after_video_upload_async_views_funcs.append(func)
+        return func
+
+
+async def process_after_video_upload_views_async(
+        file_id, filepath, params=None):
+    """
+    Actions after video has been uploaded, awaited on event loop.
+    Args:
+        file_id (str): file id
+        filepath (dict): filepath
+        params (dict | None): recognition params
+
+    Returns:
+        list: results of coroutine functions
+    """
+    return [
+        await func(file_id, filepath, params)
+        for func in after_video_upload_async_views_funcs if callable(func)
+    ]
@@ -2,23 +2,43 @@ import os
 
 import boto3
 
-from libs.transport.publisher.kafka_publisher import KafkaPublisher
+from libs.transport.publisher.kafka_publisher import publisher
 
 from werkzeug.datastructures import FileStorage  # noqa: F401
 
 
 def send_kafka_message(topic, message):
     """
-    Sends message to kafka service.
+    Sends message to kafka service with shared producer, doesn't wait
+    for delivery.
     Args:
         topic (str): kafka topic
         message (dict): message with information about file.
 
     Returns:
-        None:
+        kafka.producer.future.FutureRecordMetadata: delivery future
+
+    Raises:
+        KafkaTimeoutError: producer send buffer is full
+    """
+    return publisher.send_message(topic, **message)
+
+
+async def send_kafka_message_async(topic, message):
+    """
+    Sends message to kafka service with shared producer and waits
+    for delivery without blocking event loop.
+    Args:
+        topic (str): kafka topic
+        message (dict): message with information about file.
+
+    Returns:
+        kafka.producer.future.RecordMetadata: delivered message
+
+    Raises:
+        KafkaError: message hasn't been delivered
     """
-    publisher = KafkaPublisher()
-    publisher.send_message(topic, **message)
+    return await publisher.send_message_async(topic, **message)
 
 
 def upload_file_to_s3(filepath, bucket, filename):
@@ -1,11 +1,12 @@
 import json
 import logging
 
-import redis
-
 import numpy as np
 
-from settings import REDIS_HOST, REDIS_PORT, REDIS_DB
+import redis
+from redis import asyncio as aioredis
+
+from settings import REDIS_DB, REDIS_HOST, REDIS_PORT
 
 
 class RedisService:
@@ -50,3 +51,205 @@ class RedisService:
                         load[i] = np.array(load[i])
             return load
         return None
+
+    def update_fields(self, key, fields, expected=None):
+        """
+        Atomically updates some fields of data stored by key,
+        concurrent writers of the same key are retried.
+        Args:
+            key (str): redis key
+            fields (dict): fields to update
+            expected (dict | None): field to tuple of allowed values,
+                data is updated only if all fields have allowed values
+
+        Returns:
+            dict | None: updated data or None if there is no data
+                or it doesn't have expected values
+        """
+        def update(pipe):
+            data = pipe.get(key)
+            if not data:
+                return None
+            load = json.loads(data)
+            for name, values in (expected or {}).items():
+                if load.get(name) not in values:
+                    return None
+            load.update(fields)
+            pipe.multi()
+            pipe.set(key, json.dumps(load).encode("utf-8"))
+            return load
+
+        return self.redis.transaction(update, key, value_from_callable=True)
+
+    def write_checkpoint(self, key, data, lists):
+        """
+        Appends new items to checkpoint lists and replaces checkpoint
+        data in one transaction. Data gets lengths of lists, so readers
+        get consistent snapshot.
+        Args:
+            key (str): redis key
+            data (dict): checkpoint data, e.g. progress counters
+            lists (dict): list name to new items, bytes items are
+                stored as is, other items as json
+
+        Returns:
+            None:
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        for name, items in lists.items():
+            if items:
+                pipe.rpush(f"{key}:{name}", *[
+                    item if isinstance(item, bytes)
+                    else json.dumps(item).encode("utf-8")
+                    for item in items
+                ])
+        pipe.set(key, json.dumps(data).encode("utf-8"))
+        pipe.execute()
+
+    def get_checkpoint(self, key, names, binary=()):
+        """
+        Gets checkpoint data with its lists.
+        Args:
+            key (str): redis key
+            names (collections.abc.Iterable): names of checkpoint lists
+            binary (collections.abc.Container): names of lists with
+                bytes items, they are returned without decoding
+
+        Returns:
+            dict | None: data with lists or None
+        """
+        data = self.get(key, list_to_np_array=False)
+        if data is None:
+            return None
+
+        lengths = data.get("lengths", {})
+        for name in names:
+            length = lengths.get(name, 0)
+            items = self.redis.lrange(f"{key}:{name}", 0, length - 1) \
+                if length else []
+            data[name] = items if name in binary \
+                else [json.loads(item) for item in items]
+        return data
+
+    def delete_checkpoint(self, key, names):
+        """
+        Deletes checkpoint data with its lists.
+        Args:
+            key (str): redis key
+            names (collections.abc.Iterable): names of checkpoint lists
+
+        Returns:
+            None:
+        """
+        self.redis.delete(key, *[f"{key}:{name}" for name in names])
+
+    def publish_command(self, channel, command):
+        """
+        Stores command and publishes it to subscribers of channel,
+        subscribers started later read stored command.
+        Args:
+            channel (str): channel name, also key of the last command
+            command (str): command
+
+        Returns:
+            int: number of subscribers got command
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.set(channel, command)
+        pipe.publish(channel, command)
+        return pipe.execute()[1]
+
+    def subscribe(self, channel, handler):
+        """
+        Calls handler for every message of channel in background thread.
+        Args:
+            channel (str): channel name
+            handler (collections.abc.Callable): handler(message)
+
+        Returns:
+            redis.client.PubSubWorkerThread: thread, stop() unsubscribes
+        """
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: handler})
+        return pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+
+    def add_event(self, stream, fields, maxlen=100):
+        """
+        Appends event to stream, old events are trimmed.
+        Args:
+            stream (str): stream key
+            fields (dict): flat event fields
+            maxlen (int): approximate number of kept events
+
+        Returns:
+            bytes: event id
+        """
+        return self.redis.xadd(
+            stream, fields, maxlen=maxlen, approximate=True)
+
+    def last_event(self, stream):
+        """
+        Args:
+            stream (str): stream key
+
+        Returns:
+            tuple | None: event id and fields or None
+        """
+        events = self.redis.xrevrange(stream, count=1)
+        return events[0] if events else None
+
+    def read_events(self, streams, count=None, block=None):
+        """
+        Reads events of several streams after given ids.
+        Args:
+            streams (dict): stream key to last read event id
+            count (int | None): max events per stream
+            block (int | None): milliseconds to wait for new events
+
+        Returns:
+            list: [stream, [(event id, fields), ...]] per stream
+        """
+        return self.redis.xread(streams, count=count, block=block)
+
+    def claim(self, key, value, replace=False, ex=None):
+        """
+        Sets key if it doesn't exist.
+        Args:
+            key (str): redis key
+            value (str): value
+            replace (bool): overwrite existing value
+            ex (int | None): seconds to expire key, None keeps it
+
+        Returns:
+            str | None: existing value, None if key is set
+        """
+        if replace:
+            self.redis.set(key, value, ex=ex)
+            return None
+        while not self.redis.set(key, value, ex=ex, nx=True):
+            existing = self.redis.get(key)
+            # key could be deleted between set and get
+            if existing is not None:
+                return existing.decode("utf-8")
+        return None
+
+
+class AsyncRedisService:
+    """Service for using redis from event loop."""
+    def __init__(self, host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB):
+        """Gets instance of redis-python asyncio class."""
+        self.redis = aioredis.Redis(
+            host=host, port=port, db=db, password="mypassword")
+
+    async def update(self, key, data):
+        """
+        Update by name of hash and key-value.
+        Args:
+            key (str): redis key
+            data (dict): redis data
+
+        Returns:
+            None:
+        """
+        data_dump = json.dumps(data).encode("utf-8")
+        return await self.redis.set(key, data_dump)
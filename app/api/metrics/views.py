@@ -0,0 +1,60 @@
+import time
+
+from flask import Blueprint, Response, g, request
+
+from libs.metrics.histogram import registry
+from libs.metrics.server import CONTENT_TYPE
+
+bp = Blueprint("metrics", __name__)
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_seconds",
+    "Time spent in flask request handlers",
+    "endpoint"
+)
+
+
+@bp.before_app_request
+def start_timer():
+    """Remembers request start time."""
+    g.request_start = time.perf_counter()
+
+
+@bp.after_app_request
+def observe_request(response):
+    """
+    Observes request time by endpoint.
+    Args:
+        response (flask.Response): response
+
+    Returns:
+        flask.Response: the same response
+    """
+    start = g.pop("request_start", None)
+    if start is not None and request.endpoint != "metrics.metrics":
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start, request.endpoint or "unknown")
+    return response
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Metrics of process in prometheus text format.
+
+    Returns:
+        text response with histograms
+    ---
+    get:
+        summary: Prometheus metrics.
+        responses:
+            '200':
+                description: Success
+                content:
+                    text/plain:
+                        schema:
+                            type: string
+        tags:
+            - Metrics
+    """
+    return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -1,68 +1,351 @@
+import asyncio
+import hashlib
+import json
 import logging
 import os
 import uuid
 
-from sqlalchemy.exc import DatabaseError, DataError
+from app import after_video_upload_async_views, after_video_upload_views, \
+    async_redis_service, db, redis_service
+from app.api.helpers.helpers import send_kafka_message, \
+    send_kafka_message_async
+from app.api.videos.models import Video
+
+import cv2
+
+from libs.face_recognition import DetectorBackendEnum, \
+    FaceRecognitionStatusEnum
+from libs.face_recognition.detection import FaceDetector
+from libs.face_recognition.sampling import SamplingPolicy
+from libs.face_recognition.segments import get_segments, \
+    register_segments, register_segments_async, segment_key, \
+    segments_key, split_segments
+from libs.metrics.histogram import registry
+
+from settings import DETECT_BACKEND, FACE_RECOGNITION_TOPIC, \
+    SEGMENT_COUNT, UPLOAD_PENDING_TTL
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, DatabaseError
+
 from werkzeug.datastructures import FileStorage  # noqa: F401
 
-from app import after_video_upload_views, redis_service, db
-from app.api.helpers.helpers import send_kafka_message
-from app.api.videos.models import Video
-from libs.face_recognition import FaceRecognitionStatusEnum
-from settings import FACE_RECOGNITION_TOPIC
+
+UPLOADS = registry.counter(
+    "video_uploads_total",
+    "Uploaded videos by deduplication result, hit is a cached result",
+    "result"
+)
+_NOT_REUSABLE_STATUSES = (
+    FaceRecognitionStatusEnum.CANCEL,
+    FaceRecognitionStatusEnum.FAILED,
+)
+# statuses of redis state are stored as str(enum) or enum value
+_FINISHED_STATES = tuple(
+    form
+    for status in _NOT_REUSABLE_STATUSES + (FaceRecognitionStatusEnum.READY,)
+    for form in (str(status), status.value)
+)
 
 
-def form_kafka_message_to_upload(file_extension):
+def form_kafka_message_to_upload(file_extension, params=None):
     """
     Forms message to kafka with uuid and filepath of file.
     Args:
         file_extension (str): file extension string [example='mkv']
+        params (dict | None): recognition params
     Returns:
-        dict: dict with uuid and filepath
+        dict: dict with uuid, filepath and recognition params
     """
     file_id = str(uuid.uuid4())
     return {
         "file_id": file_id,
-        "filepath": f"/app/media/videos/{file_id}.{file_extension}"
+        "filepath": f"/app/media/videos/{file_id}.{file_extension}",
+        "params": params or {}
     }
 
 
-def save_file(file, filepath):
+def form_recognition_params(form):
+    """
+    Forms recognition params from upload form fields.
+    Args:
+        form (werkzeug.datastructures.MultiDict): request form
+
+    Returns:
+        dict: recognition params
+
+    Raises:
+        ValueError: invalid field value
+    """
+    params = {}
+    sampling_mode = form.get("sampling_mode")
+    if sampling_mode:
+        params["sampling"] = SamplingPolicy(
+            sampling_mode, form.get("sampling_value", 1)).to_dict()
+    motion_threshold = form.get("motion_threshold")
+    if motion_threshold:
+        params["motion"] = {"threshold": float(motion_threshold)}
+    detection = {}
+    detect_height = form.get("detect_height")
+    if detect_height:
+        detection["height"] = int(detect_height)
+    detect_backend = form.get("detect_backend")
+    if detect_backend:
+        detection["backend"] = DetectorBackendEnum(detect_backend).value
+    if detection:
+        # unconfigured backend (no cascade or model) raises ValueError
+        FaceDetector.from_dict(detection, backend=DETECT_BACKEND)
+        params["detection"] = detection
+    segments = form.get("segments")
+    if segments:
+        params["segments"] = int(segments)
+        if params["segments"] < 1:
+            raise ValueError("segments must be positive")
+    return params
+
+
+def save_file(file, filepath, chunk_size=1 << 20):
     """
-    Saves file locally.
+    Saves file locally, content is hashed while it's written.
     Args:
         file (FileStorage): file
         filepath (str): file path
+        chunk_size (int): bytes read at once
 
     Returns:
-        str: save path
+        tuple: save path and sha256 hex digest of content
     """
     save_path = os.path.join(os.getcwd(), filepath)
-    file.save(save_path)
-    return save_path
+    content_hash = hashlib.sha256()
+    with open(save_path, "wb") as destination:
+        while True:
+            chunk = file.stream.read(chunk_size)
+            if not chunk:
+                break
+            content_hash.update(chunk)
+            destination.write(chunk)
+    return save_path, content_hash.hexdigest()
 
 
-@after_video_upload_views
-def send_kafka_message_to_face_recognition(file_id, filepath):
+def upload_key(content_hash, params):
+    """
+    Forms key of upload index, same content recognized with same
+    params gives same result. Number of segments only splits the work,
+    so it isn't a part of the key.
+    Args:
+        content_hash (str): sha256 hex digest of file content
+        params (dict): recognition params
+
+    Returns:
+        str: redis key
+    """
+    params = {
+        name: value for name, value in params.items() if name != "segments"}
+    params_hash = hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"upload:{content_hash}:{params_hash}"
+
+
+def find_duplicate(key, file_id):
+    """
+    Gets id of video uploaded earlier with the same key, otherwise
+    registers file_id for the key. Canceled and failed videos
+    aren't reused. Key of a job without result expires after
+    UPLOAD_PENDING_TTL, so a lost job isn't reused forever.
+    Args:
+        key (str): upload key
+        file_id (str): id of new video
+
+    Returns:
+        str | None: id of existing video, None if file_id is registered
+    """
+    existing_id = redis_service.claim(key, file_id, ex=UPLOAD_PENDING_TTL)
+    if existing_id is None:
+        UPLOADS.inc("miss")
+        return None
+
+    video = Video.query.get(existing_id)
+    if video is not None:
+        reusable = video.status not in _NOT_REUSABLE_STATUSES
+        if reusable:
+            # the result is stored, the key doesn't expire anymore
+            redis_service.redis.persist(key)
+    else:
+        state = redis_service.get(existing_id, list_to_np_array=False)
+        if state:
+            # finished job without video row has lost its result
+            reusable = state.get("status") not in _FINISHED_STATES
+            if reusable:
+                redis_service.redis.expire(key, UPLOAD_PENDING_TTL)
+        else:
+            # the job waits in queue or is lost, then key expires
+            reusable = True
+    if not reusable:
+        redis_service.claim(key, file_id, replace=True, ex=UPLOAD_PENDING_TTL)
+        UPLOADS.inc("miss")
+        return None
+
+    UPLOADS.inc("hit")
+    return existing_id
+
+
+def forget_upload(key):
+    """
+    Removes key from upload index, e.g. when video hasn't been queued.
+    Args:
+        key (str): upload key
+
+    Returns:
+        None:
+    """
+    redis_service.redis.delete(key)
+
+
+def processing_exists(file_id):
+    """
+    Args:
+        file_id (str): file id
+
+    Returns:
+        bool: True if video has state of whole video or segments
+    """
+    return redis_service.redis.exists(file_id, segments_key(file_id)) > 0
+
+
+def resume_states(file_id):
     """
-    Starts video recognition process.
+    Switches paused states of video to resume. States are resumed only
+    after final checkpoint of paused job, which would overwrite resume
+    status and restart job from scratch. Segmented video is resumed
+    per segment.
     Args:
         file_id (str): file id
+
+    Returns:
+        list: resumed states
+    """
+    pause_status = FaceRecognitionStatusEnum.PAUSE
+    segments = get_segments(redis_service, file_id)
+    keys = [file_id] if segments is None else [
+        segment_key(file_id, segment["index"]) for segment in segments]
+    resumed = []
+    for key in keys:
+        data = redis_service.update_fields(
+            key,
+            {"status": str(FaceRecognitionStatusEnum.RESUME),
+             "stopped": False},
+            expected={
+                "status": (str(pause_status), pause_status.value),
+                "stopped": (True,),
+            }
+        )
+        if data is not None:
+            resumed.append(data)
+    return resumed
+
+
+def _recognition_segments(filepath, params):
+    """
+    Args:
         filepath (str): filepath
+        params (dict): recognition params
 
     Returns:
+        list: segment dicts, [None] if video isn't split
+    """
+    count = params.get("segments", SEGMENT_COUNT)
+    if count <= 1:
+        return [None]
+    video = cv2.VideoCapture(filepath)
+    frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    if frame_count <= 0:
+        return [None]
+    return split_segments(frame_count, count)
+
+
+def _recognition_messages(file_id, filepath, params, segments):
+    """
+    Args:
+        file_id (str): file id
+        filepath (str): filepath
+        params (dict): recognition params
+        segments (list): segment dicts or [None]
 
+    Returns:
+        list: recognition messages, one per segment
     """
-    send_kafka_message(
-        FACE_RECOGNITION_TOPIC,
-        {
+    messages = []
+    for segment in segments:
+        message = {
             "filepath": filepath,
-            "file_id": file_id
+            "file_id": file_id,
+            "params": params
         }
-    )
+        if segment is not None:
+            message["segment"] = segment
+        messages.append(message)
+    return messages
+
 
+@after_video_upload_views
+def send_kafka_message_to_face_recognition(file_id, filepath, params=None):
+    """
+    Starts video recognition process. Long videos can be split
+    into frame ranges, one message per range.
+    Args:
+        file_id (str): file id
+        filepath (str): filepath
+        params (dict | None): recognition params, e.g. sampling policy
 
-def create_video(file_id, data, status, frame, persons, filepath):
+    Returns:
+        list: delivery futures of sent messages
+    """
+    params = params or {}
+    segments = _recognition_segments(filepath, params)
+    if segments[0] is not None:
+        register_segments(redis_service, file_id, segments)
+    return [
+        send_kafka_message(FACE_RECOGNITION_TOPIC, message)
+        for message in _recognition_messages(
+            file_id, filepath, params, segments)
+    ]
+
+
+@after_video_upload_async_views
+async def send_kafka_message_to_face_recognition_async(
+        file_id, filepath, params=None):
+    """
+    Starts video recognition process from event loop and waits for
+    delivery of messages. Only segmented video is opened in a thread
+    to read its frame count.
+    Args:
+        file_id (str): file id
+        filepath (str): filepath
+        params (dict | None): recognition params, e.g. sampling policy
+
+    Returns:
+        list: metadata of delivered messages
+
+    Raises:
+        KafkaError: message hasn't been delivered
+    """
+    params = params or {}
+    segments = [None]
+    if params.get("segments", SEGMENT_COUNT) > 1:
+        segments = await asyncio.to_thread(
+            _recognition_segments, filepath, params)
+    if segments[0] is not None:
+        await register_segments_async(async_redis_service, file_id, segments)
+    return await asyncio.gather(*[
+        send_kafka_message_async(FACE_RECOGNITION_TOPIC, message)
+        for message in _recognition_messages(
+            file_id, filepath, params, segments)
+    ])
+
+
+def create_video(file_id, data, status, frame, persons, filepath,
+                 faces=None):
     try:
         video = Video(
             id=file_id,
@@ -70,11 +353,49 @@ def create_video(file_id, data, status, frame, persons, filepath):
             status=status,
             frame=frame,
             persons=persons,
-            filepath=filepath
+            filepath=filepath,
+            faces=faces
         )
         db.session.add(video)
         db.session.commit()
         return True
     except DatabaseError as e:
+        db.session.rollback()
         logging.error(f"Creation video in db failed: {e}")
         return False
+
+
+def create_videos(rows):
+    """
+    Creates several videos in one transaction, videos which already
+    exist, e.g. after redelivery of message, are kept. If transaction
+    fails, videos are created one by one.
+    Args:
+        rows (list): dicts with create_video arguments
+
+    Returns:
+        list: True for every video created or existing
+    """
+    try:
+        db.session.execute(
+            insert(Video).on_conflict_do_nothing(index_elements=["id"]),
+            [
+                {
+                    "id": row["file_id"],
+                    "data": row["data"],
+                    "status": row["status"],
+                    "frame": row["frame"],
+                    "persons": row["persons"],
+                    "filepath": row["filepath"],
+                    "faces": row.get("faces"),
+                }
+                for row in rows
+            ]
+        )
+        db.session.commit()
+        return [True] * len(rows)
+    except DatabaseError as e:
+        db.session.rollback()
+        logging.error(
+            f"Creation videos in db failed, creating one by one: {e}")
+        return [create_video(**row) for row in rows]
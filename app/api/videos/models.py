@@ -18,3 +18,4 @@ class Video(db.Model):
     frame = db.Column(db.Integer)
     persons = db.Column(db.Integer)
     filepath = db.Column(db.String)
+    faces = db.Column(db.LargeBinary)
@@ -16,3 +16,17 @@ class VideoResponseSchema(ma.Schema):
     message = ma.Str(example="Server response message")
     result = ma.Bool(example=True)
     video = ma.Nested(VideoSchema)
+
+
+class ProgressResponseSchema(ma.Schema):
+    """Schema for response with the last progress events of jobs."""
+    message = ma.Str(example="Server response message")
+    result = ma.Bool(example=True)
+    progress = ma.Dict()
+
+
+class UploadResponseSchema(ma.Schema):
+    """Schema for response to video upload."""
+    message = ma.Str(example="Server response message")
+    result = ma.Bool(example=True)
+    file_id = ma.UUID()
@@ -1,19 +1,26 @@
 import http
-import logging
+import os
 
 from app import redis_service
 from app.api.helpers.helpers import send_kafka_message
 from app.api.helpers.schemas import BinaryResponseSchema
-from app.api.videos.helpers import form_kafka_message_to_upload, save_file, \
-    create_video
+from app.api.videos.helpers import create_video, find_duplicate, \
+    forget_upload, form_kafka_message_to_upload, form_recognition_params, \
+    processing_exists, resume_states, save_file, upload_key
+from app.api.videos.models import Video
+from app.api.videos.schemas import ProgressResponseSchema, \
+    UploadResponseSchema, VideoResponseSchema, VideoSchema
 
 from flask import Blueprint, request
 
-from app.api.videos.models import Video
-from app.api.videos.schemas import VideoSchema, VideoResponseSchema
-from libs.face_recognition import FaceRecognitionStatusEnum
-from settings import ALLOWED_VIDEO_EXTENSIONS, VIDEO_UPLOAD_TOPIC, REDIS_DB, \
-    REDIS_PORT, REDIS_HOST, FACE_RECOGNITION_TOPIC
+from kafka.errors import KafkaError
+
+from libs.face_recognition import ControlCommandEnum
+from libs.face_recognition.control import send_command
+from libs.face_recognition.progress import last_progress
+
+from settings import ALLOWED_VIDEO_EXTENSIONS, FACE_RECOGNITION_TOPIC, \
+    REDIS_DB, REDIS_HOST, REDIS_PORT, VIDEO_UPLOAD_TOPIC
 
 bp = Blueprint("api_products", __name__, url_prefix="/api/videos")
 
@@ -38,9 +45,31 @@ def upload_video():
                             file:
                                 type: string
                                 format: binary
+                            sampling_mode:
+                                type: string
+                                enum: [all, stride, fps, keyframe]
+                            sampling_value:
+                                type: number
+                                description: N for stride and fps modes
+                            motion_threshold:
+                                type: number
+                                description: Min share of changed pixels
+                                    to run detection, 0 disables gating
+                            detect_height:
+                                type: integer
+                                description: Frame height for detection,
+                                    0 for full resolution
+                            detect_backend:
+                                type: string
+                                enum: [haar, lbp, dnn]
+                            segments:
+                                type: integer
+                                description: Number of frame ranges
+                                    processed in parallel
         responses:
             '200':
-                description: Success
+                description: Success, file_id of an earlier upload is
+                    returned for the same file and params
                 content:
                     application/json:
                         schema:
@@ -53,6 +82,13 @@ def upload_video():
                         schema:
                             type: integer
                         example: 6889735465
+            '503':
+                description: Upload queue is full
+                content:
+                    application/json:
+                        schema:
+                            type: integer
+                        example: 6889735465
         tags:
             - Videos
     """
@@ -60,13 +96,39 @@ def upload_video():
     if file:
         file_extension = file.filename.split(".")[-1]
         if file_extension in ALLOWED_VIDEO_EXTENSIONS:
-            message = form_kafka_message_to_upload(file_extension)
-            save_file(
+            try:
+                params = form_recognition_params(request.form)
+            except ValueError as e:
+                return BinaryResponseSchema().dump(
+                    {"message": f"Wrong recognition params: {e}",
+                     "result": False}
+                ), http.HTTPStatus.BAD_REQUEST
+
+            message = form_kafka_message_to_upload(file_extension, params)
+            save_path, content_hash = save_file(
                 file, message.get("filepath"))
-            send_kafka_message(VIDEO_UPLOAD_TOPIC, message)
+            key = upload_key(content_hash, params)
+            duplicate_id = find_duplicate(key, message.get("file_id"))
+            if duplicate_id is not None:
+                os.remove(save_path)
+                return UploadResponseSchema().dump(
+                    {"message": "Video has already been uploaded",
+                     "result": True, "file_id": duplicate_id}
+                ), http.HTTPStatus.OK
+
+            try:
+                send_kafka_message(VIDEO_UPLOAD_TOPIC, message)
+            except KafkaError as e:
+                forget_upload(key)
+                os.remove(save_path)
+                return BinaryResponseSchema().dump(
+                    {"message": f"Video has not been upload: {e}",
+                     "result": False}
+                ), http.HTTPStatus.SERVICE_UNAVAILABLE
 
-            return BinaryResponseSchema().dump(
-                {"message": "Video is uploading", "result": True}
+            return UploadResponseSchema().dump(
+                {"message": "Video is uploading", "result": True,
+                 "file_id": message.get("file_id")}
             ), http.HTTPStatus.OK
 
         return BinaryResponseSchema().dump(
@@ -134,6 +196,59 @@ def get_status():
     ), http.HTTPStatus.BAD_REQUEST
 
 
+@bp.route("/processing/progress", methods=["GET"])
+def processing_progress():
+    """
+    Get the last progress of video processing by file ids.
+
+    Returns:
+        JSON object with progress of every file or error message
+    ---
+    get:
+        summary: Get progress of video processing by file ids.
+        parameters:
+            - in: query
+              name: file_id
+              schema:
+                type: array
+                items:
+                    type: string
+              required: true
+              description: IDs of the files, can be repeated.
+        responses:
+            '200':
+                description: Success, frame, frame_count, persons,
+                    status and fps of every file, null for unknown ones,
+                    segmented files also have number of segments
+                content:
+                    application/json:
+                        schema:
+                            type: object
+            '400':
+                description: Bad request
+                content:
+                    application/json:
+                        schema:
+                            type: integer
+                            example: 6889735465
+        tags:
+            - Videos
+    """
+    file_ids = request.args.getlist("file_id")
+    if not file_ids:
+        return BinaryResponseSchema().dump(
+            {"message": "No file id", "result": False}
+        ), http.HTTPStatus.BAD_REQUEST
+
+    return ProgressResponseSchema().dump(
+        {
+            "message": "Progress has been retrieved successfuly",
+            "progress": last_progress(redis_service, file_ids),
+            "result": True
+        }
+    ), http.HTTPStatus.OK
+
+
 @bp.route("/processing/resume", methods=["GET"])
 def processing_resume():
     """
@@ -170,19 +285,33 @@ def processing_resume():
             - Videos
     """
     file_id = request.args.get("file_id")
-    data = redis_service.get(file_id)
-    resume_status = FaceRecognitionStatusEnum.RESUME
-    data["status"] = resume_status
-    redis_service.update(file_id, data)
-
-    filepath = data.get("filepath")
-    send_kafka_message(
-        FACE_RECOGNITION_TOPIC,
-        {
-            "filepath": filepath,
-            "file_id": file_id
+    if not processing_exists(file_id):
+        return BinaryResponseSchema().dump(
+            {
+                "message": f"No processing with file id {file_id}",
+                "result": False
+            }
+        ), http.HTTPStatus.BAD_REQUEST
+
+    resumed = resume_states(file_id)
+    if not resumed:
+        return BinaryResponseSchema().dump(
+            {
+                "message": f"Processing file with id {file_id} isn't paused",
+                "result": False
+            }
+        ), http.HTTPStatus.BAD_REQUEST
+
+    send_command(redis_service, file_id, ControlCommandEnum.RESUME)
+    for data in resumed:
+        message = {
+            "filepath": data.get("filepath"),
+            "file_id": file_id,
+            "params": data.get("params", {})
         }
-    )
+        if "segment" in data:
+            message["segment"] = data["segment"]
+        send_kafka_message(FACE_RECOGNITION_TOPIC, message)
 
     return BinaryResponseSchema().dump(
         {
@@ -228,35 +357,74 @@ def processing_pause():
             - Videos
     """
     file_id = request.args.get("file_id")
-    data = redis_service.get(file_id)
-    logging.info(data)
-    pause_status = str(FaceRecognitionStatusEnum.PAUSE)
-    data["faces_list"] = data["faces_list"].tolist()
-    data["names_list"] = data["names_list"].tolist()
-
-    # {
-    #     "file_id": self.file_id,
-    #     "faces_list": self.faces_list,
-    #     "names_list": self.names_list,
-    #     "status": str(self.status),
-    #     "frame": f"{str(self.frame_num)}/{str(self.frame_count)}",
-    #     "persons": str(self.persons),
-    #     "filepath": self.video_path
-    # }
-    redis_service.update(file_id, data)
-
-    filepath = data.get("filepath")
-    send_kafka_message(
-        FACE_RECOGNITION_TOPIC,
+    if not processing_exists(file_id):
+        return BinaryResponseSchema().dump(
+            {
+                "message": f"No processing with file id {file_id}",
+                "result": False
+            }
+        ), http.HTTPStatus.BAD_REQUEST
+
+    # running job checkpoints and stops before its next frame
+    send_command(redis_service, file_id, ControlCommandEnum.PAUSE)
+
+    return BinaryResponseSchema().dump(
         {
-            "filepath": filepath,
-            "file_id": file_id
+            "message": f"Processing file with id {file_id} on pause",
+            "result": True
         }
-    )
+    ), http.HTTPStatus.OK
+
+
+@bp.route("/processing/cancel", methods=["GET"])
+def processing_cancel():
+    """
+    Cancel video processing by file id.
+
+    Returns:
+        JSON object with success or error message from server
+    ---
+    get:
+        summary: Cancel video processing by file id.
+        parameters:
+            - in: query
+              name: file_id
+              schema:
+                type: string
+              required: true
+              description: The ID of the file to retrieve data for.
+        responses:
+            '200':
+                description: Success
+                content:
+                    application/json:
+                        schema:
+                            type: integer
+                            example: 6889735465
+            '400':
+                description: Bad request
+                content:
+                    application/json:
+                        schema:
+                            type: integer
+                            example: 6889735465
+        tags:
+            - Videos
+    """
+    file_id = request.args.get("file_id")
+    if not processing_exists(file_id):
+        return BinaryResponseSchema().dump(
+            {
+                "message": f"No processing with file id {file_id}",
+                "result": False
+            }
+        ), http.HTTPStatus.BAD_REQUEST
+
+    send_command(redis_service, file_id, ControlCommandEnum.CANCEL)
 
     return BinaryResponseSchema().dump(
         {
-            "message": f"Processing file with id {file_id} on pause",
+            "message": f"Processing file with id {file_id} is canceled",
             "result": True
         }
     ), http.HTTPStatus.OK
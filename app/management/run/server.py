@@ -1,12 +1,20 @@
+import os
+
 from app import app
 
 from flask import Blueprint
 
-from settings import DEBUG, HOST, PORT
+from libs.transport.publisher.kafka_publisher import publisher
+
+from settings import DEBUG, FACE_RECOGNITION_TOPIC, HOST, PORT, \
+    VIDEO_UPLOAD_TOPIC
 
 bp = Blueprint("server", __name__)
 
 
 @bp.cli.command("run", help="run server")
 def run():
+    # with debug reloader requests are served by the child process
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN"):
+        publisher.warm_up([VIDEO_UPLOAD_TOPIC, FACE_RECOGNITION_TOPIC])
     app.run(host=HOST, port=PORT, debug=DEBUG)
@@ -1,24 +1,58 @@
+import functools
+
+import click
+
 from flask import Blueprint
 
+from libs.transport.consumer.async_consumer import \
+    AsyncVideoUploadConsumer
 from libs.transport.consumer.kafka_consumers import VideoUploadConsumer
+from libs.transport.consumer.supervisor import ConsumerSupervisor, \
+    consume
 
-from settings import KAFKA_BROKER, VIDEO_UPLOAD_TOPIC
+from settings import KAFKA_BROKER, KAFKA_CONSUMER_BATCH_SIZE, METRICS_PORT, \
+    VIDEO_UPLOAD_TOPIC
 
 
 bp = Blueprint("video_upload_consumer", __name__)
 
 
 @bp.cli.command("run", help="listening messages from kafka")
-def run():
+@click.option(
+    "--metrics-port", type=int, default=METRICS_PORT,
+    help="prometheus metrics port, 0 disables metrics")
+@click.option(
+    "--batch-size", type=int, default=KAFKA_CONSUMER_BATCH_SIZE,
+    help="messages handled together, 0 handles them one by one")
+@click.option(
+    "--workers", type=int, default=1,
+    help="consumer processes of the group, supervised by this one")
+@click.option(
+    "--runtime", type=click.Choice(["thread", "asyncio"]), default="thread",
+    help="thread pool or asyncio consumer runtime")
+def run(metrics_port, batch_size, workers, runtime):
     """
     Starts consuming messages from kafka.
+    Args:
+        metrics_port (int): prometheus metrics port
+        batch_size (int): max messages of one batch
+        workers (int): number of consumer processes
+        runtime (str): consumer runtime
+
     Returns:
         None:
     """
     # @@@
-    consumer = VideoUploadConsumer(
+    consumer_class = VideoUploadConsumer if runtime == "thread" \
+        else AsyncVideoUploadConsumer
+    create_consumer = functools.partial(
+        consumer_class,
         VIDEO_UPLOAD_TOPIC,
         group_id="video_upload_group",
         broker=KAFKA_BROKER,
+        batch_size=batch_size,
     )
-    consumer.activate_listener()
+    if workers > 1:
+        ConsumerSupervisor(create_consumer, workers, metrics_port).run()
+    else:
+        consume(create_consumer, metrics_port)
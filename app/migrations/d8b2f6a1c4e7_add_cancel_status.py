@@ -0,0 +1,29 @@
+"""add cancel status
+
+Revision ID: d8b2f6a1c4e7
+Revises: c3e1d4f7a2b9
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8b2f6a1c4e7'
+down_revision: Union[str, None] = 'c3e1d4f7a2b9'
+branch_labels: Union[str, Sequence[str], None] = ()
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TYPE facerecognitionstatusenum "
+        "ADD VALUE IF NOT EXISTS 'CANCEL'"
+    )
+
+
+def downgrade() -> None:
+    # postgres can't drop enum values, unused value is harmless
+    pass
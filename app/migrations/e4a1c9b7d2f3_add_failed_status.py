@@ -0,0 +1,29 @@
+"""add failed status
+
+Revision ID: e4a1c9b7d2f3
+Revises: d8b2f6a1c4e7
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a1c9b7d2f3'
+down_revision: Union[str, None] = 'd8b2f6a1c4e7'
+branch_labels: Union[str, Sequence[str], None] = ()
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TYPE facerecognitionstatusenum "
+        "ADD VALUE IF NOT EXISTS 'FAILED'"
+    )
+
+
+def downgrade() -> None:
+    # postgres can't drop enum values, unused value is harmless
+    pass
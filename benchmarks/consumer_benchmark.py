@@ -0,0 +1,210 @@
+"""
+Messages per second of consumer per-message loop against batch mode.
+Messages come from in-memory stand-in of kafka consumer, so only
+handling and db writes are measured. db sink writes a Video row per
+message to configured database (rows are removed after the run),
+none sink measures consumer loop only.
+
+Usage:
+    python -m benchmarks.consumer_benchmark --messages 2000
+    python -m benchmarks.consumer_benchmark --batch-sizes 10 50 \
+        --sink none
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from unittest import mock
+
+from app import app, db
+from app.api.videos.helpers import create_video, create_videos
+from app.api.videos.models import Video
+
+from kafka.structs import TopicPartition
+
+from libs.face_recognition import FaceRecognitionStatusEnum
+from libs.transport.consumer import kafka_consumers
+from libs.transport.consumer.kafka_consumers import Consumer
+
+
+class _Message:
+    """Consumer record stand-in."""
+    def __init__(self, topic, partition, offset, value):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.value = value
+
+
+class MemoryKafkaConsumer:
+    """KafkaConsumer stand-in serving generated upload messages."""
+    def __init__(self, messages, partitions, **kwargs):
+        self.partitions = [
+            TopicPartition("benchmark", index) for index in range(partitions)]
+        per_partition = -(-messages // partitions)
+        self.end = {
+            partition: min(per_partition, messages - index * per_partition)
+            for index, partition in enumerate(self.partitions)
+        }
+        self.position = {partition: 0 for partition in self.partitions}
+        self._paused = set()
+
+    def subscribe(self, topics, listener=None):
+        pass
+
+    def poll(self, timeout_ms=0, max_records=None):
+        records = {}
+        left = max_records or 500
+        for partition in self.partitions:
+            if partition in self._paused or not left:
+                continue
+            start = self.position[partition]
+            end = min(self.end[partition], start + left)
+            if start < end:
+                records[partition] = [
+                    _Message(partition.topic, partition.partition, offset,
+                             {"file_id": str(uuid.uuid4())})
+                    for offset in range(start, end)
+                ]
+                self.position[partition] = end
+                left -= end - start
+        if not records:
+            time.sleep(timeout_ms / 1000)
+        return records
+
+    def seek(self, partition, offset):
+        self.position[partition] = offset
+
+    def paused(self):
+        return set(self._paused)
+
+    def pause(self, *partitions):
+        self._paused.update(partitions)
+
+    def resume(self, *partitions):
+        self._paused.difference_update(partitions)
+
+    def commit(self, offsets=None):
+        pass
+
+    def close(self):
+        pass
+
+
+def _row(message):
+    return {
+        "file_id": message.value["file_id"],
+        "data": {"names_list": []},
+        "status": FaceRecognitionStatusEnum.READY,
+        "frame": 0,
+        "persons": 0,
+        "filepath": "",
+    }
+
+
+class BenchmarkConsumer(Consumer):
+    """Writes a Video row per message, stops after all messages."""
+    def __init__(self, messages, sink, *args, **kwargs):
+        self.messages = messages
+        self.sink = sink
+        self.handled = 0
+        self.finished = None
+        self.file_ids = []
+        self._handled_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _handled(self, messages):
+        with self._handled_lock:
+            self.handled += len(messages)
+            self.file_ids.extend(
+                message.value["file_id"] for message in messages)
+            if self.handled >= self.messages:
+                self.finished = time.perf_counter()
+                self.stop()
+
+    def on_message(self, message):
+        if self.sink == "db":
+            with app.app_context():
+                create_video(**_row(message))
+        self._handled([message])
+        return True
+
+    def on_batch(self, messages):
+        if self.sink == "db":
+            with app.app_context():
+                create_videos([_row(message) for message in messages])
+        self._handled(messages)
+        return [True] * len(messages)
+
+
+def run(messages, partitions, batch_size, sink, threads, max_in_flight):
+    """
+    Consumes all messages in per-message or batch mode.
+    Args:
+        messages (int): number of messages
+        partitions (int): number of partitions
+        batch_size (int): batch size, 0 for per-message loop
+        sink (str): db or none
+        threads (int): consumer threads
+        max_in_flight (int): window per partition
+
+    Returns:
+        dict: messages per second
+    """
+    with mock.patch.object(
+            kafka_consumers, "KafkaConsumer",
+            lambda **kwargs: MemoryKafkaConsumer(messages, partitions)):
+        consumer = BenchmarkConsumer(
+            messages, sink, "benchmark", "benchmark", threads=threads,
+            max_in_flight=max_in_flight, batch_size=batch_size,
+            batch_linger_ms=10)
+        start = time.perf_counter()
+        consumer.activate_listener()
+        # listener exits after poll timeout, it isn't counted
+        seconds = (consumer.finished or time.perf_counter()) - start
+
+    if sink == "db":
+        with app.app_context():
+            Video.query.filter(Video.id.in_(consumer.file_ids)).delete(
+                synchronize_session=False)
+            db.session.commit()
+    return {
+        "batch_size": batch_size,
+        "messages": consumer.handled,
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(consumer.handled / seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--sink", default="db", choices=["db", "none"])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-in-flight", type=int, default=200)
+    parser.add_argument("--json", help="write results to file")
+    args = parser.parse_args()
+
+    results = []
+    for batch_size in [0] + args.batch_sizes:
+        result = run(
+            args.messages, args.partitions, batch_size, args.sink,
+            args.threads, args.max_in_flight)
+        results.append(result)
+        mode = f"batch={batch_size}" if batch_size else "per-message"
+        print(
+            f"{mode:>14} {result['messages_per_second']:>10} msg/s "
+            f"({result['seconds']}s)")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"args": vars(args), "results": results}, file,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Detection recall and throughput of detector backends for several
+detection heights on synthetic videos of several resolutions.
+Backends which aren't configured (lbp cascade, dnn model) are skipped.
+
+Usage:
+    python -m benchmarks.detection_benchmark --resolutions 1080p 2160p
+    python -m benchmarks.detection_benchmark --backends haar lbp dnn
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import RESOLUTIONS, load_faces, recall, \
+    write_video
+
+import cv2
+
+from libs.face_recognition import DetectorBackendEnum
+from libs.face_recognition.detection import FaceDetector
+
+
+def run(path, truth, height, backend="haar"):
+    """
+    Runs detector over all frames of video,
+    batch detectors get batch_size frames per call.
+    Args:
+        path (str): video path
+        truth (dict): ground truth of video
+        height (int): detection height
+        backend (str): detector backend
+
+    Returns:
+        dict: recall and frames per second
+    """
+    detector = FaceDetector.from_dict({"height": height, "backend": backend})
+    detector.warm_up()
+    video = cv2.VideoCapture(path)
+    found = expected = frames = 0
+    seconds = 0.0
+    ret = True
+    while ret:
+        batch = []
+        while len(batch) < detector.batch_size:
+            ret, frame = video.read()
+            if not ret:
+                break
+            batch.append(frame)
+        if not batch:
+            break
+
+        start = time.perf_counter()
+        images = batch if detector.color else [
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in batch]
+        results = detector.detect_batch(images)
+        seconds += time.perf_counter() - start
+        for boxes in results:
+            f, e = recall(truth["frames"][frames], boxes)
+            found, expected, frames = found + f, expected + e, frames + 1
+    video.release()
+    return {
+        "backend": backend,
+        "height": height,
+        "frames": frames,
+        "recall": round(found / expected, 3) if expected else None,
+        "fps": round(frames / seconds, 1) if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--resolutions", nargs="+", default=["720p", "1080p", "2160p"],
+        choices=sorted(RESOLUTIONS))
+    parser.add_argument(
+        "--heights", type=int, nargs="+", default=[0, 1080, 720, 480])
+    parser.add_argument(
+        "--backends", nargs="+", default=["haar"],
+        choices=[backend.value for backend in DetectorBackendEnum])
+    parser.add_argument("--duration", type=float, default=2)
+    parser.add_argument("--faces", type=int, default=3)
+    parser.add_argument("--faces-dir", help="directory with face crops")
+    parser.add_argument("--json", help="write results to file")
+    args = parser.parse_args()
+
+    crops = load_faces(args.faces_dir) if args.faces_dir else None
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for resolution in args.resolutions:
+            path = os.path.join(tmp, f"{resolution}.avi")
+            truth = write_video(
+                path, resolution, duration=args.duration,
+                faces=args.faces, crops=crops)
+            for backend in args.backends:
+                for height in args.heights:
+                    if height >= RESOLUTIONS[resolution][1]:
+                        continue
+                    try:
+                        result = run(path, truth, height, backend)
+                    except ValueError as e:
+                        print(f"{backend} skipped: {e}")
+                        break
+                    result["resolution"] = resolution
+                    results.append(result)
+                    print(
+                        f"{resolution:>6} {backend:>4} "
+                        f"height={height or 'full':>5} "
+                        f"recall={result['recall']} fps={result['fps']}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Per-frame match cost of FaceGallery compared with the previous
+approach (LBPH recognizer trained per detection).
+
+Usage:
+    python -m benchmarks.gallery_benchmark --sizes 10 100 1000
+"""
+import argparse
+import time
+
+from libs.face_recognition.gallery import FaceGallery, lbp_histogram
+
+import numpy as np
+
+try:
+    import cv2
+    HAS_CV2_FACE = hasattr(cv2, "face")
+except ImportError:
+    HAS_CV2_FACE = False
+
+
+def random_faces(count, size=128, seed=0):
+    """
+    Generates deterministic random face crops.
+    Args:
+        count (int): number of crops
+        size (int): crop side
+        seed (int): random seed
+
+    Returns:
+        list: uint8 crops
+    """
+    rng = np.random.default_rng(seed)
+    return [
+        rng.integers(0, 256, (size, size), dtype=np.uint8)
+        for _ in range(count)
+    ]
+
+
+def match_gallery(gallery, detections):
+    """
+    Matches detections of one frame using gallery.
+    Args:
+        gallery (FaceGallery): filled gallery
+        detections (list): face crops
+
+    Returns:
+        list: True for every new person
+    """
+    return [
+        not gallery.is_known(lbp_histogram(face)) for face in detections
+    ]
+
+
+def match_legacy(faces, detections, threshold):
+    """
+    Matches detections of one frame like FaceRecognition did before.
+    Args:
+        faces (list): known face crops
+        detections (list): face crops
+        threshold (int): LBPH threshold
+
+    Returns:
+        list: True for every new person
+    """
+    result = []
+    for face in detections:
+        rec = cv2.face.LBPHFaceRecognizer.create()
+        rec.train([face], np.array(0))
+        is_new = True
+        for known in faces:
+            _, confidence = rec.predict(known)
+            if confidence < threshold:
+                is_new = False
+        result.append(is_new)
+    return result
+
+
+def measure(func, *args, repeat=3):
+    """
+    Best wall time of function call.
+    Args:
+        func (collections.abc.Callable): measured function
+        repeat (int): number of runs
+
+    Returns:
+        tuple: best time in seconds and result of last call
+    """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 500, 1000])
+    parser.add_argument("--detections", type=int, default=5)
+    parser.add_argument("--threshold", type=int, default=80)
+    parser.add_argument("--no-legacy", action="store_true")
+    args = parser.parse_args()
+
+    detections = random_faces(args.detections, seed=1)
+    legacy = HAS_CV2_FACE and not args.no_legacy
+
+    print(f"{'gallery':>8} {'gallery ms':>11} {'legacy ms':>10} same")
+    for size in args.sizes:
+        faces = random_faces(size)
+        gallery = FaceGallery.from_faces(faces, threshold=args.threshold)
+        gallery_time, gallery_result = measure(
+            match_gallery, gallery, detections)
+
+        legacy_ms, same = "-", "-"
+        if legacy:
+            legacy_time, legacy_result = measure(
+                match_legacy, faces, detections, args.threshold, repeat=1)
+            legacy_ms = f"{legacy_time * 1000:.2f}"
+            same = str(legacy_result == gallery_result)
+        print(
+            f"{size:>8} {gallery_time * 1000:>11.2f} {legacy_ms:>10} {same}")
+
+
+if __name__ == "__main__":
+    main()
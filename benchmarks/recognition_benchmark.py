@@ -0,0 +1,169 @@
+"""
+End-to-end FaceRecognition.process benchmark on deterministic
+synthetic videos. Every case runs in a fresh process against
+in-memory redis stand-in (fakeredis), so peak RSS belongs to the case
+and no redis server is needed. Results can be written to json and
+compared between commits.
+
+Usage:
+    python -m benchmarks.recognition_benchmark --json results.json
+    python -m benchmarks.recognition_benchmark --resolutions 1080p \
+        --durations 10 --faces 1 5
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import RESOLUTIONS, load_faces, write_video
+
+import cv2
+
+
+def _use_redis_stand_in():
+    """
+    Replaces redis client of app redis service with in-memory one.
+    Returns:
+        None:
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit(
+            "fakeredis is needed for redis stand-in: pip install fakeredis")
+
+    from app import redis_service
+    redis_service.redis = fakeredis.FakeRedis()
+
+
+def run_case(path, persons, engine):
+    """
+    Runs recognition of one video, called in a fresh process.
+    Args:
+        path (str): video path
+        persons (int): number of persons in video
+        engine (str): recognition engine
+
+    Returns:
+        dict: throughput, stage latency, memory and accuracy
+    """
+    _use_redis_stand_in()
+    import libs.face_recognition.face_recognition as module
+    module.RECOGNITION_ENGINE = engine
+
+    start = time.perf_counter()
+    face_recognition = module.FaceRecognition(str(uuid.uuid4()), path)
+    face_recognition.process()
+    seconds = time.perf_counter() - start
+
+    frames = face_recognition.frame_num
+    found = face_recognition.persons
+    return {
+        "engine": engine,
+        "status": face_recognition.status.value,
+        "frames": frames,
+        "seconds": round(seconds, 3),
+        "fps": round(frames / seconds, 1) if seconds else None,
+        "persons": found,
+        "expected_persons": persons,
+        "accuracy": round(1 - abs(found - persons) / persons, 3)
+        if persons else None,
+        # linux reports kilobytes
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": {
+            stage: {
+                "mean_ms": round(
+                    timing["seconds"] / timing["count"] * 1000, 3),
+                "max_ms": timing["max_ms"],
+                "count": timing["count"],
+            }
+            for stage, timing in face_recognition.stats["timings"].items()
+        },
+        "decode_fps": face_recognition.stats["decode"]["fps"],
+    }
+
+
+def _commit():
+    """
+    Returns:
+        str | None: current git commit
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--resolutions", nargs="+", default=["720p", "1080p"],
+        choices=sorted(RESOLUTIONS))
+    parser.add_argument(
+        "--durations", type=float, nargs="+", default=[2])
+    parser.add_argument("--faces", type=int, nargs="+", default=[1, 3])
+    parser.add_argument(
+        "--face-size", type=int,
+        help="face side, 15%% of height by default; faces smaller than "
+             "detector min_size (100) aren't found")
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--engine", default="thread", choices=["thread", "process"])
+    parser.add_argument("--faces-dir", help="directory with face crops")
+    parser.add_argument("--json", help="write results to file")
+    args = parser.parse_args()
+
+    crops = load_faces(args.faces_dir) if args.faces_dir else None
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for resolution, duration, faces in itertools.product(
+                args.resolutions, args.durations, args.faces):
+            path = os.path.join(
+                tmp, f"{resolution}_{duration}s_{faces}.avi")
+            truth = write_video(
+                path, resolution, duration=duration, fps=args.fps,
+                faces=faces, face_size=args.face_size, seed=args.seed,
+                crops=crops)
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(
+                    run_case, path, truth["persons"], args.engine).result()
+            result.update(
+                resolution=resolution, duration=duration, faces=faces)
+            results.append(result)
+            stages = " ".join(
+                f"{stage}={timing['mean_ms']}ms"
+                for stage, timing in result["stages"].items())
+            print(
+                f"{resolution:>6} {duration:>4}s faces={faces} "
+                f"fps={result['fps']} persons={result['persons']}"
+                f"/{faces} rss={result['peak_rss_mb']}MB {stages}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(
+                {
+                    "commit": _commit(),
+                    "python": platform.python_version(),
+                    "opencv": cv2.__version__,
+                    "cpus": os.cpu_count(),
+                    "args": vars(args),
+                    "results": results,
+                },
+                file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
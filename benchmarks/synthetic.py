@@ -0,0 +1,155 @@
+"""
+Deterministic synthetic videos with pasted faces for benchmarks.
+Faces are drawn procedurally, every identity has its own proportions
+and tone, or are taken from crops in a directory.
+"""
+import os
+
+import cv2
+
+from libs.face_recognition.tracking import iou
+
+import numpy as np
+
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "2160p": (3840, 2160),
+}
+
+
+def draw_face(size, identity):
+    """
+    Draws grayscale face which haar cascade detects.
+    Args:
+        size (int): face side
+        identity (int): face identity, changes proportions and tone
+
+    Returns:
+        np.ndarray: uint8 face crop
+    """
+    rng = np.random.default_rng(identity)
+    skin = int(rng.integers(170, 230))
+    eye_dx = rng.uniform(0.15, 0.19)
+    mouth_w = rng.uniform(0.10, 0.17)
+    nose_h = rng.uniform(0.07, 0.11)
+
+    img = np.full((size, size), 90, np.uint8)
+    c = size // 2
+    cv2.ellipse(
+        img, (c, c), (int(size * 0.38), int(size * 0.48)),
+        0, 0, 360, skin, -1)
+    for dx in (-1, 1):
+        ex, ey = c + dx * int(size * eye_dx), int(size * 0.40)
+        cv2.ellipse(
+            img, (ex, ey), (int(size * 0.09), int(size * 0.05)),
+            0, 0, 360, 40, -1)
+        brow_y = ey - int(size * 0.09)
+        cv2.line(
+            img, (ex - int(size * 0.1), brow_y),
+            (ex + int(size * 0.1), brow_y), 60, max(1, size // 30))
+    cv2.ellipse(
+        img, (c, int(size * 0.58)), (int(size * 0.05), int(size * nose_h)),
+        0, 0, 360, skin - 50, -1)
+    cv2.ellipse(
+        img, (c, int(size * 0.74)), (int(size * mouth_w), int(size * 0.04)),
+        0, 0, 360, 70, -1)
+    texture = rng.integers(-12, 13, img.shape)
+    img = np.clip(img.astype(np.int16) + texture, 0, 255).astype(np.uint8)
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+
+def load_faces(directory):
+    """
+    Loads face crops from directory.
+    Args:
+        directory (str): directory with images
+
+    Returns:
+        list: grayscale crops sorted by file name
+    """
+    faces = []
+    for name in sorted(os.listdir(directory)):
+        img = cv2.imread(os.path.join(directory, name), cv2.IMREAD_GRAYSCALE)
+        if img is not None:
+            faces.append(img)
+    return faces
+
+
+def write_video(
+        path, resolution="720p", duration=4, fps=25, faces=3,
+        face_size=None, seed=0, crops=None):
+    """
+    Writes synthetic video, faces slowly move over textured background.
+    Args:
+        path (str): output video path, .avi is written with MJPG
+        resolution (str): key of RESOLUTIONS
+        duration (float): seconds
+        fps (int): frames per second
+        faces (int): number of persons
+        face_size (int | None): face side, 15% of height by default
+        seed (int): random seed
+        crops (list | None): face crops instead of drawn faces
+
+    Returns:
+        dict: ground truth with frame boxes and number of persons
+    """
+    width, height = RESOLUTIONS[resolution]
+    face_size = face_size or int(height * 0.15)
+    rng = np.random.default_rng(seed)
+
+    background = cv2.resize(
+        rng.integers(60, 140, (height // 8, width // 8), dtype=np.uint8),
+        (width, height), interpolation=cv2.INTER_CUBIC)
+    if crops:
+        face_imgs = [
+            cv2.resize(crops[i % len(crops)], (face_size, face_size))
+            for i in range(faces)
+        ]
+    else:
+        face_imgs = [draw_face(face_size, seed * 1000 + i)
+                     for i in range(faces)]
+
+    # every person is visible during its own part of the video
+    frame_total = int(duration * fps)
+    span = max(1, frame_total // max(1, faces))
+    starts = rng.integers(0, width - face_size, (faces, 2))
+    starts[:, 1] %= height - face_size
+    speed = rng.integers(-3, 4, (faces, 2))
+
+    fourcc = cv2.VideoWriter_fourcc(*"MJPG")
+    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    truth = {"persons": faces, "frames": []}
+    for index in range(frame_total):
+        frame = background.copy()
+        boxes = []
+        visible = [min(index // span, faces - 1)] if faces else []
+        for i in visible:
+            x, y = starts[i] + speed[i] * (index - i * span)
+            x = int(np.clip(x, 0, width - face_size))
+            y = int(np.clip(y, 0, height - face_size))
+            frame[y:y + face_size, x:x + face_size] = face_imgs[i]
+            boxes.append((x, y, face_size, face_size))
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        truth["frames"].append(boxes)
+    writer.release()
+    return truth
+
+
+def recall(truth_boxes, found_boxes, min_iou=0.5):
+    """
+    Args:
+        truth_boxes (list): ground truth boxes of frame
+        found_boxes (list): detected boxes of frame
+        min_iou (float): min iou to count box as found
+
+    Returns:
+        tuple: numbers of found and expected boxes
+    """
+    found = sum(
+        1 for t in truth_boxes
+        if any(iou(t, f) >= min_iou for f in found_boxes)
+    )
+    return found, len(truth_boxes)
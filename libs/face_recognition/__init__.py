@@ -9,3 +9,29 @@ class FaceRecognitionStatusEnum(Enum):
     PAUSE = "pause"
     READY = "ready"
     RESUME = "resume"
+    CANCEL = "cancel"
+    FAILED = "failed"
+
+
+class SamplingModeEnum(Enum):
+    ALL = "all"
+    STRIDE = "stride"
+    FPS = "fps"
+    KEYFRAME = "keyframe"
+
+
+class RecognitionEngineEnum(Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class DetectorBackendEnum(Enum):
+    HAAR = "haar"
+    LBP = "lbp"
+    DNN = "dnn"
+
+
+class ControlCommandEnum(Enum):
+    PAUSE = "pause"
+    RESUME = "resume"
+    CANCEL = "cancel"
@@ -0,0 +1,118 @@
+import time
+
+
+CHECKPOINT_LISTS = ("faces_list", "names_list", "keyframes")
+BINARY_CHECKPOINT_LISTS = ("faces_list",)
+
+
+class CheckpointWriter:
+    """
+    Coalesces recognition state updates and writes them to redis
+    on time or frame interval. Only new list items (found persons,
+    key frames) and progress counters are sent.
+    Must be used from one thread, e.g. pipeline match stage.
+    """
+    def __init__(self, storage, key, interval=1.0, frames=250,
+                 timings=None):
+        """
+        Sets writer parameters.
+        Args:
+            storage (RedisService): redis service
+            key (str): checkpoint key, file id
+            interval (float): max seconds between flushes
+            frames (int): max frames between flushes
+            timings (StageTimings | None): job timings
+        """
+        self.storage = storage
+        self.timings = timings
+        self.key = key
+        self.interval = interval
+        self.frames = frames
+        self.seq = 0
+        self.flushes = 0
+        self._lengths = {name: 0 for name in CHECKPOINT_LISTS}
+        self._pending = {name: [] for name in CHECKPOINT_LISTS}
+        self._last_flush = time.monotonic()
+        self._last_frame = 0
+
+    def load(self):
+        """
+        Loads checkpoint, next flushes continue its lists.
+        Returns:
+            dict | None: checkpoint data with lists
+        """
+        data = self.storage.get_checkpoint(
+            self.key, CHECKPOINT_LISTS, binary=BINARY_CHECKPOINT_LISTS)
+        if data is not None:
+            for name in CHECKPOINT_LISTS:
+                self._lengths[name] = len(data[name])
+            self.seq = data.get("seq", 0)
+        return data
+
+    def reset(self):
+        """
+        Removes previous checkpoint of the key, e.g. for a new job.
+        Returns:
+            None:
+        """
+        self.storage.delete_checkpoint(self.key, CHECKPOINT_LISTS)
+
+    def append(self, name, item):
+        """
+        Queues new list item till the next flush.
+        Args:
+            name (str): one of CHECKPOINT_LISTS
+            item (Any): json serializable item or bytes
+
+        Returns:
+            None:
+        """
+        self._pending[name].append(item)
+
+    def update(self, frame_num, data):
+        """
+        Flushes state if interval has passed.
+        Args:
+            frame_num (int): current frame number
+            data (collections.abc.Callable): returns progress data
+
+        Returns:
+            bool: True if state has been flushed
+        """
+        if time.monotonic() - self._last_flush < self.interval \
+                and frame_num - self._last_frame < self.frames:
+            return False
+        self.flush(frame_num, data())
+        return True
+
+    def flush(self, frame_num, data):
+        """
+        Writes queued items and progress data in one transaction.
+        Args:
+            frame_num (int): current frame number
+            data (dict): progress data
+
+        Returns:
+            None:
+        """
+        pending, self._pending = self._pending, {
+            name: [] for name in CHECKPOINT_LISTS}
+        for name, items in pending.items():
+            self._lengths[name] += len(items)
+
+        self.seq += 1
+        data = dict(data, seq=self.seq, lengths=dict(self._lengths))
+        start = time.perf_counter()
+        self.storage.write_checkpoint(self.key, data, pending)
+        if self.timings is not None:
+            self.timings.observe("redis", time.perf_counter() - start)
+        self.flushes += 1
+        self._last_flush = time.monotonic()
+        self._last_frame = frame_num
+
+    def stats(self):
+        """
+        Returns:
+            dict: number of flushes and last sequence number
+        """
+        return {"flushes": self.flushes, "seq": self.seq}
@@ -0,0 +1,116 @@
+import struct
+from enum import Enum
+
+import cv2
+
+import numpy as np
+
+
+MAGIC = b"FACE"
+HEADER = struct.Struct("<4sBHH")
+LENGTH = struct.Struct("<I")
+
+
+class FaceFormatEnum(Enum):
+    RAW = 0
+    PNG = 1
+    WEBP = 2
+
+
+_EXTENSIONS = {
+    FaceFormatEnum.PNG: (".png", [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    # webp quality above 100 means lossless
+    FaceFormatEnum.WEBP: (".webp", [cv2.IMWRITE_WEBP_QUALITY, 101]),
+}
+
+
+def encode_face(face, fmt=FaceFormatEnum.RAW):
+    """
+    Encodes grayscale face crop to bytes with shape header.
+    Args:
+        face (np.ndarray): uint8 face crop
+        fmt (FaceFormatEnum | str): raw bytes or lossless image format
+
+    Returns:
+        bytes: encoded face
+    """
+    fmt = fmt if isinstance(fmt, FaceFormatEnum) \
+        else FaceFormatEnum[fmt.upper()]
+    face = np.ascontiguousarray(face, dtype=np.uint8)
+    height, width = face.shape[:2]
+    header = HEADER.pack(MAGIC, fmt.value, height, width)
+    if fmt == FaceFormatEnum.RAW:
+        return header + face.tobytes()
+
+    extension, flags = _EXTENSIONS[fmt]
+    ok, encoded = cv2.imencode(extension, face, flags)
+    if not ok:
+        raise ValueError(f"Face can't be encoded to {fmt.name}")
+    return header + encoded.tobytes()
+
+
+def decode_face(data):
+    """
+    Decodes face crop, raw faces are not copied.
+    Args:
+        data (bytes | memoryview): encoded face
+
+    Returns:
+        np.ndarray: uint8 face crop, read only for raw format
+
+    Raises:
+        ValueError: data is not encoded face
+    """
+    magic, fmt, height, width = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Data is not encoded face")
+
+    fmt = FaceFormatEnum(fmt)
+    if fmt == FaceFormatEnum.RAW:
+        return np.frombuffer(
+            data, dtype=np.uint8, count=height * width,
+            offset=HEADER.size).reshape(height, width)
+
+    encoded = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size)
+    return cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
+
+
+def pack_faces(faces, fmt=FaceFormatEnum.PNG):
+    """
+    Packs face crops into one blob of length prefixed records.
+    Args:
+        faces (list): face crops
+        fmt (FaceFormatEnum | str): format of every face
+
+    Returns:
+        bytes: packed faces
+    """
+    parts = []
+    for face in faces:
+        encoded = encode_face(face, fmt)
+        parts.append(LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+def unpack_faces(data):
+    """
+    Unpacks faces packed by pack_faces.
+    Args:
+        data (bytes | None): packed faces
+
+    Returns:
+        list: face crops
+    """
+    faces = []
+    if not data:
+        return faces
+
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        (length,) = LENGTH.unpack_from(view, offset)
+        offset += LENGTH.size
+        faces.append(decode_face(view[offset:offset + length]))
+        offset += length
+    return faces
@@ -0,0 +1,93 @@
+import logging
+
+from libs.face_recognition import ControlCommandEnum
+
+
+def control_channel(file_id):
+    """
+    Args:
+        file_id (str): file id
+
+    Returns:
+        str: redis channel of job commands
+    """
+    return f"{file_id}:control"
+
+
+def send_command(storage, file_id, command):
+    """
+    Sends command to running jobs of file.
+    Args:
+        storage (RedisService): redis service
+        file_id (str): file id
+        command (ControlCommandEnum): command
+
+    Returns:
+        int: number of jobs got command
+    """
+    return storage.publish_command(control_channel(file_id), command.value)
+
+
+class JobControl:
+    """
+    Control channel of running job. Commands are pushed by redis
+    pub/sub, so job sees them before its next frame. Command sent
+    before job has started is read from redis on start.
+    """
+    def __init__(self, storage, file_id):
+        """
+        Args:
+            storage (RedisService): redis service
+            file_id (str): file id
+        """
+        self.storage = storage
+        self.channel = control_channel(file_id)
+        self.command = None
+        self._thread = None
+
+    def start(self):
+        """
+        Subscribes to commands.
+        Returns:
+            None:
+        """
+        self._thread = self.storage.subscribe(self.channel, self._on_message)
+        # subscribed first, so command sent meanwhile isn't lost
+        stored = self.storage.redis.get(self.channel)
+        if stored is not None and self.command is None:
+            self._set(stored)
+
+    def stop(self):
+        """
+        Unsubscribes from commands.
+        Returns:
+            None:
+        """
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+
+    def _on_message(self, message):
+        """
+        Args:
+            message (dict): redis pub/sub message
+
+        Returns:
+            None:
+        """
+        self._set(message["data"])
+
+    def _set(self, data):
+        """
+        Args:
+            data (bytes | str): command value
+
+        Returns:
+            None:
+        """
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        try:
+            self.command = ControlCommandEnum(data)
+        except ValueError:
+            logging.error(f"Unknown command {data} in {self.channel}")
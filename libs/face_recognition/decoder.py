@@ -0,0 +1,105 @@
+import threading
+import time
+
+import cv2
+
+
+class FrameDecoder:
+    """
+    Video decoder for pipeline decode thread.
+    Skipped frames are only grabbed, analysed frames are retrieved
+    into recycled buffers, which pipeline returns after detection,
+    so decoding doesn't allocate a new array per frame.
+    """
+    def __init__(self, video, pool_size=32, timings=None):
+        """
+        Sets decoder parameters.
+        Args:
+            video (cv2.VideoCapture): opened video
+            pool_size (int): max number of free buffers kept,
+                frames in flight in pipeline
+            timings (StageTimings | None): job timings
+        """
+        self.video = video
+        self.pool_size = pool_size
+        self.timings = timings
+        self.grabbed = 0
+        self.retrieved = 0
+        self.allocated = 0
+        self.seconds = 0.0
+        self._free = []
+        self._lock = threading.Lock()
+
+    def grab(self):
+        """
+        Grabs next frame without decoding it.
+        Returns:
+            bool: False if video is over
+        """
+        start = time.perf_counter()
+        ok = self.video.grab()
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        if self.timings is not None:
+            self.timings.observe("grab", seconds)
+        if ok:
+            self.grabbed += 1
+        return ok
+
+    def position(self):
+        """
+        Returns:
+            int: number of the grabbed frame, starting from 1
+        """
+        return int(self.video.get(cv2.CAP_PROP_POS_FRAMES))
+
+    def retrieve(self):
+        """
+        Decodes grabbed frame into free buffer.
+        Returns:
+            np.ndarray | None: BGR frame, None if it can't be decoded
+        """
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+        start = time.perf_counter()
+        ok, frame = self.video.retrieve(buffer)
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        if self.timings is not None:
+            self.timings.observe("decode", seconds)
+        if not ok:
+            self.release(buffer)
+            return None
+        if frame is not buffer:
+            self.allocated += 1
+        self.retrieved += 1
+        return frame
+
+    def release(self, frame):
+        """
+        Returns frame buffer to decoder, frame mustn't be used after.
+        Args:
+            frame (np.ndarray | None): frame got from retrieve
+
+        Returns:
+            None:
+        """
+        if frame is None:
+            return
+        with self._lock:
+            if len(self._free) < self.pool_size:
+                self._free.append(frame)
+
+    def stats(self):
+        """
+        Returns:
+            dict: decoded frames, allocated buffers and throughput
+        """
+        return {
+            "grabbed": self.grabbed,
+            "retrieved": self.retrieved,
+            "allocated_buffers": self.allocated,
+            "seconds": round(self.seconds, 3),
+            "fps": round(self.grabbed / self.seconds, 1)
+            if self.seconds else None,
+        }
@@ -0,0 +1,443 @@
+import contextlib
+import os
+import threading
+import time
+
+import cv2
+
+from libs.face_recognition import ALG, DetectorBackendEnum
+from libs.face_recognition.gallery import lbp_histogram
+
+import numpy as np
+
+from settings import DNN_BATCH_SIZE, DNN_CONFIDENCE, DNN_CONFIG, \
+    DNN_INPUT_SIZE, DNN_MODEL, LBP_CASCADE
+
+
+# haar cascade window, smaller faces can't be found anyway
+MIN_CASCADE_SIZE = 24
+
+
+class CascadePool:
+    """
+    Process wide pool of cascade classifiers.
+    Cascade file is read from disk once, every detecting thread
+    borrows its own classifier, because detectMultiScale isn't
+    documented as thread safe. Classifiers are reused across jobs.
+    """
+    def __init__(self):
+        self.created = 0
+        self.load_seconds = 0.0
+        self._sources = {}
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def _create(self, path):
+        """
+        Args:
+            path (str): cascade file path
+
+        Returns:
+            cv2.CascadeClassifier: new classifier
+        """
+        started = time.perf_counter()
+        model = self._load(path)
+        with self._lock:
+            self.created += 1
+            self.load_seconds += time.perf_counter() - started
+        return model
+
+    def _load(self, path):
+        """
+        Args:
+            path (str): cascade file path
+
+        Returns:
+            cv2.CascadeClassifier: loaded classifier
+        """
+        with self._lock:
+            source = self._sources.get(path)
+            if source is None:
+                with open(path) as file:
+                    source = self._sources[path] = file.read()
+
+        storage = cv2.FileStorage(
+            source, cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+        cascade = cv2.CascadeClassifier()
+        # old format cascades can be loaded only from file
+        if not cascade.read(storage.getFirstTopLevelNode()):
+            cascade = cv2.CascadeClassifier(path)
+        storage.release()
+        if cascade.empty():
+            raise ValueError(f"Cascade {path} can't be loaded")
+        return cascade
+
+    @contextlib.contextmanager
+    def acquire(self, path):
+        """
+        Borrows classifier for the calling thread.
+        Args:
+            path (str): cascade file path
+
+        Yields:
+            cv2.CascadeClassifier: classifier
+        """
+        with self._lock:
+            free = self._free.setdefault(path, [])
+            cascade = free.pop() if free else None
+        if cascade is None:
+            cascade = self._create(path)
+        try:
+            yield cascade
+        finally:
+            with self._lock:
+                self._free[path].append(cascade)
+
+    def warm_up(self, path, count=1):
+        """
+        Creates classifiers in advance, so jobs don't pay load cost.
+        Args:
+            path (str): cascade file path
+            count (int): number of classifiers, e.g. detecting threads
+
+        Returns:
+            float: seconds spent
+        """
+        started = time.perf_counter()
+        with self._lock:
+            missing = count - len(self._free.setdefault(path, []))
+        cascades = [self._create(path) for _ in range(missing)]
+        with self._lock:
+            self._free[path].extend(cascades)
+        return time.perf_counter() - started
+
+    def stats(self):
+        """
+        Returns:
+            dict: number of created classifiers and their load time
+        """
+        return {
+            "created": self.created,
+            "load_seconds": round(self.load_seconds, 3),
+        }
+
+
+class NetPool(CascadePool):
+    """Pool of cv2.dnn networks, Net isn't thread safe either."""
+    def _load(self, path):
+        """
+        Args:
+            path (tuple): model and config file paths
+
+        Returns:
+            cv2.dnn.Net: network running on CPU
+        """
+        net = cv2.dnn.readNet(*path)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return net
+
+
+cascade_pool = CascadePool()
+net_pool = NetPool()
+
+
+class FaceDetector:
+    """
+    Haar cascade face detector which can run on downscaled frame.
+    Boxes are mapped back to full resolution, so crops keep quality.
+    Base class of detector backends, backends only find boxes
+    on downscaled images.
+    """
+    backend = DetectorBackendEnum.HAAR
+    # backend needs BGR frames instead of grayscale ones
+    color = False
+
+    def __init__(
+            self, height=0, scale_factor=1.1, min_neighbors=5,
+            min_size=100, path=None):
+        """
+        Sets detector parameters.
+        Args:
+            height (int): detection frame height, 0 for full resolution
+            scale_factor (float): detectMultiScale scale factor
+            min_neighbors (int): detectMultiScale min neighbors
+            min_size (int): min face side on full resolution frame
+            path (str | None): cascade file path
+        """
+        self.face_cascade_path = path or cv2.data.haarcascades + ALG
+        self.height = int(height)
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.batch_size = 1
+
+    @classmethod
+    def from_dict(cls, data, height=0, backend="haar"):
+        """
+        Creates detector of requested backend from kafka message params.
+        Args:
+            data (dict | None): {"height": 720, "backend": "lbp"}
+            height (int): default detection height
+            backend (str): default backend
+
+        Returns:
+            FaceDetector: detector
+        """
+        data = data or {}
+        backend = DetectorBackendEnum(data.get("backend", backend))
+        return _BACKENDS[backend](height=data.get("height", height))
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: detector params, e.g. for worker processes
+        """
+        return {"height": self.height, "backend": self.backend.value}
+
+    def warm_up(self, count=1):
+        """
+        Loads classifiers for detecting threads in advance.
+        Args:
+            count (int): number of detecting threads
+
+        Returns:
+            float: seconds spent
+        """
+        return cascade_pool.warm_up(self.face_cascade_path, count)
+
+    def scale(self, frame_height):
+        """
+        Args:
+            frame_height (int): full resolution frame height
+
+        Returns:
+            float: detection frame scale, 1 means no downscaling
+        """
+        if self.height <= 0 or frame_height <= self.height:
+            return 1.0
+        return self.height / frame_height
+
+    def detect(self, image):
+        """
+        Detects faces.
+        Args:
+            image (np.ndarray): full resolution grayscale frame,
+                BGR frame for color backends
+
+        Returns:
+            list: (x, y, w, h) boxes on full resolution frame
+        """
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        """
+        Detects faces on several frames.
+        Args:
+            images (list): full resolution frames of the same size
+
+        Returns:
+            list: boxes of every frame
+        """
+        if not images:
+            return []
+        frame_height, frame_width = images[0].shape[:2]
+        scale = self.scale(frame_height)
+        smalls = images
+        if scale < 1:
+            size = (round(frame_width * scale), round(frame_height * scale))
+            smalls = [
+                cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+                for image in images
+            ]
+        min_size = max(MIN_CASCADE_SIZE, round(self.min_size * scale))
+
+        result = []
+        for faces in self._find(smalls, min_size):
+            boxes = []
+            for (x, y, w, h) in faces:
+                x, y = max(0, int(x / scale)), max(0, int(y / scale))
+                w = min(int(round(w / scale)), frame_width - x)
+                h = min(int(round(h / scale)), frame_height - y)
+                if w > 0 and h > 0:
+                    boxes.append((x, y, w, h))
+            result.append(boxes)
+        return result
+
+    def _find(self, smalls, min_size):
+        """
+        Finds faces on downscaled frames.
+        Args:
+            smalls (list): downscaled frames
+            min_size (int): min face side on downscaled frame
+
+        Returns:
+            list: (x, y, w, h) boxes of every frame
+        """
+        with cascade_pool.acquire(self.face_cascade_path) as cascade:
+            return [
+                cascade.detectMultiScale(
+                    small, scaleFactor=self.scale_factor,
+                    minNeighbors=self.min_neighbors,
+                    minSize=(min_size, min_size))
+                for small in smalls
+            ]
+
+
+class LbpFaceDetector(FaceDetector):
+    """
+    LBP cascade detector, several times faster than Haar cascade
+    with lower recall. The cascade is a part of OpenCV sources and
+    system packages, but not of pip wheels, so path is configured.
+    """
+    backend = DetectorBackendEnum.LBP
+
+    def __init__(self, height=0, path=LBP_CASCADE, **kwargs):
+        """
+        Sets detector parameters.
+        Args:
+            height (int): detection frame height, 0 for full resolution
+            path (str): LBP cascade file path
+            kwargs: FaceDetector parameters
+        """
+        if not os.path.isfile(path):
+            raise ValueError(f"LBP cascade {path} isn't found")
+        super().__init__(height=height, path=path, **kwargs)
+
+
+class DnnFaceDetector(FaceDetector):
+    """
+    cv2.dnn SSD face detector running on CPU, e.g. OpenCV
+    res10_300x300 caffe model. Several frames are passed to network
+    as one blob, batch_size frames are collected by pipeline.
+    """
+    backend = DetectorBackendEnum.DNN
+    color = True
+
+    def __init__(
+            self, height=0, model=DNN_MODEL, config=DNN_CONFIG,
+            confidence=DNN_CONFIDENCE, input_size=DNN_INPUT_SIZE,
+            batch_size=DNN_BATCH_SIZE, min_size=100):
+        """
+        Sets detector parameters.
+        Args:
+            height (int): detection frame height, 0 for full resolution
+            model (str): model weights path
+            config (str): model config path
+            confidence (float): min detection confidence
+            input_size (int): network input side
+            batch_size (int): max frames in one blob
+            min_size (int): min face side on full resolution frame
+        """
+        super().__init__(height=height, min_size=min_size)
+        if not model:
+            raise ValueError("dnn detector model isn't configured")
+        if not os.path.isfile(model):
+            raise ValueError(f"dnn detector model {model} isn't found")
+        self.model = (model, config)
+        self.confidence = confidence
+        self.input_size = input_size
+        self.batch_size = max(1, batch_size)
+
+    def warm_up(self, count=1):
+        """
+        Loads networks for detecting threads in advance.
+        Args:
+            count (int): number of detecting threads
+
+        Returns:
+            float: seconds spent
+        """
+        return net_pool.warm_up(self.model, count)
+
+    def _find(self, smalls, min_size):
+        """
+        Finds faces on downscaled BGR frames with one forward pass.
+        Args:
+            smalls (list): downscaled frames
+            min_size (int): min face side on downscaled frame
+
+        Returns:
+            list: (x, y, w, h) boxes of every frame
+        """
+        height, width = smalls[0].shape[:2]
+        blob = cv2.dnn.blobFromImages(
+            smalls, 1.0, (self.input_size, self.input_size),
+            (104.0, 177.0, 123.0))
+        with net_pool.acquire(self.model) as net:
+            net.setInput(blob)
+            # [1, 1, N, 7]: image, label, confidence, x1, y1, x2, y2
+            detections = net.forward().reshape(-1, 7)
+
+        result = [[] for _ in smalls]
+        detections = detections[detections[:, 2] >= self.confidence]
+        corners = np.clip(detections[:, 3:7], 0, 1) \
+            * np.array([width, height, width, height])
+        for image, (x1, y1, x2, y2) in zip(
+                detections[:, 0].astype(int), corners.astype(int)):
+            w, h = x2 - x1, y2 - y1
+            if min(w, h) >= min_size and 0 <= image < len(result):
+                result[image].append((x1, y1, w, h))
+        return result
+
+
+_BACKENDS = {
+    DetectorBackendEnum.HAAR: FaceDetector,
+    DetectorBackendEnum.LBP: LbpFaceDetector,
+    DetectorBackendEnum.DNN: DnnFaceDetector,
+}
+
+
+def _timed(timings, stage):
+    """
+    Args:
+        timings (StageTimings | None): job timings
+        stage (str): stage name
+
+    Returns:
+        contextlib.AbstractContextManager: measures stage if timings
+            are given
+    """
+    return timings.time(stage) if timings else contextlib.nullcontext()
+
+
+def extract_faces(detector, frame, timings=None):
+    """
+    Detects faces on frame and computes their gallery descriptors.
+    Args:
+        detector (FaceDetector): detector
+        frame (cv2.typing.MatLike): BGR frame
+        timings (StageTimings | None): job timings
+
+    Returns:
+        list: face crops with their descriptors and boxes
+    """
+    return extract_faces_batch(detector, [frame], timings)[0]
+
+
+def extract_faces_batch(detector, frames, timings=None):
+    """
+    Detects faces on several frames with one detector call.
+    Args:
+        detector (FaceDetector): detector
+        frames (list): BGR frames of the same size
+        timings (StageTimings | None): job timings
+
+    Returns:
+        list: face crops with their descriptors and boxes of every frame
+    """
+    with _timed(timings, "gray"):
+        grays = [
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    with _timed(timings, "detect"):
+        batch = detector.detect_batch(frames if detector.color else grays)
+
+    result = []
+    with _timed(timings, "descriptor"):
+        for gray, boxes in zip(grays, batch):
+            faces = []
+            for (x, y, w, h) in boxes:
+                crop = gray[y:y + h, x:x + w].copy()
+                faces.append((crop, lbp_histogram(crop), (x, y, w, h)))
+            result.append(faces)
+    return result
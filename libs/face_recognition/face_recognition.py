@@ -1,85 +1,170 @@
 import logging
 import time
-import uuid
-from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 
 from app import redis_service
 
-from libs.face_recognition import ALG, FaceRecognitionStatusEnum
+from libs.face_recognition import ControlCommandEnum, \
+    DetectorBackendEnum, FaceRecognitionStatusEnum, RecognitionEngineEnum
+from libs.face_recognition.checkpoint import CheckpointWriter
+from libs.face_recognition.codec import decode_face, encode_face
+from libs.face_recognition.control import JobControl
+from libs.face_recognition.decoder import FrameDecoder
+from libs.face_recognition.detection import FaceDetector, cascade_pool, \
+    extract_faces, extract_faces_batch, net_pool
+from libs.face_recognition.gallery import FaceGallery, person_id
+from libs.face_recognition.motion import MotionGate
+from libs.face_recognition.pipeline import FramePipeline
+from libs.face_recognition.process_pipeline import ProcessFramePipeline, \
+    WorkerDiedError
+from libs.face_recognition.progress import ProgressStream
+from libs.face_recognition.sampling import SamplingPolicy
+from libs.face_recognition.seek import add_keyframe, is_keyframe, \
+    seek_to_frame
+from libs.face_recognition.segments import segment_key
+from libs.face_recognition.tracking import FaceTracker
+from libs.metrics.histogram import StageTimings
 
-import numpy as np
+from settings import CHECKPOINT_FRAMES, CHECKPOINT_INTERVAL, \
+    DECODE_QUEUE_SIZE, DETECT_BACKEND, DETECT_HEIGHT, MATCH_QUEUE_SIZE, \
+    MOTION_THRESHOLD, MOTION_THUMB_WIDTH, NUM_MAX_THREADS, \
+    PROGRESS_INTERVAL, PROGRESS_MAXLEN, RECOGNITION_ENGINE, RING_SLOTS, \
+    TRACK_MAX_GAP, TRACK_MIN_IOU, TRACK_REVALIDATE
 
-from settings import NUM_MAX_THREADS
+
+_STOP_COMMANDS = {
+    ControlCommandEnum.PAUSE: FaceRecognitionStatusEnum.PAUSE,
+    ControlCommandEnum.CANCEL: FaceRecognitionStatusEnum.CANCEL,
+}
+_STOPPED_STATUSES = tuple(_STOP_COMMANDS.values())
+_FINAL_STATUSES = _STOPPED_STATUSES + (FaceRecognitionStatusEnum.FAILED,)
+# checkpoint of these statuses is continued, not started again
+_CONTINUED_STATES = tuple(
+    form
+    for status in (FaceRecognitionStatusEnum.RESUME,
+                   FaceRecognitionStatusEnum.PAUSE)
+    for form in (str(status), status.value)
+)
 
 
 class FaceRecognition:
     """Service for using opencv face recognition."""
-    def __init__(self, file_id, video_path, threshold=80):
+    def __init__(self, file_id, video_path, threshold=80, params=None,
+                 segment=None):
         """
         Sets model’s parameters.
         Args:
             file_id (str): file id
             video_path (str): path to video
             threshold (int): model’s threshold
+            params (dict | None): job params from kafka message
+            segment (dict | None): frame range of video from kafka
+                message, whole video if None
         """
-        self.face_cascade_path = cv2.data.haarcascades + ALG
-        self.face_cascade = cv2.CascadeClassifier(self.face_cascade_path)
+        started = time.perf_counter()
         self.faces_list = []
         self.names_list = []
         self.threshold = threshold
+        self.gallery = FaceGallery(threshold=threshold)
         self.video_path = video_path
         self.video = cv2.VideoCapture(self.video_path)
         self.frame_count = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
         self.frame_num = int(self.video.get(cv2.CAP_PROP_POS_FRAMES))
         self.file_id = file_id
+        self.segment = segment
+        self.state_key = file_id
+        self.end_frame = None
+        if segment is not None:
+            self.state_key = segment_key(file_id, segment["index"])
+            self.end_frame = segment["end"]
+            self.frame_count = min(self.frame_count, self.end_frame)
         self.status = FaceRecognitionStatusEnum.PROCESS
         self.persons = 0
+        self.stats = {}
+        self.params = params or {}
+        self.sampling = SamplingPolicy.from_dict(self.params.get("sampling"))
+        self.motion_gate = MotionGate.from_dict(
+            self.params.get("motion"),
+            threshold=MOTION_THRESHOLD,
+            thumb_width=MOTION_THUMB_WIDTH
+        )
+        self.detector = FaceDetector.from_dict(
+            self.params.get("detection"),
+            height=DETECT_HEIGHT,
+            backend=DETECT_BACKEND
+        )
+        self.tracker = FaceTracker.from_dict(
+            self.params.get("tracking"),
+            min_iou=TRACK_MIN_IOU,
+            max_gap=TRACK_MAX_GAP,
+            revalidate=TRACK_REVALIDATE
+        )
+        self.last_read_frame = self.frame_num
+        self.decoder = None
+        self.keyframes = []
+        self._keyframes_sent = 0
+        self.timings = StageTimings()
+        self.control = JobControl(redis_service, file_id)
+        self.progress = ProgressStream(
+            redis_service, self.state_key,
+            interval=PROGRESS_INTERVAL, maxlen=PROGRESS_MAXLEN,
+            timings=self.timings)
+        self.checkpoint = CheckpointWriter(
+            redis_service, self.state_key,
+            interval=CHECKPOINT_INTERVAL, frames=CHECKPOINT_FRAMES,
+            timings=self.timings)
+        self.stats["setup_seconds"] = round(
+            time.perf_counter() - started, 3)
 
     def process(self):
         """
         Process of recognition faces in video by frames.
-        Writes id as uuid4.
+        Writes id as uuid5 of file id and frame, where person
+        is found first.
         Returns:
             tuple: with list of faces and list of names
-        """
-        pool = ThreadPoolExecutor(max_workers=NUM_MAX_THREADS)
 
-        # redis_data = redis_service.get(self.file_id)
-        # self.status = redis_data.get("status")
-        # if self.status == FaceFaceRecognitionStatusEnum.READY:
-        #     return
-
-        while True:
-            if self.status == FaceRecognitionStatusEnum.RESUME:
-                resume_data = redis_service.get(self.file_id)
-                self.faces_list = resume_data.get("faces_list")
-                self.names_list = resume_data.get("names_list")
-                self.frame_num = resume_data.get("frame")
-                self.persons = resume_data.get("persons")
-
-                logging.info(
-                    f"\nFile id: {self.file_id} | Resume\n"
-                    f"Frame: {self.frame_num}")
-                for i in range(self.frame_num + 1):
-                    self.video.read()
-                    self.frame_num += 1
-                self.status = FaceRecognitionStatusEnum.PROCESS
-
-            ret, frame = self.video.read()
-
-            if not ret:
-                break
+        Raises:
+            WorkerDiedError: detector process died, job is marked failed
+        """
+        redis_data = redis_service.get(
+            self.state_key, list_to_np_array=False)
+        # paused job isn't reset, stored pause command stops it again
+        if redis_data and redis_data.get("status") in _CONTINUED_STATES:
+            self.status = FaceRecognitionStatusEnum.RESUME
 
-            self.frame_num = int(self.video.get(cv2.CAP_PROP_POS_FRAMES))
-            pool.submit(self._process_frame, frame, self.frame_num)
+        if self.status == FaceRecognitionStatusEnum.RESUME:
+            self._resume(self.checkpoint.load())
+        else:
+            self.checkpoint.reset()
+            if self.segment is not None:
+                self._seek_segment()
 
-        pool.shutdown(wait=True)
+        self.control.start()
+        self.progress.start(self.frame_num)
+        error = None
+        try:
+            self.stats["pipeline"] = self._create_pipeline().run()
+        except WorkerDiedError as e:
+            # frames of dead worker are lost, result isn't complete
+            error = e
+            self.status = FaceRecognitionStatusEnum.FAILED
+        finally:
+            self.control.stop()
+        self.stats["decode"] = self.decoder.stats()
+        self.stats["motion"] = self.motion_gate.stats()
+        self.stats["tracking"] = self.tracker.stats()
+        self.stats["cascades"] = cascade_pool.stats()
+        if self.detector.backend == DetectorBackendEnum.DNN:
+            self.stats["nets"] = net_pool.stats()
         self._close()
 
-        if self.frame_num == self.frame_count:
-            self.status = FaceRecognitionStatusEnum.READY
+        if self.status not in _FINAL_STATUSES:
+            # frames after the last sampled one are skipped, not lost
+            self.frame_num = max(self.frame_num, self.last_read_frame)
+            if self.frame_num == self.frame_count:
+                self.status = FaceRecognitionStatusEnum.READY
 
         logging.info(
             f"\n-----\n"
@@ -87,70 +172,258 @@ class FaceRecognition:
             f"Frame: {self.frame_num}/{self.frame_count}\n"
             f"Persons: {self.persons}\n"
             f"Status: {self.status}\n"
+            f"Stats: {self.stats}\n"
             f"-----\n")
 
-        redis_service.update(
-            self.file_id,
-            {
-                "file_id": self.file_id,
-                "faces_list": self.faces_list,
-                "names_list": self.names_list,
-                "status": str(self.status),
-                "frame": f"{str(self.frame_num)}/{str(self.frame_count)}",
-                "persons": str(self.persons),
-                "filepath": self.video_path
-            }
-        )
+        self._sync_keyframes()
+        self.stats["checkpoint"] = self.checkpoint.stats()
+        self.stats["timings"] = self.timings.stats()
+        # stopped marks the final flush, paused job is resumable after it
+        final = dict(self._progress(), stats=self.stats, stopped=True)
+        if error is not None:
+            final["error"] = str(error)
+        self.checkpoint.flush(self.frame_num, final)
+        self.progress.update(
+            self.frame_num, self.frame_count, self.persons, self.status,
+            force=True)
+        if error is not None:
+            raise error
         return self.faces_list, self.names_list
 
-    def _process_frame(self, frame, frame_num):
+    def pause(self):
+        """
+        Pauses job before its next frame like pause command, e.g. when
+        consumer is stopping. Paused job is resumed from checkpoint.
+        Returns:
+            None:
+        """
+        self.control.command = ControlCommandEnum.PAUSE
+
+    def _resume(self, resume_data):
+        """
+        Restores state from redis and seeks to the checkpoint frame.
+        Args:
+            resume_data (dict): state saved in redis
+
+        Returns:
+            None:
+        """
+        self.faces_list = [
+            decode_face(face) for face in resume_data.get("faces_list", [])]
+        self.names_list = resume_data.get("names_list", [])
+        self.frame_num = int(str(resume_data.get("frame", 0)).split("/")[0])
+        self.persons = int(resume_data.get("persons", 0))
+        self.keyframes = resume_data.get("keyframes", [])
+        self._keyframes_sent = len(self.keyframes)
+        self.gallery = FaceGallery.from_faces(
+            self.faces_list, threshold=self.threshold)
+
+        self.video, method, seconds = seek_to_frame(
+            self.video_path, self.video, self.frame_num, self.keyframes)
+        self.last_read_frame = self.frame_num
+        self.stats["resume"] = {
+            "frame": self.frame_num,
+            "method": method.value,
+            "seconds": round(seconds, 3),
+        }
+        logging.info(
+            f"\nFile id: {self.file_id} | Resume\n"
+            f"Frame: {self.frame_num}\n"
+            f"Seek: {method.value}, {seconds:.3f}s")
+        self.status = FaceRecognitionStatusEnum.PROCESS
+
+    def _seek_segment(self):
+        """
+        Seeks to the first frame of segment.
+        Returns:
+            None:
+        """
+        start = self.segment["start"]
+        self.video, method, seconds = seek_to_frame(
+            self.video_path, self.video, start)
+        self.frame_num = self.last_read_frame = start
+        logging.info(
+            f"\nFile id: {self.file_id} | Segment "
+            f"{self.segment['index'] + 1}/{self.segment['count']}\n"
+            f"Frames: {start}-{self.segment['end']}\n"
+            f"Seek: {method.value}, {seconds:.3f}s")
+
+    def _progress(self):
+        """
+        Returns:
+            dict: progress part of checkpoint
+        """
+        progress = {
+            "file_id": self.file_id,
+            "status": str(self.status),
+            "frame": f"{str(self.frame_num)}/{str(self.frame_count)}",
+            "persons": str(self.persons),
+            "filepath": self.video_path,
+            "params": self.params,
+        }
+        if self.segment is not None:
+            progress["segment"] = self.segment
+        return progress
+
+    def _sync_keyframes(self):
+        """
+        Queues key frames found by decoder since the last call.
+        Returns:
+            None:
+        """
+        found = len(self.keyframes)
+        for keyframe in self.keyframes[self._keyframes_sent:found]:
+            self.checkpoint.append("keyframes", keyframe)
+        self._keyframes_sent = found
+
+    def _create_pipeline(self):
+        """
+        Creates pipeline of engine from settings.
+        Returns:
+            FramePipeline | ProcessFramePipeline: pipeline
+        """
+        engine = RecognitionEngineEnum(RECOGNITION_ENGINE)
+        if engine == RecognitionEngineEnum.PROCESS:
+            # frames are copied to shared memory right away
+            self.decoder = FrameDecoder(
+                self.video, pool_size=2, timings=self.timings)
+            return ProcessFramePipeline(
+                self._read_frames(),
+                self.detector,
+                self._match_faces,
+                ring_slots=RING_SLOTS,
+                release=self.decoder.release,
+                timings=self.timings,
+            )
+        self.decoder = FrameDecoder(
+            self.video,
+            pool_size=DECODE_QUEUE_SIZE
+            + NUM_MAX_THREADS * self.detector.batch_size + 1,
+            timings=self.timings
+        )
+        return FramePipeline(
+            self._read_frames(),
+            self._detect_faces,
+            self._match_faces,
+            workers=NUM_MAX_THREADS,
+            decode_queue_size=DECODE_QUEUE_SIZE,
+            match_queue_size=MATCH_QUEUE_SIZE,
+            detect_batch=self._detect_faces_batch,
+            batch_size=self.detector.batch_size,
+            release=self.decoder.release,
+        )
+
+    def _read_frames(self):
+        """
+        Decodes sampled frames of video, other frames are only grabbed.
+        Frames without changes since the last analysed one are gated,
+        they are yielded without frame, so match stage still counts
+        them in order. Reading stops at the end of segment. Runs in
+        pipeline decode thread, pipeline returns frames to decoder
+        after detection.
+        Yields:
+            tuple: frame number and cv2 frame or None for gated frame
+        """
+        while self.end_frame is None or self.last_read_frame < self.end_frame:
+            if self._is_stopped():
+                break
+            if not self.decoder.grab():
+                break
+            frame_num = self.decoder.position()
+            self.last_read_frame = frame_num
+            if is_keyframe(self.video):
+                add_keyframe(self.keyframes, frame_num - 1)
+            if not self.sampling.is_sampled(frame_num - 1, self.video):
+                continue
+            frame = self.decoder.retrieve()
+            if frame is None:
+                continue
+            if self.motion_gate.is_static(frame):
+                self.decoder.release(frame)
+                frame = None
+            yield frame_num, frame
+
+    def _detect_faces(self, frame_num, frame):
         """
-        Frame processing.
+        Detects faces on frame, called from pipeline worker threads.
         Args:
+            frame_num (int): current frame number
             frame (cv2.typing.MatLike): cv2 frame
+
+        Returns:
+            list | None: face crops with their descriptors,
+                None if paused
+        """
+        if self.status in _STOPPED_STATUSES:
+            return None
+
+        return extract_faces(self.detector, frame, self.timings)
+
+    def _detect_faces_batch(self, frame_nums, frames):
+        """
+        Detects faces on several frames, called from pipeline
+        worker threads for detectors which process batches.
+        Args:
+            frame_nums (list): frame numbers
+            frames (list): cv2 frames
+
+        Returns:
+            list: result of _detect_faces for every frame
+        """
+        if self.status in _STOPPED_STATUSES:
+            return [None] * len(frames)
+
+        return extract_faces_batch(self.detector, frames, self.timings)
+
+    def _match_faces(self, frame_num, faces):
+        """
+        Matches faces of frame with known persons,
+        called from pipeline match thread in frame order.
+        Faces continuing a track inherit its identity,
+        only new tracks and periodic validations use gallery.
+        Args:
             frame_num (int): current frame number
+            faces (list | None): face crops with their descriptors
+                and boxes, None if frame hasn't been detected,
+                e.g. gated frame, then only progress is moved
 
         Returns:
             None:
         """
-        if self.status == FaceRecognitionStatusEnum.PAUSE:
-            logging.info(
-                f"File id: {self.file_id} | Paused by user"
-                f"Frame: {self.frame_num}")
+        # frames detected before pause are done again on resume
+        if self.status in _STOPPED_STATUSES:
+            return
+        self.frame_num = frame_num
+        if faces is None:
+            self.checkpoint.update(frame_num, self._progress)
+            self.progress.update(
+                frame_num, self.frame_count, self.persons, self.status)
             return
+        tracks = self.tracker.update(frame_num, [box for *_, box in faces])
+        for i, ((cur_face, descriptor, _), track) in enumerate(
+                zip(faces, tracks)):
+            if not self.tracker.needs_validation(track, frame_num):
+                continue
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(
-            gray, scaleFactor=1.1, minNeighbors=5, minSize=(100, 100))
-
-        for (x, y, w, h) in faces:
-            cur_face = gray[y:y + h, x:x + w]
-            rec = cv2.face.LBPHFaceRecognizer.create()
-            rec.train([cur_face], np.array(0))
-            f = True
-            for face in self.faces_list:
-                _, confidence = rec.predict(face)
-                if confidence < self.threshold:
-                    f = False
-
-            if f:
-                label = str(uuid.uuid4())
-                self.faces_list.append(cur_face.tolist())
-                self.names_list.append(label)
-                self.persons += 1
-
-        redis_service.update(
-            self.file_id,
-            {
-                "file_id": self.file_id,
-                "faces_list": self.faces_list,
-                "names_list": self.names_list,
-                "status": str(self.status),
-                "frame": f"{str(self.frame_num)}/{str(self.frame_count)}",
-                "persons": str(self.persons),
-                "filepath": self.video_path
-            }
-        )
+            with self.timings.time("match"):
+                index, distance = self.gallery.nearest(descriptor)
+            if distance < self.threshold:
+                track.validate(self.names_list[index], frame_num)
+                continue
+
+            label = person_id(self.file_id, frame_num, i)
+            self.gallery.add(descriptor)
+            self.faces_list.append(cur_face)
+            self.names_list.append(label)
+            self.checkpoint.append("faces_list", encode_face(cur_face))
+            self.checkpoint.append("names_list", label)
+            self.persons += 1
+            track.validate(label, frame_num)
+
+        self._sync_keyframes()
+        self.checkpoint.update(frame_num, self._progress)
+        self.progress.update(
+            frame_num, self.frame_count, self.persons, self.status)
         logging.info(
             f"\n-----\n"
             f"File id: {self.file_id}\n"
@@ -159,6 +432,23 @@ class FaceRecognition:
             f"Status: {self.status}\n"
             f"-----\n")
 
+    def _is_stopped(self):
+        """
+        Applies pause or cancel command got from control channel,
+        called from decode thread before every frame.
+        Returns:
+            bool: True if job must stop reading frames
+        """
+        command = self.control.command
+        if command not in _STOP_COMMANDS:
+            return False
+
+        self.status = _STOP_COMMANDS[command]
+        logging.info(
+            f"File id: {self.file_id} | {command.value} by user\n"
+            f"Frame: {self.frame_num}")
+        return True
+
     def _close(self):
         """
         Closes video and destroys all windows.
@@ -166,5 +456,9 @@ class FaceRecognition:
             None:
         """
         self.video.release()
-        cv2.destroyAllWindows()
+        try:
+            cv2.destroyAllWindows()
+        except cv2.error:
+            # headless opencv builds have no windows
+            pass
         logging.info(f"File: {self.file_id} | All windows destroys")
@@ -0,0 +1,237 @@
+import math
+import uuid
+
+import numpy as np
+
+
+LBP_RADIUS = 1
+LBP_NEIGHBORS = 8
+LBP_GRID_X = 8
+LBP_GRID_Y = 8
+LBP_PATTERNS = 2 ** LBP_NEIGHBORS
+DESCRIPTOR_SIZE = LBP_GRID_X * LBP_GRID_Y * LBP_PATTERNS
+
+_FLOAT_EPSILON = np.finfo(np.float32).eps
+_DOUBLE_EPSILON = np.float32(np.finfo(np.float64).eps)
+
+
+def _elbp(src):
+    """
+    Extended local binary patterns, same as opencv LBPH uses
+    with radius 1 and 8 neighbors.
+    Args:
+        src (np.ndarray): grayscale face crop
+
+    Returns:
+        np.ndarray: lbp codes, shape (rows - 2, cols - 2)
+    """
+    src = src.astype(np.float32, copy=False)
+    rows, cols = src.shape
+    r = LBP_RADIUS
+    center = src[r:rows - r, r:cols - r]
+    dst = np.zeros(center.shape, dtype=np.int32)
+
+    for n in range(LBP_NEIGHBORS):
+        x = np.float32(r * math.cos(2.0 * math.pi * n / LBP_NEIGHBORS))
+        y = np.float32(-r * math.sin(2.0 * math.pi * n / LBP_NEIGHBORS))
+        fx, fy = int(math.floor(x)), int(math.floor(y))
+        cx, cy = int(math.ceil(x)), int(math.ceil(y))
+        ty, tx = y - fy, x - fx
+        w1 = (1 - tx) * (1 - ty)
+        w2 = tx * (1 - ty)
+        w3 = (1 - tx) * ty
+        w4 = tx * ty
+
+        t = (w1 * src[r + fy:rows - r + fy, r + fx:cols - r + fx]
+             + w2 * src[r + fy:rows - r + fy, r + cx:cols - r + cx]
+             + w3 * src[r + cy:rows - r + cy, r + fx:cols - r + fx]
+             + w4 * src[r + cy:rows - r + cy, r + cx:cols - r + cx])
+        bit = (t > center) | (np.abs(t - center) < _FLOAT_EPSILON)
+        dst += bit.astype(np.int32) << n
+    return dst
+
+
+def lbp_histogram(face):
+    """
+    Computes LBPH spatial histogram of face crop.
+    The result is the same vector cv2.face.LBPHFaceRecognizer
+    keeps after training on a single crop.
+    Args:
+        face (np.ndarray): grayscale face crop
+
+    Returns:
+        np.ndarray: float32 vector with DESCRIPTOR_SIZE items
+    """
+    lbp = _elbp(np.asarray(face, dtype=np.uint8))
+    height = lbp.shape[0] // LBP_GRID_Y
+    width = lbp.shape[1] // LBP_GRID_X
+    if not height or not width:
+        return np.zeros(DESCRIPTOR_SIZE, dtype=np.float32)
+
+    cells = lbp[:height * LBP_GRID_Y, :width * LBP_GRID_X].reshape(
+        LBP_GRID_Y, height, LBP_GRID_X, width).transpose(0, 2, 1, 3)
+    cells = cells.reshape(LBP_GRID_Y * LBP_GRID_X, height * width)
+    offsets = np.arange(LBP_GRID_Y * LBP_GRID_X)[:, None] * LBP_PATTERNS
+    counts = np.bincount(
+        (cells + offsets).ravel(), minlength=DESCRIPTOR_SIZE)
+    return counts.astype(np.float32) / np.float32(height * width)
+
+
+class FaceGallery:
+    """
+    Gallery of known persons.
+    Keeps one LBPH descriptor per person in contiguous matrix,
+    new face is compared with all of them in one batched computation.
+    """
+    def __init__(self, threshold=80, capacity=64, chunk_size=256):
+        """
+        Sets gallery parameters.
+        Args:
+            threshold (int): LBPH confidence threshold
+            capacity (int): initial number of preallocated rows
+            chunk_size (int): rows compared at once, limits memory
+        """
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self._descriptors = np.empty(
+            (capacity, DESCRIPTOR_SIZE), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def descriptors(self):
+        """
+        Returns:
+            np.ndarray: view on filled rows of gallery matrix
+        """
+        return self._descriptors[:self._size]
+
+    @classmethod
+    def from_faces(cls, faces, threshold=80):
+        """
+        Builds gallery from stored face crops.
+        Args:
+            faces (list): face crops
+            threshold (int): LBPH confidence threshold
+
+        Returns:
+            FaceGallery: filled gallery
+        """
+        gallery = cls(threshold=threshold, capacity=max(len(faces), 64))
+        for face in faces:
+            gallery.add(lbp_histogram(face))
+        return gallery
+
+    def add(self, descriptor):
+        """
+        Adds person descriptor to gallery.
+        Args:
+            descriptor (np.ndarray): lbp histogram
+
+        Returns:
+            int: index of added person
+        """
+        if self._size == len(self._descriptors):
+            grown = np.empty(
+                (len(self._descriptors) * 2, DESCRIPTOR_SIZE),
+                dtype=np.float32)
+            grown[:self._size] = self.descriptors
+            self._descriptors = grown
+        self._descriptors[self._size] = descriptor
+        self._size += 1
+        return self._size - 1
+
+    def distances(self, descriptor):
+        """
+        Chi-square distances of descriptor to every person,
+        same values LBPHFaceRecognizer.predict returns as confidence.
+        Args:
+            descriptor (np.ndarray): lbp histogram
+
+        Returns:
+            np.ndarray: float64 distance per person
+        """
+        result = np.empty(self._size, dtype=np.float64)
+        for start in range(0, self._size, self.chunk_size):
+            stop = min(start + self.chunk_size, self._size)
+            chunk = self._descriptors[start:stop]
+            diff = np.subtract(chunk, descriptor)
+            total = np.add(chunk, descriptor)
+            # histogram values are non-negative, so bins with
+            # zero sum also have zero difference and add nothing
+            np.maximum(total, _DOUBLE_EPSILON, out=total)
+            np.multiply(diff, diff, out=diff)
+            np.divide(diff, total, out=diff)
+            result[start:stop] = diff.sum(axis=1)
+        result *= 2
+        return result
+
+    def nearest(self, descriptor):
+        """
+        Finds closest person.
+        Args:
+            descriptor (np.ndarray): lbp histogram
+
+        Returns:
+            tuple: index and distance, (-1, inf) for empty gallery
+        """
+        if not self._size:
+            return -1, float("inf")
+        distances = self.distances(descriptor)
+        index = int(np.argmin(distances))
+        return index, float(distances[index])
+
+    def is_known(self, descriptor):
+        """
+        Checks if face belongs to one of known persons.
+        Args:
+            descriptor (np.ndarray): lbp histogram
+
+        Returns:
+            bool: True if some distance is below threshold
+        """
+        _, distance = self.nearest(descriptor)
+        return distance < self.threshold
+
+
+def person_id(file_id, frame_num, index):
+    """
+    Stable person name, the same for every run of the same video.
+    Args:
+        file_id (str): file id
+        frame_num (int): frame where person is found first
+        index (int): index of face on that frame
+
+    Returns:
+        str: uuid5 of person
+    """
+    name = f"{file_id}/{frame_num}/{index}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+
+def merge_shards(shards, threshold=80):
+    """
+    Reduces galleries built independently, e.g. by video segments.
+    Every face is cross-matched with persons of the previous shards,
+    unknown faces are added. Shards are merged in given order and
+    keep their names, so result doesn't depend on which shard has
+    finished first.
+    Args:
+        shards (list): (faces, names) of every shard
+        threshold (int): LBPH confidence threshold
+
+    Returns:
+        tuple: merged list of faces and list of names
+    """
+    gallery = FaceGallery(threshold=threshold)
+    faces_list, names_list = [], []
+    for faces, names in shards:
+        for face, name in zip(faces, names):
+            descriptor = lbp_histogram(face)
+            if not gallery.is_known(descriptor):
+                gallery.add(descriptor)
+                faces_list.append(face)
+                names_list.append(name)
+    return faces_list, names_list
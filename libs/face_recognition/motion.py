@@ -0,0 +1,99 @@
+import cv2
+
+
+class MotionGate:
+    """
+    Cheap pre-filter in front of face detection.
+    Compares downscaled grayscale thumbnail of frame with thumbnail
+    of the last analysed frame, static frames are skipped.
+    Changed area is measured instead of mean difference, so a small
+    face entering a static scene isn't averaged out.
+    """
+    def __init__(self, threshold=0.002, thumb_width=160, pixel_delta=12):
+        """
+        Sets gate parameters.
+        Args:
+            threshold (float): min share of changed thumbnail pixels
+                to analyse frame, 0 disables gate
+            thumb_width (int): thumbnail width
+            pixel_delta (int): min pixel difference (0-255 scale)
+                to count pixel as changed
+        """
+        self.threshold = float(threshold)
+        self.thumb_width = thumb_width
+        self.pixel_delta = pixel_delta
+        self.analysed = 0
+        self.gated = 0
+        self._reference = None
+
+    @classmethod
+    def from_dict(cls, data, threshold=0.002, thumb_width=160):
+        """
+        Creates gate from kafka message params.
+        Args:
+            data (dict | None): {"threshold": 0.002}
+            threshold (float): default threshold
+            thumb_width (int): default thumbnail width
+
+        Returns:
+            MotionGate: gate
+        """
+        data = data or {}
+        return cls(
+            data.get("threshold", threshold),
+            data.get("thumb_width", thumb_width)
+        )
+
+    def _thumbnail(self, frame):
+        """
+        Args:
+            frame (cv2.typing.MatLike): BGR frame
+
+        Returns:
+            np.ndarray: grayscale thumbnail
+        """
+        height, width = frame.shape[:2]
+        thumb_height = max(1, height * self.thumb_width // width)
+        thumb = cv2.resize(
+            frame, (self.thumb_width, thumb_height),
+            interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+
+    def is_static(self, frame):
+        """
+        Checks if frame hasn't changed since the last analysed frame.
+        Args:
+            frame (cv2.typing.MatLike): BGR frame
+
+        Returns:
+            bool: True if detection can be skipped
+        """
+        if self.threshold <= 0:
+            self.analysed += 1
+            return False
+
+        thumb = self._thumbnail(frame)
+        if self._reference is not None \
+                and self._reference.shape == thumb.shape:
+            diff = cv2.absdiff(thumb, self._reference)
+            changed = cv2.countNonZero(
+                cv2.threshold(
+                    diff, self.pixel_delta, 255, cv2.THRESH_BINARY)[1])
+            if changed < self.threshold * diff.size:
+                self.gated += 1
+                return True
+
+        self._reference = thumb
+        self.analysed += 1
+        return False
+
+    def stats(self):
+        """
+        Returns:
+            dict: numbers of analysed and gated frames
+        """
+        return {
+            "threshold": self.threshold,
+            "analysed": self.analysed,
+            "gated": self.gated,
+        }
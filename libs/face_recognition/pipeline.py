@@ -0,0 +1,264 @@
+import logging
+import queue
+import threading
+import time
+
+
+_STOP = object()
+
+
+class StageQueue:
+    """Bounded queue between pipeline stages which collects occupancy."""
+    def __init__(self, name, maxsize):
+        """
+        Sets queue parameters.
+        Args:
+            name (str): stage name for stats
+            maxsize (int): max number of items in queue
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.items = 0
+        self.max_occupancy = 0
+        self.occupancy_total = 0
+        self.wait_seconds = 0.0
+
+    def put(self, item):
+        """
+        Puts item, blocks while queue is full.
+        Args:
+            item (Any): item
+
+        Returns:
+            None:
+        """
+        start = time.perf_counter()
+        self._queue.put(item)
+        if item is _STOP:
+            return
+        waited = time.perf_counter() - start
+        occupancy = self._queue.qsize()
+        with self._lock:
+            self.items += 1
+            self.wait_seconds += waited
+            self.occupancy_total += occupancy
+            self.max_occupancy = max(self.max_occupancy, occupancy)
+
+    def get(self):
+        """
+        Gets item, blocks while queue is empty.
+        Returns:
+            Any: item
+        """
+        return self._queue.get()
+
+    def get_nowait(self):
+        """
+        Gets item if queue isn't empty.
+        Returns:
+            Any: item or None
+        """
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def stats(self):
+        """
+        Returns:
+            dict: occupancy stats of queue
+        """
+        items = self.items or 1
+        return {
+            "maxsize": self.maxsize,
+            "items": self.items,
+            "max_occupancy": self.max_occupancy,
+            "avg_occupancy": round(self.occupancy_total / items, 2),
+            "put_wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class FramePipeline:
+    """
+    Staged decode -> detect -> match pipeline.
+    Decode and match run in one thread each, detect runs in several
+    worker threads. Stages are connected by bounded queues and the
+    number of frames in flight is limited, so memory doesn't depend
+    on video length. Match stage gets frames in decode order.
+    Worker can take several waiting frames at once for detectors
+    which process batches. Frames without image, e.g. gated ones,
+    aren't detected, match stage gets None result for them in order.
+    """
+    def __init__(
+            self, frames, detect, match, workers=8,
+            decode_queue_size=16, match_queue_size=16,
+            detect_batch=None, batch_size=1, release=None):
+        """
+        Sets pipeline stages.
+        Args:
+            frames (collections.abc.Iterable): yields (frame_num, frame),
+                frame is None if it isn't detected
+            detect (collections.abc.Callable): detect(frame_num, frame),
+                called from worker threads
+            match (collections.abc.Callable): match(frame_num, result),
+                called from match thread in frame order, result is
+                None if frame hasn't been detected
+            workers (int): number of detect threads
+            decode_queue_size (int): max frames waiting for detection
+            match_queue_size (int): max results waiting for matching
+            detect_batch (collections.abc.Callable | None):
+                detect_batch(frame_nums, frames) returns list of results,
+                called from worker threads
+            batch_size (int): max frames of one detect_batch call
+            release (collections.abc.Callable | None): release(frame),
+                called when frame isn't needed after detection
+        """
+        self.frames = frames
+        self.detect = detect
+        self.detect_batch = detect_batch
+        self.batch_size = batch_size if detect_batch else 1
+        self.release = release
+        self.match = match
+        self.workers = workers
+        self.decode_queue = StageQueue("decode", decode_queue_size)
+        self.match_queue = StageQueue("match", match_queue_size)
+        self._slots = threading.Semaphore(
+            decode_queue_size + match_queue_size + workers)
+        self._stop = threading.Event()
+        self.max_reorder = 0
+
+    def stop(self):
+        """
+        Stops reading new frames, frames in flight are finished.
+        Returns:
+            None:
+        """
+        self._stop.set()
+
+    def run(self):
+        """
+        Runs pipeline until frames are over or pipeline is stopped.
+        Returns:
+            dict: stats of pipeline stages
+        """
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._decode, daemon=True)]
+        threads += [
+            threading.Thread(target=self._detect, daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self._match()
+        for thread in threads:
+            thread.join()
+
+        return {
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "seconds": round(time.perf_counter() - start, 3),
+            "decode_queue": self.decode_queue.stats(),
+            "match_queue": self.match_queue.stats(),
+            "max_reorder": self.max_reorder,
+        }
+
+    def _decode(self):
+        """Decode stage, reads frames and waits for free slot."""
+        seq = 0
+        try:
+            for frame_num, frame in self.frames:
+                self._slots.acquire()
+                if self._stop.is_set():
+                    self._slots.release()
+                    break
+                self.decode_queue.put((seq, frame_num, frame))
+                seq += 1
+        except Exception as e:
+            logging.error(f"Decode stage error: {e}")
+        finally:
+            for _ in range(self.workers):
+                self.decode_queue.put(_STOP)
+
+    def _detect(self):
+        """Detect stage, runs in every worker thread."""
+        while True:
+            item = self.decode_queue.get()
+            if item is _STOP:
+                self.match_queue.put(_STOP)
+                return
+
+            batch = [item]
+            stopped = False
+            while len(batch) < self.batch_size:
+                item = self.decode_queue.get_nowait()
+                if item is None:
+                    break
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.append(item)
+
+            detected = [item for item in batch if item[2] is not None]
+            results = iter(self._detect_batch(detected))
+            for *_, frame in detected:
+                if self.release is not None:
+                    self.release(frame)
+            for seq, frame_num, frame in batch:
+                result = None if frame is None else next(results)
+                self.match_queue.put((seq, frame_num, result))
+            if stopped:
+                self.match_queue.put(_STOP)
+                return
+
+    def _detect_batch(self, batch):
+        """
+        Args:
+            batch (list): (seq, frame_num, frame) items
+
+        Returns:
+            list: detect result of every item, None on error
+        """
+        if not batch:
+            return []
+        if len(batch) > 1:
+            frame_nums = [frame_num for _, frame_num, _ in batch]
+            try:
+                return self.detect_batch(
+                    frame_nums, [frame for *_, frame in batch])
+            except Exception as e:
+                logging.error(
+                    f"Detect stage error on frames {frame_nums}: {e}")
+                return [None] * len(batch)
+
+        _, frame_num, frame = batch[0]
+        try:
+            return [self.detect(frame_num, frame)]
+        except Exception as e:
+            logging.error(f"Detect stage error on frame {frame_num}: {e}")
+            return [None]
+
+    def _match(self):
+        """Match stage, restores decode order of results."""
+        pending = {}
+        next_seq = 0
+        stopped = 0
+        while stopped < self.workers:
+            item = self.match_queue.get()
+            if item is _STOP:
+                stopped += 1
+                continue
+
+            pending[item[0]] = item
+            self.max_reorder = max(self.max_reorder, len(pending))
+            while next_seq in pending:
+                _, frame_num, result = pending.pop(next_seq)
+                next_seq += 1
+                try:
+                    self.match(frame_num, result)
+                except Exception as e:
+                    logging.error(
+                        f"Match stage error on frame {frame_num}: {e}")
+                finally:
+                    self._slots.release()
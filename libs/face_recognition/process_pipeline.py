@@ -0,0 +1,486 @@
+import atexit
+import contextlib
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+from libs.face_recognition.detection import FaceDetector, extract_faces
+
+import numpy as np
+
+from settings import NUM_MAX_THREADS
+
+
+_STOP = None
+_DETECT = "detect"
+_DETACH = "detach"
+_END = object()
+_WORKER_DIED = object()
+
+
+class WorkerDiedError(RuntimeError):
+    """Detector process died, frames of running jobs are lost."""
+
+
+class SharedFrameRing:
+    """Fixed number of frame slots in one shared memory block."""
+    def __init__(self, slots, shape, dtype=np.uint8, name=None):
+        """
+        Creates or attaches shared memory block.
+        Args:
+            slots (int): number of frame slots
+            shape (tuple): frame shape
+            dtype (np.dtype): frame dtype
+            name (str | None): name of existing block to attach
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self._owner = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=self._owner, size=size if self._owner else 0)
+        self._frames = np.ndarray(
+            (slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def slot(self, index):
+        """
+        Args:
+            index (int): slot index
+
+        Returns:
+            np.ndarray: frame view on shared memory
+        """
+        return self._frames[index]
+
+    def close(self):
+        """
+        Detaches block, owner also removes it.
+        Returns:
+            None:
+        """
+        self._frames = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class _FrameTimings:
+    """Stage seconds of one frame, they are sent back with its faces."""
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        Measures time of with block.
+        Args:
+            stage (str): stage name
+
+        Yields:
+            None:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) \
+                + time.perf_counter() - start
+
+
+def _worker(tasks, results):
+    """
+    Worker process loop. Reads frames of jobs from their shared memory
+    rings, detects faces and computes descriptors. Rings and detectors
+    are kept between tasks, so a job attaches its ring once and the
+    cascade is loaded once per process.
+    Args:
+        tasks (multiprocessing.Queue): tasks of this worker
+        results (multiprocessing.Queue): (job_id, seq, frame_num, slot,
+            faces, stage seconds) results of all workers
+
+    Returns:
+        None:
+    """
+    rings = {}
+    detectors = {}
+    try:
+        while True:
+            task = tasks.get()
+            if task is _STOP:
+                return
+            if task[0] == _DETACH:
+                ring = rings.pop(task[1], None)
+                if ring is not None:
+                    ring.close()
+                continue
+
+            _, job_id, seq, frame_num, ring_params, slot, detector_params = \
+                task
+            faces = None
+            timings = _FrameTimings()
+            # frame without slot isn't detected, e.g. gated one
+            if slot is not None:
+                try:
+                    ring = rings.get(ring_params["name"])
+                    if ring is None:
+                        ring = SharedFrameRing(**ring_params)
+                        rings[ring.name] = ring
+                    key = json.dumps(detector_params, sort_keys=True)
+                    detector = detectors.get(key)
+                    if detector is None:
+                        detector = FaceDetector.from_dict(detector_params)
+                        detectors[key] = detector
+                    faces = extract_faces(
+                        detector, ring.slot(slot), timings)
+                except Exception as e:
+                    logging.error(
+                        f"Worker error on frame {frame_num}: {e}")
+            results.put(
+                (job_id, seq, frame_num, slot, faces, timings.seconds))
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+class DetectorProcessPool:
+    """
+    Worker processes of process engine. Workers are started once and
+    shared by all jobs of the consumer, so jobs don't pay for process
+    start, imports and cascade load. Results are routed to jobs by
+    dispatcher thread. Dead worker is restarted, jobs running at that
+    moment fail, because frames queued to it are lost.
+    """
+    def __init__(self, workers=NUM_MAX_THREADS):
+        """
+        Sets pool, workers are started on first job.
+        Args:
+            workers (int): number of worker processes
+        """
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._processes = []
+        self._tasks = []
+        self._results = None
+        self._jobs = {}
+        self._next_job = 0
+        self._next_worker = 0
+        self._closed = None
+
+    def start(self):
+        """
+        Starts workers and dispatcher if they aren't started yet.
+        Returns:
+            None:
+        """
+        with self._lock:
+            if self._processes:
+                return
+            self._closed = threading.Event()
+            self._results = self._context.Queue()
+            for index in range(self.workers):
+                self._tasks.append(self._context.Queue())
+                self._processes.append(self._start_worker(index))
+            threading.Thread(
+                target=self._dispatch,
+                args=(self._results, self._closed),
+                daemon=True).start()
+        logging.info(f"Started {self.workers} detector processes")
+
+    def close(self):
+        """
+        Stops workers, running jobs must be finished before.
+        Returns:
+            None:
+        """
+        with self._lock:
+            if not self._processes:
+                return
+            processes, self._processes = self._processes, []
+            tasks, self._tasks = self._tasks, []
+            self._closed.set()
+        for queue_ in tasks:
+            queue_.put(_STOP)
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def open_job(self):
+        """
+        Registers job, starts workers on first job.
+        Returns:
+            tuple: job id and queue of job results
+        """
+        self.start()
+        with self._lock:
+            job_id = self._next_job
+            self._next_job += 1
+            results = queue.Queue()
+            self._jobs[job_id] = results
+        return job_id, results
+
+    def close_job(self, job_id, ring_name):
+        """
+        Unregisters job, workers detach its ring.
+        Args:
+            job_id (int): job id
+            ring_name (str): shared memory block of job
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            tasks = list(self._tasks)
+        for queue_ in tasks:
+            queue_.put((_DETACH, ring_name))
+
+    def submit(self, job_id, seq, frame_num, ring_params, slot,
+               detector_params):
+        """
+        Queues frame to the next worker.
+        Args:
+            job_id (int): job id
+            seq (int): frame sequence number in job
+            frame_num (int): frame number
+            ring_params (dict): SharedFrameRing params of job
+            slot (int | None): frame slot, None if it isn't detected
+            detector_params (dict): FaceDetector params of job
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            index = self._next_worker
+            self._next_worker = (index + 1) % self.workers
+            tasks = self._tasks[index]
+        tasks.put((
+            _DETECT, job_id, seq, frame_num, ring_params, slot,
+            detector_params))
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=_worker,
+            args=(self._tasks[index], self._results),
+            name=f"detector-{index}",
+            daemon=True)
+        process.start()
+        return process
+
+    def _dispatch(self, results_queue, closed):
+        """Dispatcher loop, routes results to jobs, watches workers."""
+        checked = time.monotonic()
+        while not closed.is_set():
+            try:
+                item = results_queue.get(timeout=1)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                with self._lock:
+                    results = self._jobs.get(item[0])
+                if results is not None:
+                    results.put(item[1:])
+            if time.monotonic() - checked >= 1:
+                checked = time.monotonic()
+                self._check_workers()
+
+    def _check_workers(self):
+        """Restarts dead workers and fails running jobs."""
+        with self._lock:
+            dead = [
+                index for index, process in enumerate(self._processes)
+                if process.exitcode is not None]
+            for index in dead:
+                logging.error(
+                    f"Detector process {index} exited with code "
+                    f"{self._processes[index].exitcode}, restarting")
+                # tasks queued to dead worker are lost
+                self._tasks[index] = self._context.Queue()
+                self._processes[index] = self._start_worker(index)
+            jobs = list(self._jobs.values()) if dead else []
+        for results in jobs:
+            results.put(_WORKER_DIED)
+
+
+detector_processes = DetectorProcessPool()
+atexit.register(detector_processes.close)
+
+
+class ProcessFramePipeline:
+    """
+    Decode -> detect -> match pipeline with detection in worker
+    processes of the pool. Frames are passed through shared memory ring
+    buffer, only slot indexes and found face crops go through queues.
+    Results are reduced in decode order, so they don't depend on
+    which worker got which frame.
+    """
+    def __init__(
+            self, frames, detector, match, pool=None, ring_slots=16,
+            release=None, timings=None):
+        """
+        Sets pipeline stages.
+        Args:
+            frames (collections.abc.Iterable): yields (frame_num, frame),
+                frame is None if it isn't detected
+            detector (FaceDetector): detector, workers create own copies
+            match (collections.abc.Callable): match(frame_num, result),
+                called in frame order, result is None if frame
+                hasn't been detected
+            pool (DetectorProcessPool | None): worker processes,
+                shared pool of the process by default
+            ring_slots (int): number of shared memory frame slots
+            release (collections.abc.Callable | None): release(frame),
+                called when frame is copied to shared memory
+            timings (StageTimings | None): job timings, get detection
+                stages measured by workers
+        """
+        self.frames = frames
+        self.detector_params = detector.to_dict()
+        self.match = match
+        self.release = release
+        self.timings = timings
+        self.pool = pool or detector_processes
+        self.ring_slots = max(ring_slots, self.pool.workers)
+        self._free_slots = queue.Queue()
+        self._stop = threading.Event()
+        self.slot_wait_seconds = 0.0
+        self.max_reorder = 0
+
+    def stop(self):
+        """
+        Stops reading new frames, frames in flight are finished.
+        Returns:
+            None:
+        """
+        self._stop.set()
+
+    def run(self):
+        """
+        Runs pipeline until frames are over or pipeline is stopped.
+        Returns:
+            dict: stats of pipeline
+
+        Raises:
+            WorkerDiedError: worker process died during the job
+        """
+        start = time.perf_counter()
+        frames = iter(self.frames)
+        first = next(frames, None)
+        if first is None:
+            return {"workers": 0, "frames": 0}
+
+        ring = SharedFrameRing(
+            self.ring_slots, first[1].shape, first[1].dtype)
+        for slot in range(self.ring_slots):
+            self._free_slots.put(slot)
+        ring_params = {
+            "slots": ring.slots,
+            "shape": ring.shape,
+            "dtype": ring.dtype.str,
+            "name": ring.name,
+        }
+
+        job_id, results = self.pool.open_job()
+        decoder = threading.Thread(
+            target=self._decode,
+            args=(first, frames, ring, ring_params, job_id, results),
+            daemon=True)
+        decoder.start()
+        try:
+            decoded = self._reduce(results)
+        finally:
+            decoder.join()
+            self.pool.close_job(job_id, ring.name)
+            ring.close()
+
+        return {
+            "engine": "process",
+            "workers": self.pool.workers,
+            "ring_slots": self.ring_slots,
+            "frames": decoded,
+            "seconds": round(time.perf_counter() - start, 3),
+            "slot_wait_seconds": round(self.slot_wait_seconds, 3),
+            "max_reorder": self.max_reorder,
+        }
+
+    def _decode(self, first, frames, ring, ring_params, job_id, results):
+        """Decode stage, copies frames into free shared memory slots."""
+        seq = 0
+        try:
+            item = first
+            while item is not None and not self._stop.is_set():
+                frame_num, frame = item
+                slot = None
+                if frame is not None:
+                    wait_start = time.perf_counter()
+                    slot = self._free_slots.get()
+                    self.slot_wait_seconds += \
+                        time.perf_counter() - wait_start
+                    np.copyto(ring.slot(slot), frame)
+                    if self.release is not None:
+                        self.release(frame)
+                self.pool.submit(
+                    job_id, seq, frame_num, ring_params, slot,
+                    self.detector_params)
+                seq += 1
+                item = next(frames, None)
+        except Exception as e:
+            logging.error(f"Decode stage error: {e}")
+        finally:
+            # reducer waits for this number of results
+            results.put((_END, seq))
+
+    def _reduce(self, results):
+        """
+        Reduce stage, frees slots and matches results in decode order.
+        Args:
+            results (queue.Queue): job results routed by pool
+
+        Returns:
+            int: number of reduced frames
+
+        Raises:
+            WorkerDiedError: worker process died during the job
+        """
+        pending = {}
+        next_seq = 0
+        total = None
+        while total is None or next_seq < total:
+            item = results.get()
+            if item is _WORKER_DIED:
+                self.stop()
+                # wakes decoder if it waits for a slot
+                self._free_slots.put(0)
+                raise WorkerDiedError(
+                    f"Detector process died after {next_seq} reduced frames")
+            if item[0] is _END:
+                total = item[1]
+                continue
+
+            seq, frame_num, slot, faces, stage_seconds = item
+            if slot is not None:
+                self._free_slots.put(slot)
+            if self.timings is not None:
+                for stage, seconds in stage_seconds.items():
+                    self.timings.observe(stage, seconds)
+            pending[seq] = (frame_num, faces)
+            self.max_reorder = max(self.max_reorder, len(pending))
+            while next_seq in pending:
+                frame_num, faces = pending.pop(next_seq)
+                next_seq += 1
+                try:
+                    self.match(frame_num, faces)
+                except Exception as e:
+                    logging.error(
+                        f"Match stage error on frame {frame_num}: {e}")
+        return next_seq
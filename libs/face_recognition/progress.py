@@ -0,0 +1,214 @@
+import time
+
+from libs.face_recognition import FaceRecognitionStatusEnum
+from libs.face_recognition.segments import combine_status, get_segments, \
+    segment_key
+
+
+def progress_stream(file_id):
+    """
+    Args:
+        file_id (str): file id
+
+    Returns:
+        str: redis stream key of job progress
+    """
+    return f"{file_id}:progress"
+
+
+def _decode_event(fields):
+    """
+    Args:
+        fields (dict): raw stream fields
+
+    Returns:
+        dict: progress event
+    """
+    event = {
+        key.decode("utf-8") if isinstance(key, bytes) else key:
+            value.decode("utf-8") if isinstance(value, bytes) else value
+        for key, value in fields.items()
+    }
+    for key in ("frame", "frame_count", "persons"):
+        if key in event:
+            event[key] = int(event[key])
+    if "fps" in event:
+        event["fps"] = float(event["fps"])
+    return event
+
+
+class ProgressStream:
+    """
+    Writes compact progress events of job to redis stream,
+    separately from checkpoint with face crops. Writes are throttled.
+    Must be used from one thread, e.g. pipeline match stage.
+    """
+    def __init__(self, storage, file_id, interval=0.5, maxlen=100,
+                 timings=None):
+        """
+        Sets stream parameters.
+        Args:
+            storage (RedisService): redis service
+            file_id (str): file id
+            interval (float): min seconds between events
+            maxlen (int): approximate number of kept events
+            timings (StageTimings | None): job timings
+        """
+        self.storage = storage
+        self.timings = timings
+        self.stream = progress_stream(file_id)
+        self.interval = interval
+        self.maxlen = maxlen
+        self.events = 0
+        self._started = time.monotonic()
+        self._start_frame = 0
+        self._last_event = None
+
+    def start(self, frame_num):
+        """
+        Starts fps measurement.
+        Args:
+            frame_num (int): first frame of this run
+
+        Returns:
+            None:
+        """
+        self._started = time.monotonic()
+        self._start_frame = frame_num
+
+    def update(self, frame_num, frame_count, persons, status, force=False):
+        """
+        Writes event if interval has passed.
+        Args:
+            frame_num (int): current frame number
+            frame_count (int): number of frames
+            persons (int): found persons
+            status (FaceRecognitionStatusEnum): job status
+            force (bool): write regardless of interval, e.g. last event
+
+        Returns:
+            bool: True if event has been written
+        """
+        now = time.monotonic()
+        if not force and self._last_event is not None \
+                and now - self._last_event < self.interval:
+            return False
+
+        elapsed = now - self._started
+        fps = (frame_num - self._start_frame) / elapsed if elapsed else 0.0
+        self.storage.add_event(
+            self.stream,
+            {
+                "frame": frame_num,
+                "frame_count": frame_count,
+                "persons": persons,
+                "status": status.value,
+                "fps": round(fps, 1),
+            },
+            maxlen=self.maxlen
+        )
+        if self.timings is not None:
+            self.timings.observe("redis", time.monotonic() - now)
+        self.events += 1
+        self._last_event = now
+        return True
+
+
+def _combine_events(segments, events):
+    """
+    Combines the last progress events of segments into event of video.
+    Persons are counted per segment, the same person found in several
+    segments is counted once only after segments are merged.
+    Args:
+        segments (list): segment dicts
+        events (list): the last event of every segment or None
+
+    Returns:
+        dict | None: progress event, None if segments have no events
+    """
+    if not any(events):
+        return None
+    frame = persons = 0
+    fps = 0.0
+    for segment, event in zip(segments, events):
+        if event is None:
+            continue
+        frame += max(0, event["frame"] - segment["start"])
+        persons = max(persons, event["persons"])
+        if event["status"] == FaceRecognitionStatusEnum.PROCESS.value:
+            # running segments decode in parallel
+            fps += event.get("fps", 0.0)
+    return {
+        "frame": frame,
+        "frame_count": segments[-1]["end"] - segments[0]["start"],
+        "persons": persons,
+        "status": combine_status(
+            [event and event["status"] for event in events]).value,
+        "fps": round(fps, 1),
+        "segments": len(segments),
+    }
+
+
+def last_progress(storage, file_ids):
+    """
+    Gets the last progress event of every job. Events of segmented
+    video are combined from streams of its segments.
+    Args:
+        storage (RedisService): redis service
+        file_ids (list): file ids
+
+    Returns:
+        dict: file id to event, None for jobs without events
+    """
+    result = {}
+    for file_id in file_ids:
+        event = storage.last_event(progress_stream(file_id))
+        if event:
+            result[file_id] = _decode_event(event[1])
+            continue
+        segments = get_segments(storage, file_id)
+        if not segments:
+            result[file_id] = None
+            continue
+        events = []
+        for segment in segments:
+            event = storage.last_event(
+                progress_stream(segment_key(file_id, segment["index"])))
+            events.append(_decode_event(event[1]) if event else None)
+        result[file_id] = _combine_events(segments, events)
+    return result
+
+
+def read_progress(storage, positions, count=None, block=None):
+    """
+    Tails progress of several jobs with one redis call.
+    Args:
+        storage (RedisService): redis service
+        positions (dict): file id to last read event id,
+            "0" for all kept events, "$" for new events only
+        count (int | None): max events per job
+        block (int | None): milliseconds to wait for new events
+
+    Returns:
+        dict: file id to list of (event id, event), pass the last
+            event ids as positions of the next call
+    """
+    file_ids = {progress_stream(file_id): file_id for file_id in positions}
+    streams = {
+        progress_stream(file_id): position
+        for file_id, position in positions.items()
+    }
+    result = {}
+    for stream, events in storage.read_events(
+            streams, count=count, block=block):
+        if isinstance(stream, bytes):
+            stream = stream.decode("utf-8")
+        result[file_ids[stream]] = [
+            (
+                event_id.decode("utf-8")
+                if isinstance(event_id, bytes) else event_id,
+                _decode_event(fields)
+            )
+            for event_id, fields in events
+        ]
+    return result
@@ -0,0 +1,112 @@
+import cv2
+
+from libs.face_recognition import SamplingModeEnum
+from libs.face_recognition.seek import is_keyframe
+
+
+class SamplingPolicy:
+    """
+    Decides which frames of video go to recognition.
+    Modes:
+        - all: every frame
+        - stride: every Nth frame
+        - fps: N frames per second of video time
+        - keyframe: only frames encoded as key frames
+    """
+    def __init__(self, mode=SamplingModeEnum.ALL, value=1):
+        """
+        Sets sampling parameters.
+        Args:
+            mode (SamplingModeEnum | str): sampling mode
+            value (int | float): N for stride and fps modes
+
+        Raises:
+            ValueError: unknown mode or not positive value
+        """
+        self.mode = SamplingModeEnum(mode)
+        self.value = float(value) if self.mode == SamplingModeEnum.FPS \
+            else int(value)
+        if self.value <= 0:
+            raise ValueError(f"Sampling value must be positive: {value}")
+        self._last_bucket = None
+        self._keyframes_supported = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates policy from kafka message params.
+        Args:
+            data (dict | None): {"mode": "stride", "value": 5}
+
+        Returns:
+            SamplingPolicy: policy, every frame if data is empty
+        """
+        if not data:
+            return cls()
+        return cls(
+            data.get("mode", SamplingModeEnum.ALL.value),
+            data.get("value", 1)
+        )
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: policy params for kafka message
+        """
+        return {"mode": self.mode.value, "value": self.value}
+
+    def is_sampled(self, frame_index, video):
+        """
+        Checks if grabbed frame must be decoded and recognized.
+        Args:
+            frame_index (int): zero based index of grabbed frame
+            video (cv2.VideoCapture): video, frame is already grabbed
+
+        Returns:
+            bool: True if frame is sampled
+        """
+        if self.mode == SamplingModeEnum.STRIDE:
+            return frame_index % self.value == 0
+        if self.mode == SamplingModeEnum.FPS:
+            return self._is_new_time_bucket(
+                frame_index, video.get(cv2.CAP_PROP_FPS))
+        if self.mode == SamplingModeEnum.KEYFRAME:
+            return self._is_keyframe(frame_index, video)
+        return True
+
+    def _is_new_time_bucket(self, frame_index, fps):
+        """
+        Samples first frame in every 1/N second of video time.
+        Args:
+            frame_index (int): zero based frame index
+            fps (float): video fps, every frame is sampled if unknown
+
+        Returns:
+            bool: True if frame is sampled
+        """
+        if not fps or fps <= 0:
+            return True
+        bucket = int(frame_index * self.value / fps)
+        if bucket == self._last_bucket:
+            return False
+        self._last_bucket = bucket
+        return True
+
+    def _is_keyframe(self, frame_index, video):
+        """
+        Checks key flag of last grabbed packet. Backends which
+        don't report it fall back to one frame per second.
+        Args:
+            frame_index (int): zero based frame index
+            video (cv2.VideoCapture): video, frame is already grabbed
+
+        Returns:
+            bool: True if frame is sampled
+        """
+        if self._keyframes_supported is None:
+            # first frame of video is always a key frame
+            self._keyframes_supported = is_keyframe(video)
+        if self._keyframes_supported:
+            return is_keyframe(video)
+        return self._is_new_time_bucket(
+            frame_index, video.get(cv2.CAP_PROP_FPS))
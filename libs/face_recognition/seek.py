@@ -0,0 +1,110 @@
+import bisect
+import time
+from enum import Enum
+
+import cv2
+
+
+# index keeps at most one key frame per this number of frames,
+# so intra-only videos don't index every frame
+KEYFRAME_MIN_GAP = 25
+
+
+class SeekMethodEnum(Enum):
+    NONE = "none"
+    KEYFRAME = "keyframe"
+    SEEK = "seek"
+    GRAB = "grab"
+
+
+def is_keyframe(video):
+    """
+    Checks key flag of last grabbed packet.
+    Args:
+        video (cv2.VideoCapture): video, frame is already grabbed
+
+    Returns:
+        bool: True if backend reports key frame
+    """
+    prop = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+    return prop is not None and video.get(prop) == 1
+
+
+def add_keyframe(keyframes, frame_index):
+    """
+    Adds key frame to index if it's far enough from the last one.
+    Args:
+        keyframes (list): sorted zero based key frame indexes
+        frame_index (int): zero based index of key frame
+
+    Returns:
+        None:
+    """
+    if not keyframes or frame_index - keyframes[-1] >= KEYFRAME_MIN_GAP:
+        keyframes.append(frame_index)
+
+
+def _set_position(video, position):
+    """
+    Seeks video and checks position reported by backend.
+    Args:
+        video (cv2.VideoCapture): video
+        position (int): number of frames before next grabbed one
+
+    Returns:
+        bool: True if backend moved exactly to position
+    """
+    return video.set(cv2.CAP_PROP_POS_FRAMES, position) \
+        and int(video.get(cv2.CAP_PROP_POS_FRAMES)) == position
+
+
+def _grab_until(video, position):
+    """
+    Skips frames without decoding them.
+    Args:
+        video (cv2.VideoCapture): video
+        position (int): target position
+
+    Returns:
+        bool: False if video ended before position
+    """
+    while int(video.get(cv2.CAP_PROP_POS_FRAMES)) < position:
+        if not video.grab():
+            return False
+    return True
+
+
+def seek_to_frame(video_path, video, position, keyframes=None):
+    """
+    Positions video so next grabbed frame is frame number position + 1.
+    Tries nearest key frame from index, then direct seek, then
+    reopens video and grabs frames from the start.
+    Args:
+        video_path (str): path to video, used to reopen it
+        video (cv2.VideoCapture): opened video
+        position (int): number of already processed frames
+        keyframes (list | None): sorted zero based key frame indexes
+
+    Returns:
+        tuple: video capture, SeekMethodEnum and seconds spent
+    """
+    start = time.perf_counter()
+    method = SeekMethodEnum.NONE
+    if position > 0:
+        keyframe = None
+        if keyframes:
+            index = bisect.bisect_right(keyframes, position) - 1
+            keyframe = keyframes[index] if index >= 0 else None
+
+        # seeking to the first key frame is the same as reading from start
+        if keyframe and _set_position(video, keyframe) \
+                and _grab_until(video, position):
+            method = SeekMethodEnum.KEYFRAME
+        elif _set_position(video, position):
+            method = SeekMethodEnum.SEEK
+        else:
+            video.release()
+            video = cv2.VideoCapture(video_path)
+            _grab_until(video, position)
+            method = SeekMethodEnum.GRAB
+    return video, method, time.perf_counter() - start
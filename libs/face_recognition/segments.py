@@ -0,0 +1,184 @@
+from libs.face_recognition import FaceRecognitionStatusEnum
+from libs.face_recognition.checkpoint import CheckpointWriter
+from libs.face_recognition.codec import decode_face
+from libs.face_recognition.gallery import merge_shards
+
+
+def split_segments(frame_count, count):
+    """
+    Splits video into frame ranges of almost equal length.
+    Args:
+        frame_count (int): number of frames in video
+        count (int): number of segments
+
+    Returns:
+        list: segment dicts with index, count, start and end,
+            start is exclusive and end is inclusive frame number
+    """
+    count = max(1, min(count, frame_count))
+    bounds = [frame_count * i // count for i in range(count + 1)]
+    return [
+        {"index": i, "count": count, "start": bounds[i], "end": bounds[i + 1]}
+        for i in range(count)
+    ]
+
+
+def segment_key(file_id, index):
+    """
+    Args:
+        file_id (str): file id
+        index (int): segment index
+
+    Returns:
+        str: redis key of segment state
+    """
+    return f"{file_id}:segment:{index}"
+
+
+def segments_key(file_id):
+    """
+    Args:
+        file_id (str): file id
+
+    Returns:
+        str: redis key of segments of video
+    """
+    return f"{file_id}:segments"
+
+
+def register_segments(storage, file_id, segments):
+    """
+    Stores segments of video, so jobs of video are found by file id.
+    Args:
+        storage (RedisService): redis service
+        file_id (str): file id
+        segments (list): segment dicts
+
+    Returns:
+        None:
+    """
+    storage.update(segments_key(file_id), {"segments": segments})
+
+
+async def register_segments_async(storage, file_id, segments):
+    """
+    Coroutine version of register_segments.
+    Args:
+        storage (AsyncRedisService): asyncio redis service
+        file_id (str): file id
+        segments (list): segment dicts
+
+    Returns:
+        None:
+    """
+    await storage.update(segments_key(file_id), {"segments": segments})
+
+
+def get_segments(storage, file_id):
+    """
+    Args:
+        storage (RedisService): redis service
+        file_id (str): file id
+
+    Returns:
+        list | None: segment dicts, None if video isn't segmented
+    """
+    data = storage.get(segments_key(file_id), list_to_np_array=False)
+    return data["segments"] if data else None
+
+
+def fail_segment(storage, file_id, segment, error):
+    """
+    Marks segment failed, its state is created if segment has failed
+    before the first checkpoint.
+    Args:
+        storage (RedisService): redis service
+        file_id (str): file id
+        segment (dict): failed segment
+        error (str): error message
+
+    Returns:
+        None:
+    """
+    key = segment_key(file_id, segment["index"])
+    fields = {
+        "status": str(FaceRecognitionStatusEnum.FAILED),
+        "error": error,
+        "segment": segment,
+    }
+    if storage.update_fields(key, fields) is None:
+        storage.update(key, fields)
+
+
+def combine_status(statuses):
+    """
+    Args:
+        statuses (list): statuses of segments as stored in redis,
+            str(enum) or enum value, None for segments without state
+
+    Returns:
+        FaceRecognitionStatusEnum: status of whole video
+    """
+    known = {
+        form: status
+        for status in FaceRecognitionStatusEnum
+        for form in (str(status), status.value)
+    }
+    statuses = [known.get(status) for status in statuses]
+    if all(s == FaceRecognitionStatusEnum.READY for s in statuses):
+        return FaceRecognitionStatusEnum.READY
+    for status in (FaceRecognitionStatusEnum.CANCEL,
+                   FaceRecognitionStatusEnum.FAILED,
+                   FaceRecognitionStatusEnum.PAUSE):
+        if status in statuses:
+            return status
+    return FaceRecognitionStatusEnum.PROCESS
+
+
+def finish_segment(storage, file_id, segment, threshold=80):
+    """
+    Marks segment finished. The consumer which finishes the last
+    segment merges results of all segments. Finished segments are
+    a set of indexes, so a redelivered segment isn't counted twice,
+    it merges results again if all segments are finished.
+    Args:
+        storage (RedisService): redis service
+        file_id (str): file id
+        segment (dict): finished segment
+        threshold (int): LBPH confidence threshold
+
+    Returns:
+        dict | None: merged result of video or None if some segments
+            are still processing
+    """
+    pipe = storage.redis.pipeline(transaction=True)
+    pipe.sadd(f"{file_id}:segments_done", segment["index"])
+    pipe.scard(f"{file_id}:segments_done")
+    _, finished = pipe.execute()
+    if finished < segment["count"]:
+        return None
+
+    shards, statuses = [], []
+    frames = 0
+    for index in range(segment["count"]):
+        data = CheckpointWriter(storage, segment_key(file_id, index)).load()
+        if data is None:
+            statuses.append(None)
+            continue
+        start = data.get("segment", {}).get("start", 0)
+        frame = int(str(data.get("frame", start)).split("/")[0])
+        frames += frame - start
+        statuses.append(data.get("status"))
+        shards.append((
+            [decode_face(face) for face in data["faces_list"]],
+            data["names_list"]
+        ))
+
+    faces_list, names_list = merge_shards(shards, threshold)
+    return {
+        "faces_list": faces_list,
+        "names_list": names_list,
+        "status": combine_status(statuses),
+        "frame": frames,
+        "persons": len(faces_list),
+    }
@@ -0,0 +1,170 @@
+import itertools
+
+
+def iou(a, b):
+    """
+    Args:
+        a (tuple): (x, y, w, h) box
+        b (tuple): (x, y, w, h) box
+
+    Returns:
+        float: intersection over union
+    """
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2 = min(a[0] + a[2], b[0] + b[2])
+    y2 = min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+class Track:
+    """Face seen on consecutive analysed frames."""
+    def __init__(self, track_id, box, frame_num):
+        """
+        Args:
+            track_id (int): track id
+            box (tuple): (x, y, w, h) box
+            frame_num (int): frame where track is born
+        """
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = frame_num
+        self.validated_at = None
+        self.name = None
+
+    def needs_validation(self, frame_num, revalidate):
+        """
+        Args:
+            frame_num (int): current frame number
+            revalidate (int): frames between gallery validations
+
+        Returns:
+            bool: True if track identity must be checked by gallery
+        """
+        return self.name is None or \
+            frame_num - self.validated_at >= revalidate
+
+    def validate(self, name, frame_num):
+        """
+        Sets identity found by gallery.
+        Args:
+            name (str): person name
+            frame_num (int): current frame number
+
+        Returns:
+            None:
+        """
+        self.name = name
+        self.validated_at = frame_num
+
+
+class FaceTracker:
+    """
+    Associates faces of consecutive analysed frames by box overlap,
+    so a person standing in front of camera isn't matched against
+    the whole gallery on every frame.
+    Must be used in frame order, e.g. in pipeline match stage.
+    """
+    def __init__(self, min_iou=0.3, max_gap=25, revalidate=125):
+        """
+        Sets tracker parameters.
+        Args:
+            min_iou (float): min overlap to continue track, 0 disables
+                tracking
+            max_gap (int): frames after which unseen track is dropped
+            revalidate (int): frames between gallery validations
+        """
+        self.min_iou = min_iou
+        self.max_gap = max_gap
+        self.revalidate = revalidate
+        self.tracks = []
+        self.tracked = 0
+        self.validated = 0
+        self._ids = itertools.count()
+
+    @classmethod
+    def from_dict(cls, data, min_iou=0.3, max_gap=25, revalidate=125):
+        """
+        Creates tracker from kafka message params.
+        Args:
+            data (dict | None): {"min_iou": 0.3, "max_gap": 25}
+            min_iou (float): default min overlap
+            max_gap (int): default max gap
+            revalidate (int): default frames between validations
+
+        Returns:
+            FaceTracker: tracker
+        """
+        data = data or {}
+        return cls(
+            data.get("min_iou", min_iou),
+            data.get("max_gap", max_gap),
+            data.get("revalidate", revalidate)
+        )
+
+    def update(self, frame_num, boxes):
+        """
+        Continues tracks with boxes of the frame, starts new tracks
+        for the rest of boxes and drops lost tracks.
+        Args:
+            frame_num (int): current frame number
+            boxes (list): (x, y, w, h) boxes of faces
+
+        Returns:
+            list: Track for every box
+        """
+        self.tracks = [
+            track for track in self.tracks
+            if frame_num - track.last_seen <= self.max_gap
+        ]
+        result = [None] * len(boxes)
+        if self.min_iou > 0:
+            pairs = sorted(
+                (
+                    (iou(track.box, box), t, b)
+                    for t, track in enumerate(self.tracks)
+                    for b, box in enumerate(boxes)
+                ),
+                reverse=True
+            )
+            used = set()
+            for overlap, t, b in pairs:
+                if overlap < self.min_iou:
+                    break
+                if t in used or result[b] is not None:
+                    continue
+                used.add(t)
+                result[b] = self.tracks[t]
+
+        for b, box in enumerate(boxes):
+            track = result[b]
+            if track is None:
+                track = Track(next(self._ids), box, frame_num)
+                self.tracks.append(track)
+                result[b] = track
+            track.box = box
+            track.last_seen = frame_num
+        return result
+
+    def needs_validation(self, track, frame_num):
+        """
+        Args:
+            track (Track): track of face
+            frame_num (int): current frame number
+
+        Returns:
+            bool: True if face must be matched with gallery
+        """
+        if track.needs_validation(frame_num, self.revalidate):
+            self.validated += 1
+            return True
+        self.tracked += 1
+        return False
+
+    def stats(self):
+        """
+        Returns:
+            dict: numbers of faces identified by track and by gallery
+        """
+        return {"tracked": self.tracked, "validated": self.validated}
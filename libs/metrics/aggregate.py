@@ -0,0 +1,47 @@
+def _with_label(sample, label, value):
+    """
+    Adds label to sample line, e.g. name{a="1"} 2 -> name{w="0",a="1"} 2.
+    Args:
+        sample (str): sample line
+        label (str): label name
+        value (str): label value
+
+    Returns:
+        str: sample line
+    """
+    pair = f'{label}="{value}"'
+    name, _, rest = sample.partition("{")
+    if rest:
+        return f"{name}{{{pair},{rest}"
+    name, _, rest = sample.partition(" ")
+    return f"{name}{{{pair}}} {rest}"
+
+
+def merge(texts, label="worker"):
+    """
+    Merges metrics of several processes into one prometheus text,
+    samples of every process get label with its key.
+    Args:
+        texts (dict): process key to metrics text
+        label (str): label name
+
+    Returns:
+        str: merged metrics
+    """
+    families = {}
+    for key, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = families.setdefault(
+                    line.split(" ", 3)[2], {"header": [], "samples": []})
+                if line not in family["header"]:
+                    family["header"].append(line)
+            elif line and not line.startswith("#") and family is not None:
+                family["samples"].append(_with_label(line, label, key))
+
+    lines = []
+    for family in families.values():
+        lines.extend(family["header"])
+        lines.extend(family["samples"])
+    return "\n".join(lines) + "\n" if lines else ""
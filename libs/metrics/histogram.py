@@ -0,0 +1,259 @@
+import bisect
+import contextlib
+import threading
+import time
+
+
+# seconds, from a fast cvtColor to a slow redis write
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class Histogram:
+    """
+    Process wide histogram with one label, thread safe.
+    Rendered in prometheus text format.
+    """
+    def __init__(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        """
+        Sets histogram parameters.
+        Args:
+            name (str): metric name
+            description (str): metric help
+            label (str): label name, e.g. "stage"
+            buckets (tuple): sorted upper bounds of buckets
+        """
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        """
+        Args:
+            value (float): observed value
+            label_value (str): label value
+
+        Returns:
+            None:
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        """
+        Returns:
+            str: histogram in prometheus text format
+        """
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {
+                value: (list(counts), total)
+                for value, (counts, total) in self._series.items()
+            }
+        for value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="{bound}"}} '
+                    f"{cumulative}")
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    """
+    Process wide counter with one label, thread safe.
+    Rendered in prometheus text format.
+    """
+    def __init__(self, name, description, label):
+        """
+        Sets counter parameters.
+        Args:
+            name (str): metric name, ends with _total
+            description (str): metric help
+            label (str): label name, e.g. "result"
+        """
+        self.name = name
+        self.description = description
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, value=1):
+        """
+        Args:
+            label_value (str): label value
+            value (int): increment
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            self._series[label_value] = \
+                self._series.get(label_value, 0) + value
+
+    def value(self, label_value):
+        """
+        Args:
+            label_value (str): label value
+
+        Returns:
+            int: current value
+        """
+        with self._lock:
+            return self._series.get(label_value, 0)
+
+    def render(self):
+        """
+        Returns:
+            str: counter in prometheus text format
+        """
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            series = dict(self._series)
+        for value, count in sorted(series.items()):
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class Registry:
+    """Histograms and counters of process."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        """
+        Gets histogram by name, creates it on the first call.
+        Args:
+            name (str): metric name
+            description (str): metric help
+            label (str): label name
+            buckets (tuple): sorted upper bounds of buckets
+
+        Returns:
+            Histogram: histogram
+        """
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(
+                    name, description, label, buckets)
+            return self._metrics[name]
+
+    def counter(self, name, description, label):
+        """
+        Gets counter by name, creates it on the first call.
+        Args:
+            name (str): metric name
+            description (str): metric help
+            label (str): label name
+
+        Returns:
+            Counter: counter
+        """
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, description, label)
+            return self._metrics[name]
+
+    def render(self):
+        """
+        Returns:
+            str: all metrics in prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "face_recognition_stage_seconds",
+    "Time spent in face recognition pipeline stages",
+    "stage"
+)
+
+
+class StageTimings:
+    """
+    Timings of one job. Every measurement goes to job totals
+    and to process wide STAGE_SECONDS histogram.
+    """
+    def __init__(self, histogram=STAGE_SECONDS):
+        """
+        Args:
+            histogram (Histogram): process wide histogram
+        """
+        self.histogram = histogram
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """
+        Args:
+            stage (str): stage name
+            seconds (float): time spent
+
+        Returns:
+            None:
+        """
+        self.histogram.observe(seconds, stage)
+        with self._lock:
+            totals = self._stages.get(stage)
+            if totals is None:
+                totals = self._stages[stage] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        Measures time of with block.
+        Args:
+            stage (str): stage name
+
+        Yields:
+            None:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def stats(self):
+        """
+        Returns:
+            dict: stage to number of calls, total and max seconds
+        """
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "seconds": round(total, 3),
+                    "max_ms": round(longest * 1000, 2),
+                }
+                for stage, (count, total, longest) in self._stages.items()
+            }
@@ -0,0 +1,60 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libs.metrics.histogram import registry
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves metrics on /metrics and health on /health."""
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self._send(200, CONTENT_TYPE, self.server.render())
+        elif path == "/health" and self.server.health is not None:
+            healthy, details = self.server.health()
+            self._send(
+                200 if healthy else 503, "application/json",
+                json.dumps(details))
+        else:
+            self.send_error(404)
+
+    def _send(self, status, content_type, text):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Scrapes aren't logged."""
+
+
+def start_metrics_server(port, host="0.0.0.0", render=None, health=None):
+    """
+    Starts metrics http server in background thread,
+    e.g. for consumer processes without flask server.
+    Args:
+        port (int): port, 0 disables server
+        host (str): host
+        render (collections.abc.Callable | None): returns metrics text,
+            process registry by default
+        health (collections.abc.Callable | None): returns healthy flag
+            and json details, /health isn't served if it's None
+
+    Returns:
+        ThreadingHTTPServer | None: server
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.render = render or registry.render
+    server.health = health
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Metrics are served on {host}:{port}/metrics")
+    return server
@@ -0,0 +1,316 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app.api.events import process_after_video_upload_views_async
+
+from kafka.errors import CommitFailedError, KafkaError
+
+from libs.transport.consumer.kafka_consumers import Consumer, \
+    FaceRecognitionConsumer, VideoUploadConsumer
+from libs.transport.publisher.kafka_publisher import publisher
+
+from settings import KAFKA_ASYNC_CONCURRENCY, KAFKA_ASYNC_IO_WORKERS, \
+    KAFKA_POLL_TIMEOUT_MS
+
+
+class AsyncConsumer(Consumer):
+    """
+    Asyncio consumer runtime. Every message is a task on event loop,
+    up to concurrency tasks at once. KafkaConsumer isn't thread safe,
+    all broker calls run in one broker thread.
+
+    Child consumers override on_message_async and on_batch_async to
+    await asyncio clients, then thousands of messages wait for io
+    in one thread. Existing consumers are adapted with AsyncConsumer
+    as the first base class, their blocking on_message runs in io
+    threads or cpu executor, so messages handled at once are limited
+    by threads of that executor:
+
+        class AsyncMyConsumer(AsyncConsumer, MyConsumer):
+            io_bound = True
+    """
+    # blocking on_message of adapted consumer waits for io, not cpu
+    io_bound = False
+
+    def __init__(
+            self, *args, concurrency=KAFKA_ASYNC_CONCURRENCY,
+            io_workers=KAFKA_ASYNC_IO_WORKERS, cpu_executor=None,
+            **kwargs):
+        """
+        Sets runtime parameters.
+        Args:
+            *args: Consumer args
+            concurrency (int): max message tasks at once, also
+                default window of messages in flight per partition
+            io_workers (int): threads for blocking io, max messages
+                handled at once by adapted io bound on_message
+            cpu_executor (concurrent.futures.Executor | None): executor
+                for cpu bound work, consumer thread pool by default
+            **kwargs: Consumer kwargs
+        """
+        kwargs.setdefault("max_in_flight", concurrency)
+        self.concurrency = concurrency
+        self.io_executor = ThreadPoolExecutor(
+            io_workers, thread_name_prefix="consumer-io")
+        self._broker_executor = ThreadPoolExecutor(
+            1, thread_name_prefix="consumer-broker")
+        super().__init__(*args, **kwargs)
+        self.cpu_executor = cpu_executor or self.pool
+
+    def activate_listener(self):
+        """
+        Runs event loop until consumer is stopped.
+        Returns:
+            None:
+        """
+        try:
+            asyncio.run(self.run())
+        except Exception as e:
+            logging.error(f"Unexpected error: {e}")
+
+    async def run(self):
+        """
+        Polls broker and handles messages as tasks. After stop waits
+        for messages in flight, commits them and closes consumer.
+        Returns:
+            None:
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        await self.run_broker(self.subscribe_topic)
+        last_commit = loop.time()
+        try:
+            while not self._stop.is_set():
+                taken = await self.run_broker(self._poll)
+                for handle in self._handlers(semaphore, taken):
+                    task = asyncio.create_task(handle)
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if loop.time() - last_commit >= self.commit_interval:
+                    await self._commit()
+                    last_commit = loop.time()
+            if tasks:
+                await asyncio.gather(*tasks)
+            await self._commit()
+            await self.run_broker(self.consumer.close)
+            logging.info("Consumer is closed")
+        finally:
+            self.io_executor.shutdown(wait=False)
+            self._broker_executor.shutdown(wait=False)
+
+    def _poll(self):
+        """
+        Polls messages which fit into partition windows,
+        runs in broker thread.
+        Returns:
+            list: (PartitionOffsets, message) of taken messages
+        """
+        records = self.consumer.poll(
+            timeout_ms=KAFKA_POLL_TIMEOUT_MS,
+            max_records=self.batch_size or None)
+        taken = []
+        for partition, messages in records.items():
+            taken.extend(self._take(partition, messages))
+        if self.clear_messages:
+            self._ack(taken)
+            taken = []
+        self._update_paused()
+        return taken
+
+    def _handlers(self, semaphore, taken):
+        """
+        Args:
+            semaphore (asyncio.Semaphore): concurrency limit
+            taken (list): (PartitionOffsets, message) pairs
+
+        Returns:
+            list: coroutines handling taken messages
+        """
+        if not self.batch_size:
+            return [self._handle(semaphore, [item]) for item in taken]
+        return [
+            self._handle(semaphore, taken[index:index + self.batch_size])
+            for index in range(0, len(taken), self.batch_size)
+        ]
+
+    async def _handle(self, semaphore, items):
+        """
+        Handles message or batch and marks it completed, failed
+        messages are sent to dead letter topic first.
+        Args:
+            semaphore (asyncio.Semaphore): concurrency limit
+            items (list): (PartitionOffsets, message) pairs
+
+        Returns:
+            None:
+        """
+        messages = [message for _, message in items]
+        try:
+            async with semaphore:
+                if self.batch_size:
+                    results = await self.on_batch_async(messages)
+                    acked = sum(1 for result in results if result)
+                    logging.info(
+                        f"ack {acked}, reject {len(results) - acked}")
+                else:
+                    results = [await self.on_message_async(messages[0])]
+                    logging.info("ack" if results[0] else "reject")
+        except Exception as e:
+            logging.error(f"Unexpected error: {e}")
+            results = [False] * len(items)
+        await self._complete_async(items, results)
+
+    async def _complete_async(self, taken, results):
+        """
+        Coroutine version of Consumer._complete, failed messages are
+        sent to dead letter topic without blocking event loop.
+        Args:
+            taken (list): (PartitionOffsets, message) pairs
+            results (list): handler result of every message
+
+        Returns:
+            None:
+        """
+        failed = [
+            message for (_, message), result in zip(taken, results)
+            if not result
+        ]
+        sent = await asyncio.gather(*[
+            publisher.send_message_async(
+                self.dead_letter_topic, **message.value)
+            for message in failed
+        ], return_exceptions=True)
+        lost = set()
+        for message, result in zip(failed, sent):
+            error = result if isinstance(result, Exception) else None
+            if not self.dead_lettered(message, error):
+                lost.add((message.partition, message.offset))
+        self._ack([
+            (offsets, message) for offsets, message in taken
+            if (message.partition, message.offset) not in lost
+        ])
+
+    async def _commit(self):
+        """
+        Commits completed offsets, reconnects to group if commit
+        is rejected after rebalance.
+        Returns:
+            None:
+        """
+        try:
+            await self.run_broker(self.commit)
+        except CommitFailedError:
+            logging.error("Commit error, reconnecting to kafka group")
+            await self.run_broker(self._reconnect_broker)
+
+    def _reconnect_broker(self):
+        """
+        Closes consumer, connects again and subscribes,
+        runs in broker thread.
+        Returns:
+            None:
+        """
+        self.consumer.close()
+        with self._lock:
+            self._offsets = {}
+        self.connect()
+        self.subscribe_topic()
+
+    async def on_message_async(self, message):
+        """
+        Coroutine handler of message, child consumers override it to
+        await io directly. By default runs on_message in executor.
+        Args:
+            message (kafka.consumer.fetcher.ConsumerRecord): message
+
+        Returns:
+            bool: on_message result
+        """
+        if self.io_bound:
+            return await self.run_io(self.on_message, message)
+        return await self.run_cpu(self.on_message, message)
+
+    async def on_batch_async(self, messages):
+        """
+        Coroutine handler of batch in batch mode, child consumers
+        override it to await io directly. By default runs on_batch
+        in executor.
+        Args:
+            messages (list): kafka messages
+
+        Returns:
+            list: on_batch result
+        """
+        if self.io_bound:
+            return await self.run_io(self.on_batch, messages)
+        return await self.run_cpu(self.on_batch, messages)
+
+    async def run_broker(self, func, *args):
+        """Runs KafkaConsumer call in broker thread."""
+        return await self._run(self._broker_executor, func, *args)
+
+    async def run_io(self, func, *args):
+        """Runs blocking io, e.g. redis, s3 or db call, in io thread."""
+        return await self._run(self.io_executor, func, *args)
+
+    async def run_cpu(self, func, *args):
+        """Runs cpu bound function in cpu executor."""
+        return await self._run(self.cpu_executor, func, *args)
+
+    @staticmethod
+    async def _run(executor, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(func, *args))
+
+
+class AsyncVideoUploadConsumer(AsyncConsumer, VideoUploadConsumer):
+    """
+    VideoUploadConsumer on asyncio runtime. Uploads await asyncio
+    redis and kafka delivery, so they don't take a thread each.
+    """
+    io_bound = True
+
+    async def on_message_async(self, message):
+        """
+        Awaits after upload events of message video, recognition
+        messages are delivered before message is completed.
+        Args:
+            message (kafka.consumer.fetcher.ConsumerRecord): message
+
+        Returns:
+            bool: False if events failed
+        """
+        file_id = message.value.get("file_id")
+        try:
+            logging.info(f"Uploading video with id: {file_id}")
+            await process_after_video_upload_views_async(
+                file_id,
+                message.value.get("filepath"),
+                message.value.get("params"))
+            return True
+        except AssertionError as e:
+            logging.error(f"Assertion error: {e}")
+            return False
+        except KafkaError as e:
+            logging.error(f"Recognition messages send failed: {e}")
+            return False
+
+    async def on_batch_async(self, messages):
+        """
+        Uploads batch videos concurrently.
+        Args:
+            messages (list): messages from kafka publisher
+
+        Returns:
+            list: True for every message processed successfully
+        """
+        return list(await asyncio.gather(*[
+            self.on_message_async(message) for message in messages]))
+
+
+class AsyncFaceRecognitionConsumer(AsyncConsumer, FaceRecognitionConsumer):
+    """FaceRecognitionConsumer on asyncio runtime."""
@@ -1,17 +1,41 @@
 import json
 import logging
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 
-from app import app
+from app import app, redis_service
 from app.api.events import process_after_video_upload_views
+from app.api.videos.helpers import create_video, create_videos
 
-from kafka import KafkaConsumer
-from kafka.errors import CommitFailedError
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+from kafka.errors import CommitFailedError, KafkaError
+from kafka.structs import OffsetAndMetadata
 
-from app.api.videos.helpers import create_video
+from libs.face_recognition import FaceRecognitionStatusEnum, \
+    RecognitionEngineEnum
+from libs.face_recognition.codec import pack_faces
+from libs.face_recognition.detection import FaceDetector
 from libs.face_recognition.face_recognition import FaceRecognition
-from settings import KAFKA_BROKER, NUM_MAX_THREADS
+from libs.face_recognition.process_pipeline import WorkerDiedError, \
+    detector_processes
+from libs.face_recognition.segments import fail_segment, finish_segment
+from libs.metrics.histogram import StageTimings, registry
+from libs.transport.consumer.offsets import PartitionOffsets
+from libs.transport.publisher.kafka_publisher import publisher
 
+from settings import DETECT_BACKEND, FACE_RECOGNITION_TOPIC, \
+    FACE_STORAGE_FORMAT, KAFKA_BROKER, KAFKA_COMMIT_INTERVAL, \
+    KAFKA_CONSUMER_BATCH_LINGER_MS, KAFKA_CONSUMER_BATCH_SIZE, \
+    KAFKA_DEAD_LETTER_SUFFIX, KAFKA_MAX_IN_FLIGHT, KAFKA_POLL_TIMEOUT_MS, \
+    NUM_MAX_THREADS, RECOGNITION_ENGINE
+
+
+DEAD_LETTERS = registry.counter(
+    "kafka_dead_letter_messages_total",
+    "Failed messages sent to dead letter topic by delivery result",
+    "result"
+)
 
 # temporary logger for consuming process
 root_logger = logging.getLogger()
@@ -24,14 +48,35 @@ handler.setFormatter(formatter)
 root_logger.addHandler(handler)
 
 
+class _RebalanceListener(ConsumerRebalanceListener):
+    """Commits completed offsets of partitions taken by other member."""
+    def __init__(self, consumer):
+        self.consumer = consumer
+
+    def on_partitions_revoked(self, revoked):
+        self.consumer.on_revoked(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+
 class Consumer:
-    """Base consumer."""
+    """
+    Base consumer. Messages are processed in thread pool, every
+    partition has bounded window of messages in flight and only
+    the completed prefix of offsets is committed.
+    """
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
 
     def __init__(
             self, topic, group_id, broker=KAFKA_BROKER,
-            clear_messages=False, threads=8):
+            clear_messages=False, threads=8,
+            max_in_flight=KAFKA_MAX_IN_FLIGHT,
+            commit_interval=KAFKA_COMMIT_INTERVAL,
+            batch_size=KAFKA_CONSUMER_BATCH_SIZE,
+            batch_linger_ms=KAFKA_CONSUMER_BATCH_LINGER_MS,
+            dead_letter_topic=None):
         """
         Sets base parameters, checks num of threads.
         Args:
@@ -39,6 +84,13 @@ class Consumer:
             broker:
             clear_messages:
             threads:
+            max_in_flight (int): max uncommitted messages per partition
+            commit_interval (float): seconds between commits
+            batch_size (int): max messages of on_batch call,
+                0 calls on_message for every message
+            batch_linger_ms (int): max wait for a full batch
+            dead_letter_topic (str | None): topic of failed messages,
+                topic with KAFKA_DEAD_LETTER_SUFFIX by default
         """
         self.consumer = None
         self.topic = topic
@@ -46,12 +98,21 @@ class Consumer:
         self.group_id = group_id
         self.clear_messages = clear_messages
         self.max_workers = threads
+        self.max_in_flight = max_in_flight
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.batch_linger_ms = batch_linger_ms
+        self.dead_letter_topic = \
+            dead_letter_topic or f"{topic}{KAFKA_DEAD_LETTER_SUFFIX}"
 
         if threads > NUM_MAX_THREADS:
             logging.warning(f"Sorry, max threads: {NUM_MAX_THREADS}")
             self.max_workers = NUM_MAX_THREADS
 
         self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._offsets = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
         self.connect()
 
     def activate_listener(self):
@@ -62,21 +123,270 @@ class Consumer:
         """
         try:
             self.subscribe_topic()
-            for message in self.consumer:
-                try:
-                    if not self.clear_messages:
-                        self.pool.submit(self.process, message)
+            last_commit = time.monotonic()
+            batch = []
+            batch_start = None
+            while not self._stop.is_set():
+                timeout_ms = KAFKA_POLL_TIMEOUT_MS
+                if batch:
+                    linger_left = self.batch_linger_ms - (
+                        time.monotonic() - batch_start) * 1000
+                    timeout_ms = max(0, min(timeout_ms, int(linger_left)))
+                records = self.consumer.poll(
+                    timeout_ms=timeout_ms,
+                    max_records=self.batch_size - len(batch)
+                    if self.batch_size else None)
+                for partition, messages in records.items():
+                    try:
+                        taken = self._take(partition, messages)
+                    except Exception as e:
+                        logging.error(f"Unexpected error: {e}")
+                        continue
+                    if self.clear_messages:
+                        self._ack(taken)
+                    elif self.batch_size:
+                        batch_start = batch_start or time.monotonic()
+                        batch.extend(taken)
                     else:
-                        logging.info("Ack")
-                    self.consumer.commit()
-                except Exception as e:
-                    logging.error(f"Unexpected error: {e}")
+                        for offsets, message in taken:
+                            self.pool.submit(self._process, offsets, message)
+                if batch and (
+                        len(batch) >= self.batch_size
+                        or (time.monotonic() - batch_start) * 1000
+                        >= self.batch_linger_ms):
+                    self.pool.submit(self._process_batch, batch)
+                    batch = []
+                    batch_start = None
+                self._update_paused()
+                if time.monotonic() - last_commit >= self.commit_interval:
+                    self.commit()
+                    last_commit = time.monotonic()
+            if batch:
+                self.pool.submit(self._process_batch, batch)
+            self._drain()
         except CommitFailedError:
             logging.error("Commit error, reconnecting to kafka group")
             self._reconnect()
         except Exception as e:
             logging.error(f"Unexpected error: {e}")
 
+    def _take(self, partition, messages):
+        """
+        Takes messages which fit into partition window, the rest
+        is fetched again when window has space.
+        Args:
+            partition (kafka.TopicPartition): partition
+            messages (list): polled messages of partition
+
+        Returns:
+            list: (PartitionOffsets, message) of taken messages
+        """
+        with self._lock:
+            offsets = self._offsets.setdefault(
+                partition, PartitionOffsets())
+            free = max(self.max_in_flight - len(offsets), 0)
+            for message in messages[:free]:
+                offsets.add(message.offset)
+        if len(messages) > free:
+            self.consumer.seek(partition, messages[free].offset)
+        return [(offsets, message) for message in messages[:free]]
+
+    def _ack(self, taken):
+        """
+        Marks taken messages completed.
+        Args:
+            taken (list): (PartitionOffsets, message) pairs
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            for offsets, message in taken:
+                offsets.complete(message.offset)
+
+    def _process(self, offsets, message):
+        """
+        Processes message in pool thread and marks it completed.
+        Args:
+            offsets (PartitionOffsets): offsets of message partition
+            message (kafka.consumer.fetcher.ConsumerRecord): message
+
+        Returns:
+            None:
+        """
+        try:
+            result = self.process(message)
+        except Exception as e:
+            logging.error(f"Unexpected error: {e}")
+            result = False
+        self._complete([(offsets, message)], [result])
+
+    def _process_batch(self, batch):
+        """
+        Processes batch in pool thread and marks it completed.
+        Args:
+            batch (list): (PartitionOffsets, message) pairs
+
+        Returns:
+            None:
+        """
+        try:
+            results = self.process_batch([message for _, message in batch])
+        except Exception as e:
+            logging.error(f"Unexpected error: {e}")
+            results = [False] * len(batch)
+        self._complete(batch, results)
+
+    def _complete(self, taken, results):
+        """
+        Marks handled messages completed. Failed messages are sent to
+        dead letter topic first. Message which hasn't been delivered
+        there isn't completed, committed prefix stops before it, so
+        it's consumed again after restart or rebalance.
+        Args:
+            taken (list): (PartitionOffsets, message) pairs
+            results (list): handler result of every message
+
+        Returns:
+            None:
+        """
+        failed = [
+            message for (_, message), result in zip(taken, results)
+            if not result
+        ]
+        lost = {
+            (message.partition, message.offset)
+            for message in self.dead_letter(failed)
+        }
+        self._ack([
+            (offsets, message) for offsets, message in taken
+            if (message.partition, message.offset) not in lost
+        ])
+
+    def dead_letter(self, messages):
+        """
+        Sends failed messages to dead letter topic and waits for
+        their delivery.
+        Args:
+            messages (list): failed kafka messages
+
+        Returns:
+            list: messages which haven't been delivered
+        """
+        sent, lost = [], []
+        for message in messages:
+            try:
+                sent.append((message, publisher.send_message(
+                    self.dead_letter_topic, **message.value)))
+            except KafkaError as e:
+                self.dead_lettered(message, e)
+                lost.append(message)
+        for message, future in sent:
+            try:
+                future.get()
+                error = None
+            except KafkaError as e:
+                error = e
+            if not self.dead_lettered(message, error):
+                lost.append(message)
+        return lost
+
+    def dead_lettered(self, message, error):
+        """
+        Records dead letter delivery result of message.
+        Args:
+            message (kafka.consumer.fetcher.ConsumerRecord): message
+            error (Exception | None): delivery error
+
+        Returns:
+            bool: True if message has been delivered
+        """
+        if error is None:
+            DEAD_LETTERS.inc("delivered")
+            logging.warning(
+                f"Message {message.partition}:{message.offset} is sent "
+                f"to {self.dead_letter_topic}")
+            return True
+        DEAD_LETTERS.inc("failed")
+        logging.error(
+            f"Message {message.partition}:{message.offset} hasn't been "
+            f"sent to {self.dead_letter_topic}: {error}, it isn't "
+            f"completed and is consumed again after restart")
+        return False
+
+    def _update_paused(self):
+        """
+        Pauses fetching of partitions with full window,
+        resumes the rest.
+        Returns:
+            None:
+        """
+        with self._lock:
+            full = {
+                partition for partition, offsets in self._offsets.items()
+                if len(offsets) >= self.max_in_flight
+            }
+        paused = self.consumer.paused()
+        if full - paused:
+            self.consumer.pause(*(full - paused))
+        if paused - full:
+            self.consumer.resume(*(paused - full))
+
+    def commit(self):
+        """
+        Commits completed offsets prefix of every partition.
+        Returns:
+            None:
+        """
+        with self._lock:
+            positions = {
+                partition: offsets.to_commit()
+                for partition, offsets in self._offsets.items()
+            }
+        positions = {
+            partition: position for partition, position in positions.items()
+            if position is not None
+        }
+        if not positions:
+            return
+        self.consumer.commit({
+            partition: OffsetAndMetadata(position, None)
+            for partition, position in positions.items()
+        })
+        with self._lock:
+            for partition, position in positions.items():
+                if partition in self._offsets:
+                    self._offsets[partition].committed = position
+
+    def on_revoked(self, partitions):
+        """
+        Commits completed offsets before partitions go to other
+        group member, which reprocesses unfinished messages.
+        Args:
+            partitions (list): revoked partitions
+
+        Returns:
+            None:
+        """
+        try:
+            self.commit()
+        except KafkaError as e:
+            logging.error(f"Commit of revoked partitions failed: {e}")
+        with self._lock:
+            for partition in partitions:
+                self._offsets.pop(partition, None)
+
+    def _drain(self):
+        """
+        Waits for messages in flight, commits them and closes consumer.
+        Returns:
+            None:
+        """
+        self.pool.shutdown(wait=True)
+        self.commit()
+        self.consumer.close()
+        logging.info("Consumer is closed")
+
     def _reconnect(self):
         """
         Close consumer, connect again and start listening.
@@ -86,17 +396,19 @@ class Consumer:
         if self.consumer:
             self.consumer.close()
             self.consumer = None
+        with self._lock:
+            self._offsets = {}
         self.connect()
         self.activate_listener()
 
     def stop(self):
         """
-        Closes consuming process.
+        Stops listening, messages in flight are finished and committed
+        before consumer is closed.
         Returns:
             None:
         """
-        self.consumer.close()
-        logging.info("Consumer is closed")
+        self._stop.set()
 
     def subscribe_topic(self):
         """
@@ -104,7 +416,8 @@ class Consumer:
         Returns:
             None:
         """
-        self.consumer.subscribe([self.topic])
+        self.consumer.subscribe(
+            [self.topic], listener=_RebalanceListener(self))
         logging.info("Consumer is listening")
 
     def connect(self):
@@ -129,26 +442,62 @@ class Consumer:
             message (dict): kafka message
 
         Returns:
-            None:
+            bool: on_message result, False fails message
         """
         result = self.on_message(message)
         if result:
             logging.info("ack")
         else:
             logging.info("reject")
+        return result
+
+    def process_batch(self, messages):
+        """
+        Processing of consumed batch.
+        Args:
+            messages (list): kafka messages
+
+        Returns:
+            list: on_batch results, False fails message
+        """
+        results = self.on_batch(messages)
+        acked = sum(1 for result in results if result)
+        logging.info(f"ack {acked}, reject {len(results) - acked}")
+        return results
 
     def on_message(self, message):
         """Empty method for child consumers. Using in self.process()"""
 
+    def on_batch(self, messages):
+        """
+        Handles batch in batch mode, child consumers override it
+        to share round-trips between messages.
+        Args:
+            messages (list): kafka messages
+
+        Returns:
+            list: on_message result of every message
+        """
+        return [self.on_message(message) for message in messages]
+
 
 class VideoUploadConsumer(Consumer):
     """
     A child consumer to get messages about uploaded videos from kafka.
     Uploads video to s3 service, creates db row.
     """
+    def __init__(self, *args, **kwargs):
+        """
+        Connects to kafka and warms up shared producer.
+        """
+        super().__init__(*args, **kwargs)
+        publisher.warm_up([FACE_RECOGNITION_TOPIC])
+
     def on_message(self, message):
         """
-        Uploads video to s3 service, creates db row.
+        Uploads video to s3 service, creates db row. Recognition
+        messages are delivered before message is completed, so its
+        offset isn't committed while they are in producer buffer.
         Args:
             message (dict): message from kafka publisher
 
@@ -156,16 +505,65 @@ class VideoUploadConsumer(Consumer):
             bool: True if file has been uploaded to s3,
                 db row has been created else False
         """
+        futures = self.upload(message)
+        publisher.flush()
+        return futures is not None and self.delivered(futures)
+
+    def on_batch(self, messages):
+        """
+        Starts recognition of batch videos, recognition messages are
+        sent in producer batches and delivered before batch is committed.
+        Args:
+            messages (list): messages from kafka publisher
+
+        Returns:
+            list: True for every message processed successfully
+        """
+        uploads = [self.upload(message) for message in messages]
+        publisher.flush()
+        return [
+            futures is not None and self.delivered(futures)
+            for futures in uploads
+        ]
+
+    @staticmethod
+    def delivered(futures):
+        """
+        Args:
+            futures (list): delivery futures of sent messages,
+                they are done after flush
+
+        Returns:
+            bool: True if all messages have been delivered
+        """
+        return all(future.succeeded() for future in futures)
+
+    def upload(self, message):
+        """
+        Runs after upload events of message video.
+        Args:
+            message (dict): message from kafka publisher
+
+        Returns:
+            list | None: delivery futures of messages sent by events,
+                None if events failed
+        """
         try:
             filepath = message.value.get("filepath")
             file_id = message.value.get("file_id")
+            params = message.value.get("params")
             logging.info(f"Uploading video with id: {file_id}")
 
-            process_after_video_upload_views(file_id, filepath)
-            return True
+            results = process_after_video_upload_views(
+                file_id, filepath, params)
+            return [
+                future for result in results for future in result or []]
         except AssertionError as e:
             logging.error(f"Assertion error: {e}")
-            return False
+            return None
+        except KafkaError as e:
+            logging.error(f"Recognition messages send failed: {e}")
+            return None
 
 
 class FaceRecognitionConsumer(Consumer):
@@ -173,6 +571,50 @@ class FaceRecognitionConsumer(Consumer):
     A child consumer to get messages about videos which needed to
     processing of recognition from kafka.
     """
+    def __init__(self, *args, **kwargs):
+        """
+        Connects to kafka and warms up face detector.
+        """
+        self._jobs = set()
+        self._jobs_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+        # jobs of batch run concurrently, only their rows are batched
+        self._batch_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.warm_up()
+
+    def stop(self):
+        """
+        Stops listening and pauses running jobs, so they are finished
+        with resumable checkpoint before drain timeout kills process.
+        Returns:
+            None:
+        """
+        super().stop()
+        with self._jobs_lock:
+            jobs = list(self._jobs)
+        for face_recognition in jobs:
+            face_recognition.pause()
+        if jobs:
+            logging.info(f"{len(jobs)} running jobs are paused")
+
+    def warm_up(self):
+        """
+        Loads detector classifiers for all detecting threads and
+        starts detector processes of process engine, so the first job
+        doesn't pay load cost.
+        Returns:
+            float: seconds spent
+        """
+        detector = FaceDetector.from_dict(None, backend=DETECT_BACKEND)
+        seconds = detector.warm_up(NUM_MAX_THREADS)
+        if RecognitionEngineEnum(RECOGNITION_ENGINE) == \
+                RecognitionEngineEnum.PROCESS:
+            detector_processes.start()
+        logging.info(
+            f"Face detector {detector.backend.value} is warmed up "
+            f"in {seconds:.3f}s")
+        return seconds
+
     def on_message(self, message):
         """
         Starts process of recognition.
@@ -184,19 +626,13 @@ class FaceRecognitionConsumer(Consumer):
                 db row has been created else False
         """
         try:
-            filepath = message.value.get("filepath")
-            file_id = message.value.get("file_id")
-            face_recognition = FaceRecognition(file_id, filepath)
-            faces_list, names_list = face_recognition.process()
-
-            data = {"faces_list": faces_list, "names_list": names_list}
+            result, row, timings = self.recognize(message)
+            if row is None:
+                return result
 
-            with app.app_context():
-                is_video_added = create_video(
-                    file_id, data, face_recognition.status,
-                    face_recognition.frame_num, face_recognition.persons,
-                    filepath
-                )
+            file_id = row["file_id"]
+            with app.app_context(), timings.time("db"):
+                is_video_added = create_video(**row)
                 if not is_video_added:
                     logging.error(
                         f"File with id {file_id} has not been created in db")
@@ -207,3 +643,171 @@ class FaceRecognitionConsumer(Consumer):
         except AssertionError as e:
             logging.error(f"Assertion error: {e}")
             return False
+
+    def on_batch(self, messages):
+        """
+        Recognizes videos of batch concurrently, as many at once as
+        consumer threads, and creates their db rows in one transaction.
+        Args:
+            messages (list): messages from kafka publisher
+
+        Returns:
+            list: True for every message processed successfully
+        """
+        results = []
+        rows = []
+        written = []
+        recognized = self._batch_pool.map(self._recognize_row, messages)
+        for index, (result, row) in enumerate(recognized):
+            results.append(result)
+            if row is not None:
+                rows.append(row)
+                written.append(index)
+        if not rows:
+            return results
+
+        with app.app_context(), StageTimings().time("db"):
+            added = create_videos(rows)
+        for index, row, is_video_added in zip(written, rows, added):
+            results[index] = is_video_added
+            if not is_video_added:
+                logging.error(
+                    f"File with id {row['file_id']} has not been "
+                    f"created in db")
+        logging.info(f"{sum(added)} files created in db successfully")
+        return results
+
+    def _recognize_row(self, message):
+        """
+        Runs recognition of batch message.
+        Args:
+            message (dict): message from kafka publisher
+
+        Returns:
+            tuple: result and create_video arguments or None
+        """
+        try:
+            result, row, _ = self.recognize(message)
+        except AssertionError as e:
+            logging.error(f"Assertion error: {e}")
+            return False, None
+        return result, row
+
+    def recognize(self, message):
+        """
+        Runs recognition of message video.
+        Args:
+            message (dict): message from kafka publisher
+
+        Returns:
+            tuple: result, create_video arguments or None if there is
+                nothing to write yet, and job timings
+        """
+        filepath = message.value.get("filepath")
+        file_id = message.value.get("file_id")
+        params = message.value.get("params")
+        segment = message.value.get("segment")
+        try:
+            face_recognition = FaceRecognition(
+                file_id, filepath, params=params, segment=segment)
+            faces_list, names_list = self._run_job(face_recognition)
+        except Exception as e:
+            if segment is None and \
+                    not isinstance(e, (ValueError, WorkerDiedError)):
+                raise
+            # e.g. detector backend isn't configured on this consumer
+            # or detector process has died
+            logging.error(f"File id: {file_id} | Recognition failed: {e}")
+            if segment is not None:
+                # failed segment still counts, so video is finished
+                fail_segment(redis_service, file_id, segment, str(e))
+                return self._finish_segment(
+                    file_id, filepath, segment, StageTimings())
+            row = {
+                "file_id": file_id,
+                "data": {"names_list": [], "error": str(e)},
+                "status": FaceRecognitionStatusEnum.FAILED,
+                "frame": 0,
+                "persons": 0,
+                "filepath": filepath,
+            }
+            return True, row, StageTimings()
+        status = face_recognition.status
+        frame = face_recognition.frame_num
+        persons = face_recognition.persons
+        timings = face_recognition.timings
+
+        if status == FaceRecognitionStatusEnum.PAUSE:
+            # state is in redis checkpoint, resume starts new job
+            logging.info(f"File id: {file_id} | Paused, slot released")
+            return True, None, timings
+
+        if segment is not None:
+            return self._finish_segment(
+                file_id, filepath, segment, timings,
+                threshold=face_recognition.threshold)
+
+        row = {
+            "file_id": file_id,
+            "data": {"names_list": names_list},
+            "status": status,
+            "frame": frame,
+            "persons": persons,
+            "filepath": filepath,
+            "faces": pack_faces(faces_list, FACE_STORAGE_FORMAT),
+        }
+        return True, row, timings
+
+    def _run_job(self, face_recognition):
+        """
+        Runs job, it is paused if consumer is stopping.
+        Args:
+            face_recognition (FaceRecognition): job
+
+        Returns:
+            tuple: with list of faces and list of names
+        """
+        with self._jobs_lock:
+            self._jobs.add(face_recognition)
+        if self._stop.is_set():
+            face_recognition.pause()
+        try:
+            return face_recognition.process()
+        finally:
+            with self._jobs_lock:
+                self._jobs.discard(face_recognition)
+
+    @staticmethod
+    def _finish_segment(file_id, filepath, segment, timings, threshold=80):
+        """
+        Marks segment finished, the last finished segment gets
+        merged result of video.
+        Args:
+            file_id (str): file id
+            filepath (str): filepath
+            segment (dict): finished segment
+            timings (StageTimings): job timings
+            threshold (int): LBPH confidence threshold
+
+        Returns:
+            tuple: result, create_video arguments or None if some
+                segments are still processing, and job timings
+        """
+        merged = finish_segment(
+            redis_service, file_id, segment, threshold=threshold)
+        if merged is None:
+            logging.info(
+                f"File id: {file_id} | Segment "
+                f"{segment['index'] + 1}/{segment['count']} done")
+            return True, None, timings
+
+        row = {
+            "file_id": file_id,
+            "data": {"names_list": merged["names_list"]},
+            "status": merged["status"],
+            "frame": merged["frame"],
+            "persons": merged["persons"],
+            "filepath": filepath,
+            "faces": pack_faces(merged["faces_list"], FACE_STORAGE_FORMAT),
+        }
+        return True, row, timings
@@ -0,0 +1,56 @@
+import collections
+
+
+class PartitionOffsets:
+    """
+    Offsets of one partition taken for processing. Messages complete
+    in any order, only the contiguous prefix of completed offsets
+    is committable, so a crash never loses an unfinished message.
+    Not thread safe, consumer guards it with its lock.
+    """
+    def __init__(self):
+        self._received = collections.deque()
+        self._completed = set()
+        self.position = None
+        self.committed = None
+
+    def __len__(self):
+        """Number of received offsets which aren't committable yet."""
+        return len(self._received)
+
+    def to_commit(self):
+        """
+        Returns:
+            int | None: position to commit, None if it's committed
+        """
+        if self.position is None or self.position == self.committed:
+            return None
+        return self.position
+
+    def add(self, offset):
+        """
+        Args:
+            offset (int): offset taken for processing, offsets are
+                added in partition order
+
+        Returns:
+            None:
+        """
+        self._received.append(offset)
+
+    def complete(self, offset):
+        """
+        Marks offset as processed and moves committable position
+        over completed prefix.
+        Args:
+            offset (int): processed offset
+
+        Returns:
+            None:
+        """
+        self._completed.add(offset)
+        while self._received and self._received[0] in self._completed:
+            head = self._received.popleft()
+            self._completed.discard(head)
+            # kafka commits offset of the next message to read
+            self.position = head + 1
@@ -0,0 +1,245 @@
+import collections
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import urllib.request
+
+from libs.metrics.aggregate import merge
+from libs.metrics.histogram import registry
+from libs.metrics.server import start_metrics_server
+
+from settings import SUPERVISOR_DRAIN_TIMEOUT, SUPERVISOR_MAX_RESTARTS, \
+    SUPERVISOR_RESTART_BACKOFF, SUPERVISOR_RESTART_BACKOFF_MAX, \
+    SUPERVISOR_RESTART_WINDOW
+
+
+RESTARTS = registry.counter(
+    "consumer_worker_restarts_total",
+    "Consumer worker processes restarted after exit",
+    "worker"
+)
+
+
+def consume(create_consumer, metrics_port=0, metrics_host="0.0.0.0"):
+    """
+    Runs consumer in current process until SIGTERM or SIGINT,
+    which stop it gracefully: messages in flight are finished
+    and committed.
+    Args:
+        create_consumer (collections.abc.Callable): returns Consumer
+        metrics_port (int): prometheus metrics port, 0 disables metrics
+        metrics_host (str): metrics host
+
+    Returns:
+        None:
+    """
+    start_metrics_server(metrics_port, metrics_host)
+    consumer = create_consumer()
+
+    def stop(signum, frame):
+        logging.info(f"Signal {signum}, draining consumer")
+        consumer.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    consumer.activate_listener()
+
+
+class ConsumerSupervisor:
+    """
+    Runs several consumer processes of the same kafka group,
+    restarts exited ones with exponential backoff and passes SIGTERM
+    to them. Worker which keeps exiting isn't restarted anymore.
+    Metrics of workers are served together on supervisor port with
+    worker label.
+    """
+    def __init__(
+            self, create_consumer, workers, metrics_port=0,
+            drain_timeout=SUPERVISOR_DRAIN_TIMEOUT,
+            restart_backoff=SUPERVISOR_RESTART_BACKOFF,
+            restart_backoff_max=SUPERVISOR_RESTART_BACKOFF_MAX,
+            max_restarts=SUPERVISOR_MAX_RESTARTS,
+            restart_window=SUPERVISOR_RESTART_WINDOW):
+        """
+        Sets supervisor parameters.
+        Args:
+            create_consumer (collections.abc.Callable): returns Consumer,
+                it's pickled to worker processes
+            workers (int): number of worker processes
+            metrics_port (int): prometheus metrics port, workers use
+                the next ports on localhost, 0 disables metrics
+            drain_timeout (float): seconds workers have to finish
+                messages in flight after SIGTERM
+            restart_backoff (float): delay of the first restart,
+                it doubles with every restart within restart_window
+            restart_backoff_max (float): max delay of restart
+            max_restarts (int): restarts within restart_window,
+                worker isn't restarted after them
+            restart_window (float): seconds restarts are counted in
+        """
+        self.create_consumer = create_consumer
+        self.workers = workers
+        self.metrics_port = metrics_port
+        self.drain_timeout = drain_timeout
+        self.restart_backoff = restart_backoff
+        self.restart_backoff_max = restart_backoff_max
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.processes = [None] * workers
+        self.restarts = [0] * workers
+        self.given_up = [False] * workers
+        self._restart_times = [collections.deque() for _ in range(workers)]
+        self._restart_at = [None] * workers
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = threading.Event()
+
+    def worker_port(self, index):
+        """
+        Args:
+            index (int): worker index
+
+        Returns:
+            int: metrics port of worker, 0 if metrics are disabled
+        """
+        return self.metrics_port + 1 + index if self.metrics_port else 0
+
+    def run(self):
+        """
+        Starts workers and supervises them until SIGTERM or SIGINT.
+        Returns:
+            None:
+        """
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        for index in range(self.workers):
+            self._start(index)
+        start_metrics_server(
+            self.metrics_port, render=self.render, health=self.health)
+
+        while not self._stop.wait(1):
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if self.given_up[index] or process.is_alive():
+                    continue
+                if self._restart_at[index] is None:
+                    self._schedule_restart(index, now)
+                elif now >= self._restart_at[index]:
+                    self._restart_at[index] = None
+                    self.restarts[index] += 1
+                    RESTARTS.inc(str(index))
+                    self._start(index)
+            if all(self.given_up):
+                logging.error("All consumer workers are given up")
+                self._stop.set()
+        self._shutdown()
+
+    def _schedule_restart(self, index, now):
+        """
+        Sets restart time of exited worker, delay doubles with every
+        restart within window. Worker is given up after max_restarts.
+        Args:
+            index (int): worker index
+            now (float): monotonic time
+
+        Returns:
+            None:
+        """
+        exitcode = self.processes[index].exitcode
+        recent = self._restart_times[index]
+        while recent and now - recent[0] > self.restart_window:
+            recent.popleft()
+        if len(recent) >= self.max_restarts:
+            logging.error(
+                f"Consumer worker {index} exited with code {exitcode}, "
+                f"it has been restarted {len(recent)} times in "
+                f"{self.restart_window}s, giving up")
+            self.given_up[index] = True
+            return
+
+        delay = min(
+            self.restart_backoff * 2 ** len(recent),
+            self.restart_backoff_max)
+        recent.append(now)
+        self._restart_at[index] = now + delay
+        logging.error(
+            f"Consumer worker {index} exited with code {exitcode}, "
+            f"restarting in {delay:.1f}s")
+
+    def _on_signal(self, signum, frame):
+        logging.info(f"Signal {signum}, stopping consumer workers")
+        self._stop.set()
+
+    def _start(self, index):
+        """
+        Starts worker process.
+        Args:
+            index (int): worker index
+
+        Returns:
+            None:
+        """
+        process = self._context.Process(
+            target=consume,
+            args=(self.create_consumer, self.worker_port(index),
+                  "127.0.0.1"),
+            name=f"consumer-{index}")
+        process.start()
+        self.processes[index] = process
+        logging.info(f"Consumer worker {index} started, pid {process.pid}")
+
+    def _shutdown(self):
+        """
+        Sends SIGTERM to workers, kills ones which don't finish
+        in drain_timeout. Workers pause running recognition jobs on
+        SIGTERM, so killed ones leave resumable checkpoints.
+        Returns:
+            None:
+        """
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        for index, process in enumerate(self.processes):
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning(
+                    f"Consumer worker {index} hasn't drained, killing it")
+                process.kill()
+                process.join()
+        logging.info("Consumer workers are stopped")
+
+    def render(self):
+        """
+        Returns:
+            str: metrics of all workers and supervisor
+        """
+        texts = {}
+        for index in range(self.workers):
+            url = f"http://127.0.0.1:{self.worker_port(index)}/metrics"
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    texts[str(index)] = response.read().decode("utf-8")
+            except OSError as e:
+                logging.warning(f"Metrics of worker {index} failed: {e}")
+        return merge(texts) + RESTARTS.render()
+
+    def health(self):
+        """
+        Returns:
+            tuple: True if all workers are alive, details of workers
+        """
+        workers = [
+            {
+                "worker": index,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "restarts": self.restarts[index],
+                "given_up": self.given_up[index],
+            }
+            for index, process in enumerate(self.processes)
+        ]
+        healthy = not self._stop.is_set() and all(
+            worker["alive"] for worker in workers)
+        return healthy, {"healthy": healthy, "workers": workers}
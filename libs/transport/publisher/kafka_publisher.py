@@ -1,37 +1,190 @@
+import asyncio
+import atexit
 import json
+import logging
+import os
+import threading
 
 from kafka import KafkaProducer
+from kafka.errors import KafkaError
+
+from libs.metrics.histogram import registry
+
+from settings import KAFKA_ACKS, KAFKA_BATCH_SIZE, KAFKA_BROKER, \
+    KAFKA_BUFFER_MEMORY, KAFKA_COMPRESSION, KAFKA_LINGER_MS, \
+    KAFKA_MAX_BLOCK_MS
+
+
+MESSAGES = registry.counter(
+    "kafka_published_messages_total",
+    "Messages published to kafka by delivery result",
+    "result"
+)
 
 
 class KafkaPublisher:
-    def __init__(self):
+    """
+    Long-lived kafka producer shared by the process. Messages are
+    batched by producer io thread and delivered asynchronously,
+    send only blocks when send buffer is full.
+    """
+    def __init__(
+            self, broker=KAFKA_BROKER, acks=KAFKA_ACKS,
+            linger_ms=KAFKA_LINGER_MS, batch_size=KAFKA_BATCH_SIZE,
+            compression_type=KAFKA_COMPRESSION,
+            buffer_memory=KAFKA_BUFFER_MEMORY,
+            max_block_ms=KAFKA_MAX_BLOCK_MS):
+        """
+        Sets producer parameters, producer connects on warm_up
+        or on the first send.
+        Args:
+            broker (str): kafka bootstrap servers
+            acks (str | int): "0", "1" or "all"
+            linger_ms (int): time to wait for more messages of batch
+            batch_size (int): max batch bytes per partition
+            compression_type (str): gzip, snappy, lz4, zstd or empty
+            buffer_memory (int): bytes of unsent messages
+            max_block_ms (int): time send waits for free buffer
+        """
+        self.config = {
+            "bootstrap_servers": broker,
+            "acks": acks if acks == "all" else int(acks),
+            "linger_ms": linger_ms,
+            "batch_size": batch_size,
+            "compression_type": compression_type or None,
+            "buffer_memory": buffer_memory,
+            "max_block_ms": max_block_ms,
+        }
         self.producer = None
-        self.connect()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Connects producer if it isn't connected in this process.
+        Producer io thread doesn't survive fork, so forked process
+        creates own producer.
+        Returns:
+            KafkaProducer: producer
+        """
+        with self._lock:
+            if self.producer is None or self._pid != os.getpid():
+                self.producer = KafkaProducer(
+                    value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+                    retries=3,
+                    api_version=(2, 1, 0),
+                    **self.config
+                )
+                self._pid = os.getpid()
+            return self.producer
+
+    def warm_up(self, topics):
+        """
+        Connects producer and fetches metadata of topics at startup,
+        so the first send doesn't wait for them.
+        Args:
+            topics (list): topics messages are sent to
+
+        Returns:
+            None:
+        """
+        try:
+            producer = self.start()
+            for topic in topics:
+                producer.partitions_for(topic)
+        except KafkaError as e:
+            logging.warning(f"Kafka producer hasn't been warmed up: {e}")
 
     def send_message(self, topic, **kwargs):
-        if self.producer:
-            future = self.producer.send(topic, kwargs)
-            future.get(timeout=60)
-            self.producer.flush()
-        else:
-            self.connect()
-
-    def connect(self):
-        self.producer = KafkaProducer(
-            bootstrap_servers="kafka:9092",
-            value_serializer=lambda v: json.dumps(v).encode("utf-8"),
-            acks=0,
-            retries=3,
-            api_version=(2, 1, 0)
-        )
-
-    def _reconnect(self):
-        if self.producer:
-            self.producer.close()
-            self.producer = None
-        self.connect()
+        """
+        Queues message, delivery result is logged by callbacks.
+        Args:
+            topic (str): kafka topic
+            **kwargs: message
+
+        Returns:
+            kafka.producer.future.FutureRecordMetadata: delivery future
+
+        Raises:
+            KafkaTimeoutError: send buffer is full for max_block_ms
+        """
+        future = self.start().send(topic, kwargs)
+        future.add_callback(self._on_delivered)
+        future.add_errback(self._on_failed, topic)
+        return future
+
+    async def send_message_async(self, topic, **kwargs):
+        """
+        Queues message and waits for its delivery without blocking
+        event loop, delivery result comes from producer io thread.
+        Args:
+            topic (str): kafka topic
+            **kwargs: message
 
-    def close(self):
-        if self.producer:
-            self.producer.close()
+        Returns:
+            kafka.producer.future.RecordMetadata: delivered message
+
+        Raises:
+            KafkaError: message hasn't been delivered
+            KafkaTimeoutError: send buffer is full for max_block_ms,
+                send blocks event loop meanwhile
+        """
+        loop = asyncio.get_running_loop()
+        delivered = loop.create_future()
+
+        def resolve(set_result, value):
+            if not delivered.done():
+                set_result(value)
+
+        future = self.send_message(topic, **kwargs)
+        future.add_callback(
+            lambda metadata: loop.call_soon_threadsafe(
+                resolve, delivered.set_result, metadata))
+        future.add_errback(
+            lambda error: loop.call_soon_threadsafe(
+                resolve, delivered.set_exception, error))
+        return await delivered
+
+    @staticmethod
+    def _on_delivered(metadata):
+        MESSAGES.inc("delivered")
+
+    @staticmethod
+    def _on_failed(topic, error):
+        MESSAGES.inc("failed")
+        logging.error(f"Message to {topic} has not been delivered: {error}")
+
+    def flush(self, timeout=None):
+        """
+        Waits for delivery of queued messages.
+        Args:
+            timeout (float | None): seconds to wait
+
+        Returns:
+            None:
+        """
+        if self.producer is not None and self._pid == os.getpid():
+            self.producer.flush(timeout)
+
+    def close(self, timeout=10):
+        """
+        Delivers queued messages and closes producer.
+        Args:
+            timeout (float): seconds to wait for delivery
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            if self.producer is None:
+                return
+            if self._pid == os.getpid():
+                try:
+                    self.producer.close(timeout)
+                except KafkaError as e:
+                    logging.error(f"Kafka producer close failed: {e}")
             self.producer = None
+
+
+publisher = KafkaPublisher()
+atexit.register(publisher.close)
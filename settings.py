@@ -41,6 +41,10 @@ PORT = _config.get("app", "port", fallback=5000)
 SECRET_KEY = _config.get("app", "secret_key", fallback="No secret key")
 DEBUG = _config.getboolean("app", "debug", fallback=False)
 NUM_MAX_THREADS = _config.getint("app", "num_max_threads", fallback=8)
+RECOGNITION_ENGINE = _config.get(
+    "app", "recognition_engine", fallback="thread")
+UPLOAD_PENDING_TTL = _config.getint(
+    "app", "upload_pending_ttl", fallback=3600)
 SWAGGER_FILENAME = "swagger-spec.yaml"
 ACCESS_CONTROL_ALLOW_CREDENTIALS = True
 ALLOWED_VIDEO_EXTENSIONS = ("mp4", "mov", "wmv", "avi", "flv", "mkv")
@@ -88,6 +92,227 @@ FACE_RECOGNITION_TOPIC = _config.get(
     "face_recognition_topic",
     fallback="face_recognition_topic"
 )
+# "0", "1" or "all"
+KAFKA_ACKS = _config.get(
+    "kafka",
+    "acks",
+    fallback="1"
+)
+KAFKA_LINGER_MS = _config.getint(
+    "kafka",
+    "linger_ms",
+    fallback=5
+)
+KAFKA_BATCH_SIZE = _config.getint(
+    "kafka",
+    "batch_size",
+    fallback=16384
+)
+# gzip, snappy, lz4, zstd, empty for no compression
+KAFKA_COMPRESSION = _config.get(
+    "kafka",
+    "compression_type",
+    fallback=""
+)
+KAFKA_BUFFER_MEMORY = _config.getint(
+    "kafka",
+    "buffer_memory",
+    fallback=33554432
+)
+KAFKA_MAX_BLOCK_MS = _config.getint(
+    "kafka",
+    "max_block_ms",
+    fallback=5000
+)
+KAFKA_MAX_IN_FLIGHT = _config.getint(
+    "kafka",
+    "max_in_flight",
+    fallback=16
+)
+KAFKA_COMMIT_INTERVAL = _config.getfloat(
+    "kafka",
+    "commit_interval",
+    fallback=1.0
+)
+KAFKA_POLL_TIMEOUT_MS = _config.getint(
+    "kafka",
+    "poll_timeout_ms",
+    fallback=500
+)
+KAFKA_DEAD_LETTER_SUFFIX = _config.get(
+    "kafka",
+    "dead_letter_suffix",
+    fallback="_dead_letter"
+)
+# messages handled by one on_batch call, 0 handles messages one by one
+KAFKA_CONSUMER_BATCH_SIZE = _config.getint(
+    "kafka",
+    "consumer_batch_size",
+    fallback=0
+)
+KAFKA_CONSUMER_BATCH_LINGER_MS = _config.getint(
+    "kafka",
+    "consumer_batch_linger_ms",
+    fallback=100
+)
+# asyncio runtime: messages handled concurrently, threads for blocking io
+KAFKA_ASYNC_CONCURRENCY = _config.getint(
+    "kafka",
+    "async_concurrency",
+    fallback=1000
+)
+KAFKA_ASYNC_IO_WORKERS = _config.getint(
+    "kafka",
+    "async_io_workers",
+    fallback=32
+)
+
+# face recognition
+DECODE_QUEUE_SIZE = _config.getint(
+    "face_recognition",
+    "decode_queue_size",
+    fallback=16
+)
+MATCH_QUEUE_SIZE = _config.getint(
+    "face_recognition",
+    "match_queue_size",
+    fallback=16
+)
+MOTION_THRESHOLD = _config.getfloat(
+    "face_recognition",
+    "motion_threshold",
+    fallback=0.002
+)
+MOTION_THUMB_WIDTH = _config.getint(
+    "face_recognition",
+    "motion_thumb_width",
+    fallback=160
+)
+DETECT_HEIGHT = _config.getint(
+    "face_recognition",
+    "detect_height",
+    fallback=0
+)
+RING_SLOTS = _config.getint(
+    "face_recognition",
+    "ring_slots",
+    fallback=16
+)
+CHECKPOINT_INTERVAL = _config.getfloat(
+    "face_recognition",
+    "checkpoint_interval",
+    fallback=1.0
+)
+CHECKPOINT_FRAMES = _config.getint(
+    "face_recognition",
+    "checkpoint_frames",
+    fallback=250
+)
+FACE_STORAGE_FORMAT = _config.get(
+    "face_recognition",
+    "face_storage_format",
+    fallback="png"
+)
+TRACK_MIN_IOU = _config.getfloat(
+    "face_recognition",
+    "track_min_iou",
+    fallback=0.3
+)
+TRACK_MAX_GAP = _config.getint(
+    "face_recognition",
+    "track_max_gap",
+    fallback=25
+)
+TRACK_REVALIDATE = _config.getint(
+    "face_recognition",
+    "track_revalidate",
+    fallback=125
+)
+SEGMENT_COUNT = _config.getint(
+    "face_recognition",
+    "segment_count",
+    fallback=1
+)
+PROGRESS_INTERVAL = _config.getfloat(
+    "face_recognition",
+    "progress_interval",
+    fallback=0.5
+)
+PROGRESS_MAXLEN = _config.getint(
+    "face_recognition",
+    "progress_maxlen",
+    fallback=100
+)
+DETECT_BACKEND = _config.get(
+    "face_recognition",
+    "detect_backend",
+    fallback="haar"
+)
+LBP_CASCADE = _config.get(
+    "face_recognition",
+    "lbp_cascade",
+    fallback="/usr/share/opencv4/lbpcascades/"
+             "lbpcascade_frontalface_improved.xml"
+)
+DNN_MODEL = _config.get(
+    "face_recognition",
+    "dnn_model",
+    fallback=""
+)
+DNN_CONFIG = _config.get(
+    "face_recognition",
+    "dnn_config",
+    fallback=""
+)
+DNN_CONFIDENCE = _config.getfloat(
+    "face_recognition",
+    "dnn_confidence",
+    fallback=0.5
+)
+DNN_INPUT_SIZE = _config.getint(
+    "face_recognition",
+    "dnn_input_size",
+    fallback=300
+)
+DNN_BATCH_SIZE = _config.getint(
+    "face_recognition",
+    "dnn_batch_size",
+    fallback=4
+)
+
+# metrics
+METRICS_PORT = _config.getint(
+    "metrics",
+    "port",
+    fallback=0
+)
+
+# supervisor
+SUPERVISOR_DRAIN_TIMEOUT = _config.getfloat(
+    "supervisor",
+    "drain_timeout",
+    fallback=60.0
+)
+SUPERVISOR_RESTART_BACKOFF = _config.getfloat(
+    "supervisor",
+    "restart_backoff",
+    fallback=1.0
+)
+SUPERVISOR_RESTART_BACKOFF_MAX = _config.getfloat(
+    "supervisor",
+    "restart_backoff_max",
+    fallback=60.0
+)
+SUPERVISOR_MAX_RESTARTS = _config.getint(
+    "supervisor",
+    "max_restarts",
+    fallback=5
+)
+SUPERVISOR_RESTART_WINDOW = _config.getfloat(
+    "supervisor",
+    "restart_window",
+    fallback=600.0
+)
 
 # redis
 REDIS_HOST = _config.get(